@@ -0,0 +1,109 @@
+"""rollup_analytics on a seeded database with a year of messages.
+
+Seeds a temporary SQLite database with COMPANIES companies and MESSAGES
+messages spread over the last 365 days, then times
+``rollup_daily_analytics`` over the whole year. For comparison it times
+``Analytics.update_daily_analytics`` (which can only do "today") for a
+sample of companies and extrapolates it to every company-day.
+
+    python benchmarks/bench_analytics_rollup.py [messages] [companies]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import warnings
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "web"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "web.settings")
+
+import django
+from django.conf import settings
+
+settings.DATABASES["default"]["NAME"] = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from admin_panel.analytics import rollup_daily_analytics
+from admin_panel.models import Analytics
+from users.models import Client, Company
+
+CLIENTS_PER_COMPANY = 20
+DAYS = 365
+SAMPLE_COMPANIES = 20
+
+
+def seed(messages, companies):
+    rng = random.Random(1)
+    now = timezone.now()
+    Company.objects.bulk_create(Company(name=f"Company {i}") for i in range(companies))
+    company_ids = list(Company._base_manager.values_list("id", flat=True))
+    Client.objects.bulk_create(
+        Client(company_id=company_id, name=f"Client {n}", telegram_id=n)
+        for company_id in company_ids for n in range(CLIENTS_PER_COMPANY)
+    )
+    clients = list(Client.objects.values_list("id", "company_id"))
+    # Spread creation over the year so total/new users vary per day
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            "UPDATE users_client SET created_at = %s WHERE id = %s",
+            [(now - timedelta(days=rng.randrange(DAYS)), client_id) for client_id, _ in clients],
+        )
+
+    # auto_now_add would overwrite timestamps in bulk_create, so insert directly
+    sql = (
+        "INSERT INTO admin_panel_message (content, timestamp, company_id, user_id, response_time, is_bot_response) "
+        "VALUES (%s, %s, %s, %s, %s, %s)"
+    )
+    batch = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for i in range(messages // 2):
+            client_id, company_id = clients[rng.randrange(len(clients))]
+            asked = now - timedelta(seconds=rng.randrange(DAYS * 86400))
+            answered = asked + timedelta(milliseconds=rng.randrange(500, 8000))
+            batch.append(("Вопрос", asked, company_id, client_id, None, False))
+            batch.append(("Ответ", answered, company_id, client_id, (answered - asked) // timedelta(microseconds=1), True))
+            if len(batch) >= 20_000:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+    return company_ids
+
+
+def main():
+    # update_daily_analytics filters with naive midnights
+    warnings.simplefilter("ignore", RuntimeWarning)
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    companies = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    call_command("migrate", verbosity=0)
+
+    started = time.perf_counter()
+    company_ids = seed(messages, companies)
+    print(f"seeded {messages} messages, {companies} companies in {time.perf_counter() - started:.1f}s")
+
+    today = timezone.localdate()
+    start = today - timedelta(days=DAYS)
+    started = time.perf_counter()
+    with CaptureQueriesContext(connection) as queries:
+        rows = rollup_daily_analytics(start, today)
+    rollup = time.perf_counter() - started
+    print(f"rollup: {rows} rows for {DAYS + 1} days in {rollup:.1f}s, {len(queries)} queries")
+
+    started = time.perf_counter()
+    for company_id in company_ids[:SAMPLE_COMPANIES]:
+        Analytics.update_daily_analytics(Company._base_manager.get(pk=company_id))
+    per_company_day = (time.perf_counter() - started) / SAMPLE_COMPANIES
+    print(f"update_daily_analytics: {per_company_day * 1000:.1f} ms per company-day, "
+          f"~{per_company_day * rows:.0f}s for the same {rows} rows")
+
+
+if __name__ == "__main__":
+    main()
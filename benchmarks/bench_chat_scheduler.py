@@ -0,0 +1,78 @@
+"""Update throughput through the durable queue with per-chat ordering.
+
+Every update is enqueued, claimed and handled by a fake handler that waits
+like an LLM call would. "serial" is one update at a time (measured on 100
+chats, it does not depend on the chat count), "per-chat" is ``QueueWorkers``
+(ordered per chat, parallel across chats). The handler also checks that no
+chat ever has two updates in progress or sees them out of order; "lanes" is
+the number of chat lanes alive at the end, before idle eviction.
+
+    python benchmarks/bench_chat_scheduler.py [handler_ms] [concurrency]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from work_queue import QueueWorkers, WorkQueue
+
+UPDATES_PER_CHAT = 5
+
+
+async def run(chats, concurrency, handler_delay):
+    path = os.path.join(tempfile.mkdtemp(), "queue.sqlite3")
+    queue = WorkQueue(path)
+    await queue.open()
+    total = chats * UPDATES_PER_CHAT
+    last_seen = {}
+    active = set()
+    violations = 0
+    handled = 0
+    done = asyncio.Event()
+
+    async def handler(update):
+        nonlocal violations, handled
+        chat = update.payload["message"]["chat"]["id"]
+        seq = update.payload["update_id"]
+        if chat in active or last_seen.get(chat, -1) > seq:
+            violations += 1
+        active.add(chat)
+        await asyncio.sleep(handler_delay)
+        last_seen[chat] = seq
+        active.discard(chat)
+        handled += 1
+        if handled == total:
+            done.set()
+
+    for seq in range(UPDATES_PER_CHAT):
+        for chat in range(chats):
+            await queue.enqueue("bench", {"update_id": seq * chats + chat, "message": {"chat": {"id": chat}}})
+
+    workers = QueueWorkers(queue, handler, concurrency=concurrency, poll_interval=0.05)
+    started = time.perf_counter()
+    workers.start()
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    lanes = workers.stats()["lanes"]
+    await workers.stop()
+    await queue.close()
+    return total / elapsed, violations, lanes
+
+
+def main():
+    handler_delay = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.02
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    print(f"handler {handler_delay * 1000:.0f} ms, {UPDATES_PER_CHAT} updates per chat")
+    print(f"{'chats':>7} {'serial upd/s':>13} {'per-chat upd/s':>15} {'order violations':>17} {'lanes':>6}")
+    for chats in (100, 1000, 5000):
+        serial, _, _ = asyncio.run(run(min(chats, 100), 1, handler_delay))
+        parallel, violations, lanes = asyncio.run(run(chats, concurrency, handler_delay))
+        print(f"{chats:>7} {serial:>13.1f} {parallel:>15.1f} {violations:>17} {lanes:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Semantic FAQ lookup latency by FAQ count.
+
+Builds a company index of N generated FAQ questions with the configured
+embedder (EMBEDDING_MODEL, or the hashing embedder) and times
+``FAQCache.lookup`` for rephrased questions (hits) and unrelated ones
+(misses). The index is built before timing, as it is once per config
+version in the webhook.
+
+    python benchmarks/bench_faq_cache.py [lookups]
+"""
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import faq_cache
+from faq_cache import FAQCache
+
+SERVICES = ["массаж", "бассейн", "тренажерный зал", "йога", "пилатес", "сауна", "консультация диетолога",
+            "персональная тренировка", "растяжка", "бокс"]
+TEMPLATES = ["Сколько стоит {}?", "Как записаться на {}?", "Есть ли скидки на {}?", "Во сколько открывается {}?",
+             "Можно ли отменить {}?", "Нужна ли справка на {}?", "Сколько длится {}?", "Есть ли {} для детей?"]
+
+
+def make_faqs(count):
+    rng = random.Random(1)
+    faqs = []
+    for i in range(count):
+        service = f"{rng.choice(SERVICES)} {i // (len(SERVICES) * len(TEMPLATES))}"
+        question = TEMPLATES[i % len(TEMPLATES)].format(service)
+        faqs.append((question, f"Ответ на вопрос {i}"))
+    return faqs
+
+
+async def bench(faq_count, lookups):
+    faqs = make_faqs(faq_count)
+
+    async def run_db(func, company_id):
+        return faqs
+
+    cache = FAQCache(run_db)
+    started = time.perf_counter()
+    await cache.lookup(1, 1, "прогрев")
+    build = time.perf_counter() - started
+
+    rng = random.Random(2)
+    timings = {"hit": [], "miss": []}
+    hits = 0
+    for i in range(lookups):
+        if i % 2:
+            question, _ = rng.choice(faqs)
+            text, kind = question.lower().rstrip("?"), "hit"
+        else:
+            text, kind = f"Когда моя запись номер {i}?", "miss"
+        started = time.perf_counter()
+        answer = await cache.lookup(1, 1, text)
+        timings[kind].append(time.perf_counter() - started)
+        hits += answer is not None and kind == "hit"
+    return cache.embedder.method, build, timings, hits / (lookups // 2)
+
+
+def main():
+    lookups = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"{'faqs':>6} {'build ms':>9} {'hit p50 ms':>11} {'miss p50 ms':>12} {'recall':>7}")
+    for faq_count in (10, 100, 1000):
+        method, build, timings, recall = asyncio.run(bench(faq_count, lookups))
+        print(f"{faq_count:>6} {build * 1000:>9.1f} {statistics.median(timings['hit']) * 1000:>11.3f} "
+              f"{statistics.median(timings['miss']) * 1000:>12.3f} {recall:>7.2f}")
+    print(f"embedder: {method}, threshold: {faq_cache.FAQ_CACHE_THRESHOLD or 'embedder default'}")
+
+
+if __name__ == "__main__":
+    main()
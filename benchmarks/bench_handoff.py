@@ -0,0 +1,72 @@
+"""Handoff detection latency: substring loop vs the compiled matcher.
+
+Times the previous ``should_handoff`` (lowercase the reply, then one
+substring search per trigger and uncertainty phrase) against
+``HandoffMatcher.match`` for replies that contain no trigger (the common
+case, and the worst one since the whole reply is scanned) over growing
+reply lengths and trigger lists. Compiling a matcher is timed too; it
+happens once per company config version.
+
+    python benchmarks/bench_handoff.py [repeats]
+"""
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from handoff import UNCERTAINTY_PHRASES, HandoffMatcher
+
+WORDS = ("абонемент стоит тенге месяц запись тренер бассейн массаж утро вечер скидка "
+         "филиал адрес часы работы оплата картой наличными можно нужно будет").split()
+
+
+def legacy_should_handoff(reply, handoff_triggers):
+    reply_lower = reply.lower()
+    for trigger in handoff_triggers:
+        if trigger.lower() in reply_lower:
+            return True
+    for phrase in UNCERTAINTY_PHRASES:
+        if phrase in reply_lower:
+            return True
+    return len(reply.strip()) < 10 and any(word in reply_lower for word in ["извините", "понимаю", "попробуйте"])
+
+
+def make_triggers(count, rng):
+    # Two-word Cyrillic phrases that never occur in the replies
+    syllables = "ба ве гу до жи зо ки лу ме но пы ру со ту фа хи це чу ша щю".split()
+    return ["".join(rng.choice(syllables) for _ in range(3)) + " " + "".join(rng.choice(syllables) for _ in range(3))
+            for _ in range(count)]
+
+
+def per_call(func, reply, repeats):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        func(reply)
+    return (time.perf_counter() - started) / repeats
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rng = random.Random(1)
+    print(f"{'triggers':>9} {'reply chars':>12} {'compile ms':>11} {'loop us':>9} {'matcher us':>11} {'speedup':>8}")
+    for trigger_count in (5, 100, 1000):
+        triggers = make_triggers(trigger_count, rng)
+        started = time.perf_counter()
+        matcher = HandoffMatcher(triggers)
+        compile_time = time.perf_counter() - started
+        for length in (200, 2000, 20000):
+            reply = ""
+            while len(reply) < length:
+                reply += rng.choice(WORDS).capitalize() + " "
+            assert not legacy_should_handoff(reply, triggers) and matcher.match(reply) is None
+            loop = per_call(lambda text: legacy_should_handoff(text, triggers), reply, repeats)
+            compiled = per_call(matcher.match, reply, repeats)
+            print(f"{trigger_count:>9} {len(reply):>12} {compile_time * 1000:>11.2f} {loop * 1e6:>9.1f} "
+                  f"{compiled * 1e6:>11.1f} {loop / compiled:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
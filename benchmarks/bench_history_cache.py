@@ -0,0 +1,76 @@
+"""get_history latency with and without the history cache.
+
+Seeds CHATS conversations with a few exchanges each, then replays
+``get_history`` + ``save_exchange`` rounds against them. "database" clears
+the cache before every read (the previous behaviour: one query per update),
+"cache" leaves it on so only the first read of each chat goes to SQLite.
+
+    python benchmarks/bench_history_cache.py [chats] [rounds]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "web"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "web.settings")
+
+import django
+from django.conf import settings
+
+settings.DATABASES["default"]["NAME"] = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+django.setup()
+
+from django.core.management import call_command
+
+import repository
+from history_cache import HistoryCache
+from users.models import Company
+
+
+async def replay(company, clients, rounds, cached):
+    timings = []
+    for _ in range(rounds):
+        for client in clients:
+            if not cached:
+                repository.history_cache.invalidate((company.pk, client.pk))
+            started = time.perf_counter()
+            await repository.get_history(company, client)
+            timings.append(time.perf_counter() - started)
+            await repository.save_exchange(company, client, "Сколько стоит прием?", "Прием стоит 5000 тенге.")
+    return timings
+
+
+async def bench(chats, rounds):
+    company = await repository.run_db(Company.objects.create, name="Bench", telegram_token="bench")
+    clients = [
+        await repository.get_or_create_client(company, {"id": n, "first_name": f"User {n}"})
+        for n in range(chats)
+    ]
+    for client in clients:
+        for _ in range(5):
+            await repository.save_exchange(company, client, "Здравствуйте", "Добрый день!")
+
+    print(f"{'mode':<10} {'p50 ms':>8} {'p99 ms':>8} {'hit ratio':>10}")
+    for mode, cached in (("database", False), ("cache", True)):
+        repository.history_cache = HistoryCache()
+        timings = sorted(await replay(company, clients, rounds, cached))
+        p50 = statistics.median(timings) * 1000
+        p99 = timings[int(len(timings) * 0.99)] * 1000
+        print(f"{mode:<10} {p50:>8.3f} {p99:>8.3f} {repository.history_cache.stats()['hit_ratio']:>10.2f}")
+
+
+def main():
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    call_command("migrate", verbosity=0)
+    asyncio.run(bench(chats, rounds))
+    repository.shutdown_executors()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Outbound request latency: a new connection per call vs the shared pool.
+
+Starts a local HTTP/1.1 keep-alive server and sends sequential and
+concurrent requests to it the way the CRM services did (``requests`` per
+call, a new connection each time), with a new httpx client per call (as
+googletrans was used) and through ``HTTPPool``. The
+local server has no TLS and no network latency, so real savings per
+request are larger: each avoided TLS handshake to Telegram or a CRM is
+one to three round trips.
+
+    python benchmarks/bench_http_pool.py [requests]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from http_pool import HTTPPool
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; without this delayed ACKs add 40 ms
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def new_client_each_time(url):
+    with httpx.Client() as client:
+        client.get(url)
+
+
+def requests_each_time(url):
+    import requests
+    requests.request("GET", url)
+
+
+def sequential(call, url, count):
+    timings = []
+    for _ in range(count):
+        started = time.perf_counter()
+        call(url)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+async def pooled(url, count, concurrency):
+    pool = HTTPPool()
+    timings = []
+
+    async def worker(share):
+        for _ in range(share):
+            started = time.perf_counter()
+            await pool.get(url)
+            timings.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(count // concurrency) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stats = pool.stats()["hosts"]["127.0.0.1"]
+    await pool.aclose()
+    return timings, elapsed, stats
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    print(f"requests: {count}")
+    print(f"{'client':>28} {'p50 ms':>8} {'p95 ms':>8} {'req/s':>8}")
+    for name, call in [("requests.request per call", requests_each_time),
+                       ("new httpx client per call", new_client_each_time)]:
+        try:
+            started = time.perf_counter()
+            timings = sequential(call, url, count)
+        except ImportError:
+            print(f"{name:>28} not installed, skipping")
+            continue
+        elapsed = time.perf_counter() - started
+        timings.sort()
+        print(f"{name:>28} {statistics.median(timings) * 1000:>8.2f} "
+              f"{timings[int(len(timings) * 0.95)] * 1000:>8.2f} {count / elapsed:>8.0f}")
+    for concurrency in (1, 20):
+        timings, elapsed, stats = asyncio.run(pooled(url, count, concurrency))
+        timings.sort()
+        print(f"{f'HTTPPool, {concurrency} concurrent':>28} {statistics.median(timings) * 1000:>8.2f} "
+              f"{timings[int(len(timings) * 0.95)] * 1000:>8.2f} {count / elapsed:>8.0f}"
+              f"   peak saturation {stats['peak_saturation']:.2f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Language detection accuracy and latency: langdetect vs ``language.detect``.
+
+Runs both detectors over short labelled client messages in Russian,
+Kazakh (with and without Kazakh-specific letters, as typed on a Russian
+keyboard) and English, none of them part of the built-in training sample.
+langdetect has no Kazakh profile, so any answer for Kazakh text is wrong;
+it is also reseeded per call, so answers can change between runs: the
+"stable" column is the share of texts that got the same answer 5 times.
+
+    python benchmarks/bench_language.py [repeats]
+"""
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import language
+
+SAMPLES = {
+    "ru": [
+        "Добрый вечер", "А массаж спины сколько?", "Запишите меня на пятницу", "Вы сегодня работаете?",
+        "Спасибо, буду ждать", "Какой адрес у второго филиала", "Можно оплатить переводом?",
+        "Нет, это не подходит", "Скиньте прайс", "А тренер будет мужчина или женщина",
+        "Хочу отменить занятие", "Я опаздываю минут на пять", "Есть свободные места на вечер?",
+        "Сколько человек в группе", "Как вас найти", "Подарочные сертификаты есть?",
+        "Мне нужно поговорить с менеджером", "Где можно припарковаться", "Ок, понял", "Здравствуйте!",
+    ],
+    "kz": [
+        "Қайырлы кеш", "Арқа массажы қанша тұрады?", "Мені жұмаға жазыңызшы", "Бүгін жұмыс істейсіздер ме?",
+        "Рахмет, күтемін", "Екінші филиалдың мекенжайы қандай", "Аударыммен төлеуге бола ма?",
+        "Жоқ, бұл маған сәйкес келмейді", "Бағасын жіберіңізші", "Жаттықтырушы ер адам ба әлде әйел ме",
+        "Сабақты болдырмағым келеді", "Бес минутқа кешігіп жатырмын", "Кешке бос орын бар ма?",
+        "Топта неше адам бар", "Сіздерді қалай табуға болады", "Сыйлық сертификаттары бар ма?",
+        # Typed without Kazakh letters
+        "Калай жазылуга болады", "Баганы айтып жиберсениз", "Ертен келсем болама", "Кандай кызметтер бар",
+        "Жаксы рахмет", "Сiз кайда орналаскансыз",
+    ],
+    "en": [
+        "Good evening", "How much is a back massage?", "Book me for Friday please", "Are you open today?",
+        "Thanks, I'll wait", "What is the address of the second branch", "Can I pay by bank transfer?",
+        "No, that doesn't work for me", "Send me the price list", "Is the trainer a man or a woman",
+        "I want to cancel my class", "Running five minutes late", "Any free slots tonight?",
+        "How many people are in a group", "How do I find you", "Do you sell gift cards?",
+    ],
+}
+
+
+def langdetect_detector():
+    from langdetect import LangDetectException, detect
+
+    def run(text):
+        try:
+            return detect(text)
+        except LangDetectException:
+            return None
+    return run
+
+
+def evaluate(detect, repeats):
+    correct = defaultdict(int)
+    stable = 0
+    timings = []
+    texts = [(expected, text) for expected, texts in SAMPLES.items() for text in texts]
+    for expected, text in texts:
+        answers = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            answers.append(detect(text))
+            timings.append(time.perf_counter() - started)
+        correct[expected] += answers[0] == expected
+        stable += len(set(answers)) == 1
+    accuracy = {lang: correct[lang] / len(SAMPLES[lang]) for lang in SAMPLES}
+    total = sum(correct.values()) / len(texts)
+    return accuracy, total, stable / len(texts), statistics.median(timings), max(timings)
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    # Memoization would hide the per-call cost after the first repeat
+    uncached = language.detect.__wrapped__
+    detectors = [("language", lambda text: uncached(text).language)]
+    try:
+        detectors.insert(0, ("langdetect", langdetect_detector()))
+    except ImportError:
+        print("langdetect is not installed (pip install -r requirements-dev.txt), skipping it")
+    print(f"{'detector':>11} {'ru':>6} {'kz':>6} {'en':>6} {'all':>6} {'stable':>7} {'p50 us':>9} {'max us':>9}")
+    for name, detect in detectors:
+        accuracy, total, stable, p50, worst = evaluate(detect, repeats)
+        print(f"{name:>11} {accuracy['ru']:>6.2f} {accuracy['kz']:>6.2f} {accuracy['en']:>6.2f} {total:>6.2f} "
+              f"{stable:>7.2f} {p50 * 1e6:>9.1f} {worst * 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
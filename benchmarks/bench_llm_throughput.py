@@ -0,0 +1,81 @@
+"""Completions/sec against the local fake OpenAI server.
+
+"before" calls the synchronous ``OpenAI`` client from a coroutine, the way
+``generate_ai_response`` used to, "after" uses the pooled async clients from
+``llm_clients``. The fake server answers after a fixed delay.
+
+    python benchmarks/bench_llm_throughput.py [delay_seconds]
+"""
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import uvicorn
+from openai import OpenAI
+
+import llm_clients
+from tests.fake_openai import create_app
+
+MESSAGES = [{"role": "user", "content": "Какие у вас цены?"}]
+
+
+def start_server(delay):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    config = uvicorn.Config(create_app(delay=delay), port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}/v1"
+
+
+async def run_sync(base_url, concurrency, rounds):
+    client = OpenAI(api_key="bench", base_url=base_url)
+
+    async def worker():
+        for _ in range(rounds):
+            client.chat.completions.create(model="fake", messages=MESSAGES)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    client.close()
+    return concurrency * rounds / (time.perf_counter() - started)
+
+
+async def run_async(base_url, concurrency, rounds):
+    provider = llm_clients.Provider("fake", llm_clients.create_client(api_key="bench", base_url=base_url), "fake")
+
+    async def worker():
+        for _ in range(rounds):
+            await llm_clients.complete(provider, MESSAGES)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    await llm_clients.close([provider])
+    return concurrency * rounds / (time.perf_counter() - started)
+
+
+def main():
+    delay = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+    server, base_url = start_server(delay)
+
+    print(f"fake server latency {delay * 1000:.0f} ms")
+    print(f"{'in flight':>10} {'before req/s':>14} {'after req/s':>14}")
+    for concurrency in (1, 50, 200):
+        # The blocking client serializes everything, keep its run short
+        before = asyncio.run(run_sync(base_url, concurrency, rounds=1))
+        after = asyncio.run(run_async(base_url, concurrency, rounds=3))
+        print(f"{concurrency:>10} {before:>14.1f} {after:>14.1f}")
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
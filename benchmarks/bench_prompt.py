@@ -0,0 +1,132 @@
+"""build_prompt cost and prompt size, before and after the cached prefix.
+
+"before" is the previous build_prompt, which rendered every section per
+message and sent the history twice (inside the system prompt and as chat
+messages). "after" is ``prompts.build_prompt``. Token counts use the
+tokenizer file from TOKENIZER_FILE (a ``tokenizers`` JSON, e.g. from a
+Hugging Face model) when set, otherwise a word/punctuation estimate.
+
+    python benchmarks/bench_prompt.py [iterations]
+"""
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from profiles import CompanyProfile
+from prompts import build_prompt
+from token_counter import counter
+
+
+def legacy_build_prompt(script_profile, user_message, history=None, user_data=None):
+    history = history or []
+    sections = []
+    company_name = script_profile.get('company', 'компания')
+    sections.append(f"""Ты - {company_name} чат-бот.
+Ты вежливый и профессиональный ассистент, который помогает клиентам с их вопросами.""")
+    working_hours = script_profile.get('working_hours', {})
+    if working_hours:
+        working_hours_list = [
+            f"- {day.capitalize()}: {hours if hours else 'Выходной'}"
+            for day, hours in working_hours.items()
+        ]
+        sections.append("\n\nЧасы работы:\n" + "\n".join(working_hours_list))
+    company_info = script_profile.get('company_info', {})
+    if company_info:
+        info_lines = []
+        if desc := company_info.get('description'):
+            info_lines.append(desc)
+        if address := company_info.get('address'):
+            info_lines.append(f"Адрес: {address}")
+        if phone := company_info.get('phone'):
+            info_lines.append(f"Телефон: {phone}")
+        if email := company_info.get('email'):
+            info_lines.append(f"Email: {email}")
+        if website := company_info.get('website'):
+            info_lines.append(f"Сайт: {website}")
+        if info_lines:
+            sections.append("\n\nО компании:\n" + "\n".join(info_lines))
+    if user_data:
+        user_info = []
+        if full_name := getattr(user_data, 'full_name', ''):
+            user_info.append(f"Имя: {full_name}")
+        if phone := getattr(user_data, 'phone_number', ''):
+            user_info.append(f"Телефон: {phone}")
+        if user_info:
+            sections.append("\n\nИнформация о пользователе:\n" + "\n".join(user_info))
+    if history:
+        history_lines = ["\n\nИстория переписки:"]
+        for msg in history[-5:]:
+            role = "Пользователь" if msg.get("role") == "user" else "Ассистент"
+            history_lines.append(f"{role}: {msg.get('content', '')}")
+        sections.append("\n".join(history_lines))
+    sections.append(f"\n\nПользователь: {user_message}")
+    tone = script_profile.get('bot_settings', {}).get('tone', 'вежливым и профессиональным')
+    off_topic = script_profile.get('messages', {}).get('off_topic', 'вежливо укажи на это')
+    unknown = script_profile.get('messages', {}).get('unknown', 'предложи связаться с оператором')
+    sections.append(f"""
+    Инструкции:
+    1. Отвечай на том же языке, на котором был задан вопрос.
+    2. Будь {tone}.
+    3. Если вопрос не по теме, {off_topic}.
+    4. Если не знаешь ответа, {unknown}.
+    """)
+    messages = [{"role": "system", "content": "".join(sections)}]
+    for msg in history[-10:]:
+        role = "user" if msg.get("role") == "user" else "assistant"
+        messages.append({"role": role, "content": msg.get("content", "")})
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+class User:
+    full_name = "Айгерим Садыкова"
+    phone_number = "77010000000"
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    with open(os.path.join(ROOT, "tests", "test_policy.json"), encoding="utf-8") as f:
+        script_profile = json.load(f)
+    script_profile["company_info"] = {
+        "description": "Сеть фитнес-клиник в Алматы: тренажерный зал, бассейн, массаж и консультации диетолога.",
+        "address": "г. Алматы, пр. Абая 150",
+        "phone": "+7 727 000 00 00",
+        "website": "https://fitclinic.kz",
+    }
+    profile = CompanyProfile.from_script_profile({**script_profile, "company_id": 1, "config_version": 1})
+    history = []
+    for i in range(5):
+        history.append({"role": "user", "content": f"Вопрос номер {i}: сколько стоит абонемент на месяц?"})
+        history.append({"role": "assistant", "content": f"Ответ {i}: месячный абонемент стоит 25 000 тенге."})
+    message = "А есть скидки для студентов?"
+    # As read from the database / history cache, with stored token counts
+    counted = [{**msg, "tokens": counter.count(msg["content"])} for msg in history]
+
+    before_us = timeit.timeit(lambda: legacy_build_prompt(script_profile, message, history, User()),
+                              number=iterations) / iterations * 1e6
+    after_us = timeit.timeit(lambda: build_prompt(profile, message, counted, user_data=User(), detected_language="ru"),
+                             number=iterations) / iterations * 1e6
+
+    count, method = counter.count, counter.method
+    before = legacy_build_prompt(script_profile, message, history, User())
+    after = build_prompt(profile, message, history, user_data=User(), detected_language="ru")
+    before_tokens = sum(count(m["content"]) for m in before)
+    after_tokens = sum(count(m["content"]) for m in after)
+    # The static prefix is shared by every call for the company
+    cacheable = count(after[0]["content"])
+
+    # The old system prompt embedded the current message, so no two calls shared it
+    next_turn = legacy_build_prompt(script_profile, "Спасибо!", history + [{"role": "user", "content": message}], User())
+    print(f"{'':>22} {'before':>10} {'after':>10}")
+    print(f"{'build_prompt us/call':>22} {before_us:>10.2f} {after_us:>10.2f}")
+    print(f"{'prompt tokens':>22} {before_tokens:>10} {after_tokens:>10}   ({method})")
+    print(f"{'stable system prefix':>22} {str(before[0] == next_turn[0]):>10} {'True':>10}")
+    print(f"{'shared prefix tokens':>22} {0:>10} {cacheable:>10}")
+
+
+if __name__ == "__main__":
+    main()
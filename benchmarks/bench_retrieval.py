@@ -0,0 +1,81 @@
+"""BM25 retrieval latency by company FAQ/policy count.
+
+Builds a company index of N generated FAQ entries, then times
+``Retriever.retrieve`` for client-like questions and ``Retriever.apply``
+for single-row edits (what a FAQ save in the admin costs the index). The
+first retrieve of a company also builds its index and is reported apart.
+
+    python benchmarks/bench_retrieval.py [queries]
+"""
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from retrieval import Retriever, faq_document
+
+SERVICES = ["массаж", "бассейн", "тренажерный зал", "йога", "пилатес", "сауна", "консультация диетолога",
+            "персональная тренировка", "растяжка", "бокс", "солярий", "маникюр", "стрижка", "окрашивание"]
+TEMPLATES = ["Сколько стоит {}?", "Как записаться на {}?", "Есть ли скидки на {}?", "Во сколько открывается {}?",
+             "Можно ли отменить {}?", "Нужна ли справка на {}?", "Сколько длится {}?", "Есть ли {} для детей?"]
+WORDS = ("абонемент месяц неделя оплата карта наличные рассрочка тренер группа индивидуально утро вечер "
+         "выходные праздники филиал центр парковка душ полотенце шкафчик тенге минут запись администратор").split()
+
+
+def make_documents(count, rng):
+    documents = []
+    for i in range(count):
+        question = rng.choice(TEMPLATES).format(f"{rng.choice(SERVICES)} {rng.choice(WORDS)}")
+        answer = " ".join(rng.choice(WORDS + SERVICES) for _ in range(30))
+        documents.append(faq_document(i, question, answer))
+    return documents
+
+
+async def bench(count, queries):
+    rng = random.Random(1)
+    documents = make_documents(count, rng)
+
+    async def run_db(func, company_id, since):
+        return {document.key for document in documents}, documents, datetime.now()
+
+    retriever = Retriever(run_db)
+    started = time.perf_counter()
+    await retriever.retrieve(1, 1, "прогрев")
+    build = time.perf_counter() - started
+
+    texts = [rng.choice(TEMPLATES).format(rng.choice(SERVICES)) for _ in range(queries)]
+    timings = []
+    for text in texts:
+        started = time.perf_counter()
+        await retriever.retrieve(1, 1, text)
+        timings.append(time.perf_counter() - started)
+
+    edits = []
+    for i in range(queries // 10):
+        document = make_documents(1, rng)[0]._replace(key=("faq", rng.randrange(count)))
+        started = time.perf_counter()
+        retriever.apply(1, document)
+        # The next retrieve recompiles the postings of the edited terms
+        await retriever.retrieve(1, 1, texts[i])
+        edits.append(time.perf_counter() - started)
+
+    timings.sort()
+    return build, statistics.median(timings), timings[int(len(timings) * 0.99)], statistics.median(edits)
+
+
+def main():
+    queries = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"{'entries':>8} {'build ms':>9} {'p50 ms':>8} {'p99 ms':>8} {'edit+query ms':>14}")
+    for count in (100, 1000, 5000, 10000):
+        build, p50, p99, edit = asyncio.run(bench(count, queries))
+        print(f"{count:>8} {build * 1000:>9.1f} {p50 * 1000:>8.3f} {p99 * 1000:>8.3f} {edit * 1000:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Latency of the pre-LLM rule stage per message.
+
+Runs ``RuleStage.apply`` over a mix of client messages (commands,
+greetings, thanks, real questions, restricted topics) for a company with
+all canned messages and ten restricted topics configured, during and
+outside working hours, and reports the share answered without the LLM.
+
+    python benchmarks/bench_rules.py [repeats]
+"""
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from profiles import CompanyProfile
+from rules import RuleStage
+
+MESSAGES = [
+    "/start", "Здравствуйте!", "Добрый день", "Спасибо большое!", "Рахмет", "Ок, спасибо",
+    "Сколько стоит абонемент в бассейн на месяц?", "Вы сегодня работаете до скольки?",
+    "Можно записаться к тренеру на пятницу вечером?", "Какой адрес у второго филиала",
+    "Что вы думаете о политике?", "Бағасын жіберіңізші", "Есть ли скидки для студентов и пенсионеров?",
+    "Хочу отменить занятие, как это сделать?", "Принимаете ставки на спорт?", "А парковка есть?",
+]
+TOPICS = ["политика", "религия", "ставки на спорт", "казино", "кредиты", "медицинские диагнозы",
+          "конкуренты", "оружие", "наркотики", "взрослый контент"]
+
+
+def run(stage, profile, now, repeats):
+    timings = []
+    for _ in range(repeats):
+        for text in MESSAGES:
+            started = time.perf_counter()
+            stage.apply(profile, text, now)
+            timings.append(time.perf_counter() - started)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99)]
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    profile = CompanyProfile.from_script_profile({
+        "company_id": 1, "company": "Бассейн", "timezone": "Asia/Almaty",
+        "working_hours": {day: "9:00-21:00" for day in ("monday", "tuesday", "wednesday", "thursday", "friday")},
+        "messages": {"welcome": "Добро пожаловать!", "thanks": "Всегда рады помочь!", "off_hours": "Ответим утром."},
+        "restricted_topics": TOPICS,
+    })
+    print(f"messages: {len(MESSAGES)}, restricted topics: {len(TOPICS)}")
+    print(f"{'when':>12} {'p50 us':>8} {'p99 us':>8} {'LLM calls avoided':>18}")
+    # 2024-01-01 is a Monday; 06:00 UTC is midday in Almaty, 20:00 UTC is night
+    for name, now in [("open", datetime(2024, 1, 1, 6, tzinfo=timezone.utc)),
+                      ("closed", datetime(2024, 1, 1, 20, tzinfo=timezone.utc))]:
+        stage = RuleStage()
+        p50, p99 = run(stage, profile, now, repeats)
+        print(f"{name:>12} {p50 * 1e6:>8.2f} {p99 * 1e6:>8.1f} {stage.stats()['avoided_rate']:>18.0%}")
+
+
+if __name__ == "__main__":
+    main()
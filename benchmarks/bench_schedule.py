@@ -0,0 +1,79 @@
+"""Cost of "is the company open now": per-message parsing vs compiled schedules.
+
+Compares the previous per-call check (``pytz.timezone`` lookup, weekday
+name, two ``strptime`` calls) with ``CompanyProfile.is_open`` (one
+timezone conversion and a bisect) and ``ScheduleTable.open_companies``
+answering for every company at once.
+
+    python benchmarks/bench_schedule.py [companies]
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+import pytz
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from profiles import WEEKDAYS, CompanyProfile, ScheduleTable
+
+TIMEZONES = ["Asia/Almaty", "Asia/Aqtobe", "Europe/Moscow", "UTC", "America/New_York"]
+
+
+def parse_each_time(working_hours, timezone_str):
+    """The check as it was: everything parsed on every call."""
+    now = datetime.now(pytz.timezone(timezone_str))
+    day_hours = working_hours.get(now.strftime("%A").lower())
+    if not day_hours:
+        return False
+    start_str, end_str = day_hours.strip().split("-")
+    start = datetime.strptime(start_str.strip(), "%H:%M").time()
+    end = datetime.strptime(end_str.strip(), "%H:%M").time()
+    current = now.time()
+    if end < start:
+        return current >= start or current <= end
+    return start <= current <= end
+
+
+def make_companies(count, rng):
+    companies = []
+    for i in range(count):
+        start = rng.randint(6, 12)
+        end = (start + rng.randint(6, 14)) % 24
+        hours = {day: f"{start}:00-{end}:00" for day in WEEKDAYS[:rng.randint(5, 7)]}
+        companies.append({"company_id": i, "company": str(i), "timezone": rng.choice(TIMEZONES),
+                          "working_hours": hours})
+    return companies
+
+
+def timed(fn, repeats):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - started) / repeats
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    companies = make_companies(count, random.Random(1))
+    profiles = [CompanyProfile.from_script_profile(company) for company in companies]
+    table = ScheduleTable.from_profiles(profiles)
+    now = datetime.now(timezone.utc)
+
+    before = timed(lambda: [parse_each_time(c["working_hours"], c["timezone"]) for c in companies], 3)
+    compiled = timed(lambda: [profile.is_open(now) for profile in profiles], 3)
+    vectorized = timed(lambda: table.open_companies(now), 20)
+    assert table.open_companies(now) == [p.company_id for p in profiles if p.is_open(now)]
+
+    print(f"companies: {count}")
+    print(f"{'check':>22} {'per company us':>15} {'all companies ms':>17}")
+    for name, seconds in [("parse every time", before), ("profile.is_open", compiled),
+                          ("ScheduleTable", vectorized)]:
+        print(f"{name:>22} {seconds / count * 1e6:>15.2f} {seconds * 1000:>17.2f}")
+
+
+if __name__ == "__main__":
+    main()
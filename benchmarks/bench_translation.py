@@ -0,0 +1,74 @@
+"""Latency the translation fallback adds to replies.
+
+Simulates a stream of replies to Russian messages in which a share came
+back in English, some of them repeated (the same FAQ-like answer), with a
+translation service that takes TRANSLATE_MS per call. Compares
+translating every English reply inline (the previous behaviour) with
+``Translator`` (hash-keyed cache, deadline) and reports the cost of the
+local language post-check that every reply pays.
+
+    python benchmarks/bench_translation.py [replies] [english share]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from translation import Translator, needs_translation
+
+TRANSLATE_MS = 300
+RUSSIAN = ["Абонемент в бассейн стоит 25 000 тенге в месяц.", "Мы работаем ежедневно с 9:00 до 21:00.",
+           "Записаться можно по телефону или здесь в чате, на какое время вам удобно?"]
+ENGLISH = ["The pool membership costs 25,000 tenge per month.", "We are open every day from 9 am to 9 pm.",
+           "You can book by phone or right here in the chat, what time suits you?"]
+
+
+def slow_translate(text, target):
+    time.sleep(TRANSLATE_MS / 1000)
+    return f"[{target}] {text}"
+
+
+def make_replies(count, english_share, rng):
+    replies = []
+    for i in range(count):
+        if rng.random() < english_share:
+            # Half of the English replies are one of a few common answers
+            replies.append(rng.choice(ENGLISH) if rng.random() < 0.5 else f"Your booking number {i} is confirmed.")
+        else:
+            replies.append(rng.choice(RUSSIAN))
+    return replies
+
+
+async def run_translator(replies):
+    translator = Translator(slow_translate)
+    for reply in replies:
+        await translator.ensure_language(reply, "ru")
+    return translator.stats()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    english_share = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    replies = make_replies(count, english_share, random.Random(1))
+
+    started = time.perf_counter()
+    for reply in replies:
+        needs_translation(reply, "ru")
+    check_us = (time.perf_counter() - started) / count * 1e6
+
+    inline = sum(TRANSLATE_MS for reply in replies if needs_translation(reply, "ru")) / count
+    stats = asyncio.run(run_translator(replies))
+    print(f"replies: {count}, English share: {english_share:.0%}, translation call: {TRANSLATE_MS} ms")
+    print(f"post-check per reply:           {check_us:.1f} us")
+    print(f"replies needing translation:    {stats['needed_rate']:.2%} ({stats['cache_hits']} from cache)")
+    print(f"added latency per reply before: {inline:.1f} ms")
+    print(f"added latency per reply now:    {stats['latency_per_reply_ms']:.1f} ms "
+          f"(max {stats['max_latency_ms']:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
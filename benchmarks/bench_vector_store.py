@@ -0,0 +1,113 @@
+"""Vector store recall and latency at 10k, 100k and 1M vectors on the CPU.
+
+Writes N clustered unit vectors (DIM dimensions, like a small sentence
+embedding model) into a temporary store in 100k-row segments, then times
+top-10 searches with a full scan of the segments, compacts them into one
+segment (IVF from VECTOR_STORE_IVF_MIN_ROWS rows on, as in production) and
+times searches again at two ``nprobe`` settings. Recall@10
+is measured against exact float32 search. Each size runs with float32 and
+with int8 storage.
+
+    python benchmarks/bench_vector_store.py [max vectors] [queries]
+"""
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from vector_store import VectorStore
+
+DIM = 384
+CLUSTERS = 2000
+CHUNK = 100_000
+K = 10
+NPROBES = (16, 64)
+
+
+def make_chunk(start, count, centers):
+    rng = np.random.default_rng(start)
+    rows = centers[rng.integers(len(centers), size=count)] + rng.normal(scale=0.06, size=(count, DIM))
+    return (rows / np.linalg.norm(rows, axis=1, keepdims=True)).astype(np.float32)
+
+
+def exact_top(queries, count, centers):
+    best = np.full((len(queries), K), -np.inf, dtype=np.float32)
+    best_keys = np.zeros((len(queries), K), dtype=np.int64)
+    for start in range(0, count, CHUNK):
+        scores = queries @ make_chunk(start, min(CHUNK, count - start), centers).T
+        keys = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+        scores = np.concatenate([best, scores], axis=1)
+        keys = np.concatenate([best_keys, keys], axis=1)
+        top = np.argpartition(-scores, K - 1, axis=1)[:, :K]
+        best, best_keys = np.take_along_axis(scores, top, 1), np.take_along_axis(keys, top, 1)
+    return [set(row) for row in best_keys]
+
+
+def timed_search(store, queries, truth):
+    timings, found = [], 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        results = store.search(query, K)
+        timings.append(time.perf_counter() - started)
+        found += len(expected & {key for key, _ in results})
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99)], found / (K * len(queries))
+
+
+def bench(directory, count, quantize, queries, truth, centers):
+    # Default ivf_min_rows: stores too small for IVF to pay off stay exact scans
+    store = VectorStore(os.path.join(directory, f"{count}-{quantize}"), DIM, quantize=quantize,
+                        max_segments=count, max_dead=1.0)
+    for start in range(0, count, CHUNK):
+        size = min(CHUNK, count - start)
+        store.upsert(np.arange(start, start + size), make_chunk(start, size, centers))
+    # Full scans get slow at 1M rows, a few queries are enough for their median
+    scan = timed_search(store, queries[:max(20, len(queries) * 10_000 // count)], truth)
+    started = time.perf_counter()
+    store.compact()
+    compaction = time.perf_counter() - started
+    ivf = {}
+    for nprobe in NPROBES:
+        store.nprobe = nprobe
+        ivf[nprobe] = timed_search(store, queries, truth)
+    return scan, compaction, ivf, store.stats()["ivf_lists"]
+
+
+def main():
+    max_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(CLUSTERS, DIM)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    directory = tempfile.mkdtemp()
+    print(f"{'vectors':>9} {'type':>7} {'scan p50 ms':>12} {'scan recall':>12} {'compact s':>10} {'lists':>6}"
+          + "".join(f" {f'nprobe={n} p50/p99 ms':>24} {'recall':>7}" for n in NPROBES))
+    try:
+        for count in (10_000, 100_000, 1_000_000):
+            if count > max_count:
+                break
+            # Queries are noisy copies of stored vectors
+            sources = make_chunk(0, CHUNK, centers)[rng.integers(min(count, CHUNK), size=query_count)]
+            queries = sources + rng.normal(scale=0.03, size=sources.shape).astype(np.float32)
+            queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+            truth = exact_top(queries, count, centers)
+            for quantize in (False, True):
+                scan, compaction, ivf, lists = bench(directory, count, quantize, queries, truth, centers)
+                print(f"{count:>9} {'int8' if quantize else 'float32':>7} {scan[0] * 1000:>12.2f} {scan[2]:>12.3f} "
+                      f"{compaction:>10.1f} {lists:>6}"
+                      + "".join(f" {f'{p50 * 1000:.2f} / {p99 * 1000:.2f}':>24} {recall:>7.3f}"
+                                for p50, p99, recall in ivf.values()))
+                shutil.rmtree(os.path.join(directory, f"{count}-{quantize}"))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
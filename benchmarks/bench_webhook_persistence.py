@@ -0,0 +1,95 @@
+"""Updates/sec of the webhook persistence path at 1, 10 and 100 concurrent chats.
+
+Also reports the longest event loop stall seen by a 1 ms heartbeat task.
+
+"before" runs the ORM calls inline in the coroutine (blocking the event loop),
+"after" goes through the awaitable ``repository`` layer. The LLM call is
+replaced by a fixed ``asyncio.sleep`` so only the data access differs.
+Django refuses blocking ORM calls inside a running loop, so the "before"
+variant needs ``DJANGO_ALLOW_ASYNC_UNSAFE``.
+
+    python benchmarks/bench_webhook_persistence.py [updates_per_chat]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "web"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "web.settings")
+os.environ.setdefault("DJANGO_ALLOW_ASYNC_UNSAFE", "true")
+
+import django
+from django.conf import settings
+
+settings.DATABASES["default"]["NAME"] = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+settings.DATABASES["default"]["OPTIONS"] = {"timeout": 30}
+django.setup()
+
+from django.core.management import call_command
+
+import repository
+from users.models import Company
+
+LLM_LATENCY = 0.02
+
+
+async def handle_inline(company_token, user):
+    company = repository._get_company_by_token(company_token)
+    client = repository._get_client(company, user["id"]) or repository._create_or_update_client(company, user)
+    repository._get_history(company, client)
+    await asyncio.sleep(LLM_LATENCY)
+    repository._save_exchange(company, client, "Здравствуйте", "Добрый день!")
+
+
+async def handle_repository(company_token, user):
+    company = await repository.get_company_by_token(company_token)
+    client = await repository.get_or_create_client(company, user)
+    await repository.get_history(company, client)
+    await asyncio.sleep(LLM_LATENCY)
+    await repository.save_exchange(company, client, "Здравствуйте", "Добрый день!")
+
+
+async def run(handler, chats, updates_per_chat, token):
+    async def chat(n):
+        user = {"id": n, "first_name": f"User {n}", "username": f"user{n}"}
+        for _ in range(updates_per_chat):
+            await handler(token, user)
+
+    async def heartbeat(stalls):
+        # How long the loop is unavailable to everything else (e.g. /health)
+        while True:
+            tick = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stalls.append(time.perf_counter() - tick - 0.001)
+
+    stalls = []
+    monitor = asyncio.create_task(heartbeat(stalls))
+    started = time.perf_counter()
+    await asyncio.gather(*(chat(n) for n in range(chats)))
+    elapsed = time.perf_counter() - started
+    monitor.cancel()
+    return chats * updates_per_chat / elapsed, max(stalls) * 1000
+
+
+def main():
+    updates_per_chat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    call_command("migrate", verbosity=0)
+
+    def fresh_company(name):
+        # A company per run keeps history and analytics sizes comparable
+        return Company._base_manager.create(name=name, telegram_token=name).telegram_token
+
+    print(f"{'chats':>6} {'before upd/s':>13} {'max stall ms':>13} {'after upd/s':>13} {'max stall ms':>13}")
+    for chats in (1, 10, 100):
+        before, before_stall = asyncio.run(run(handle_inline, chats, updates_per_chat, fresh_company(f"before-{chats}")))
+        after, after_stall = asyncio.run(run(handle_repository, chats, updates_per_chat, fresh_company(f"after-{chats}")))
+        print(f"{chats:>6} {before:>13.1f} {before_stall:>13.1f} {after:>13.1f} {after_stall:>13.1f}")
+    repository.shutdown_executors()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Per-chat ordered, cross-chat parallel execution.
+
+Work is sharded by a key such as ``(company_token, chat_id)``. Each key gets
+a lane: a FIFO served by one task, so items of the same chat run strictly
+one after another, in submission order. Lanes of different chats run in
+parallel, bounded by a shared concurrency limit. A lane that stays idle for
+``idle_timeout`` seconds ends its task and is dropped, so memory only grows
+with the number of recently active chats.
+"""
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+logger = logging.getLogger("uvicorn")
+
+CHAT_CONCURRENCY = int(os.getenv("CHAT_CONCURRENCY", "16"))
+CHAT_IDLE_TIMEOUT = float(os.getenv("CHAT_IDLE_TIMEOUT", "30"))
+
+
+class _Lane:
+    __slots__ = ("items", "wakeup", "task")
+
+    def __init__(self):
+        self.items: Deque[Any] = deque()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+
+class ChatScheduler:
+    """Runs ``handler(item)`` sequentially per key and concurrently across keys."""
+
+    def __init__(self, handler: Callable[[Any], Awaitable[Any]], concurrency: int = CHAT_CONCURRENCY,
+                 idle_timeout: float = CHAT_IDLE_TIMEOUT):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.idle_timeout = idle_timeout
+        self.lanes: Dict[Hashable, _Lane] = {}
+        # Items submitted and not finished yet
+        self.pending = 0
+        self.running = 0
+        self.processed = 0
+        self.errors = 0
+        self.evicted = 0
+        self._slots = asyncio.Semaphore(concurrency)
+        # Set every time an item finishes
+        self._progress = asyncio.Event()
+
+    def submit(self, key: Hashable, item: Any) -> None:
+        """Queue ``item`` behind earlier items with the same key."""
+        lane = self.lanes.get(key)
+        if lane is None:
+            lane = self.lanes[key] = _Lane()
+            lane.task = asyncio.create_task(self._run(key, lane))
+        lane.items.append(item)
+        lane.wakeup.set()
+        self.pending += 1
+
+    def take_waiting(self, key: Hashable) -> list:
+        """Remove and return the items queued behind the one ``key`` is running."""
+        lane = self.lanes.get(key)
+        if lane is None or len(lane.items) < 2:
+            return []
+        waiting = [lane.items.pop() for _ in range(len(lane.items) - 1)]
+        waiting.reverse()
+        self.pending -= len(waiting)
+        self._progress.set()
+        return waiting
+
+    async def wait_for_progress(self, timeout: Optional[float] = None) -> None:
+        """Wait until some item finishes (or ``timeout`` passes)."""
+        self._progress.clear()
+        try:
+            await asyncio.wait_for(self._progress.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every submitted item is finished. Returns False on timeout."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while self.pending:
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            await self.wait_for_progress(remaining)
+        return True
+
+    async def close(self) -> None:
+        """Cancel all lanes, including ones still working."""
+        tasks = [lane.task for lane in self.lanes.values() if lane.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.lanes.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "lanes": len(self.lanes),
+            "pending": self.pending,
+            "running": self.running,
+            "processed": self.processed,
+            "errors": self.errors,
+            "evicted": self.evicted,
+        }
+
+    async def _run(self, key: Hashable, lane: _Lane) -> None:
+        try:
+            while True:
+                while lane.items:
+                    async with self._slots:
+                        self.running += 1
+                        try:
+                            await self.handler(lane.items[0])
+                        except Exception as e:
+                            self.errors += 1
+                            logger.error(f"Error processing item for {key}: {e}")
+                        finally:
+                            self.running -= 1
+                    lane.items.popleft()
+                    self.pending -= 1
+                    self.processed += 1
+                    self._progress.set()
+                lane.wakeup.clear()
+                try:
+                    await asyncio.wait_for(lane.wakeup.wait(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    # Nothing can be submitted between this check and the
+                    # removal below, both run without yielding to the loop
+                    if not lane.items:
+                        break
+        finally:
+            if self.lanes.get(key) is lane:
+                del self.lanes[key]
+                self.evicted += 1
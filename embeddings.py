@@ -0,0 +1,98 @@
+"""CPU-only sentence embeddings for matching client messages.
+
+``EMBEDDING_MODEL`` names a local sentence-embedding model (a directory or
+a Hugging Face id already in the local cache, e.g. a multilingual MiniLM
+or E5-small) that is run with ``transformers`` on the CPU. Without it,
+``HashingEmbedder`` hashes character trigrams into a fixed-size vector:
+no model files, microseconds per message, but it measures shared spelling,
+not meaning. One changed word keeps the score high ("мужская стрижка" /
+"женская стрижка" score 0.73, "в 10:00" / "в 18:00" in the same sentence
+0.91) while a real rephrasing can score lower ("часы работы?" / "какие у
+вас часы работы": 0.69), so its threshold only lets through the same
+question with different case, punctuation or a filler word ("Какие у вас
+часы работы?" / "какие у вас часы работы"), and ``semantic`` is False.
+
+Every embedder returns L2-normalized float32 rows, so a dot product is the
+cosine similarity.
+"""
+import logging
+import os
+import re
+import zlib
+from typing import Sequence
+
+import numpy as np
+
+logger = logging.getLogger("uvicorn")
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "2"))
+
+_WORDS = re.compile(r"\w+")
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class HashingEmbedder:
+    """Character n-gram counts hashed into ``dim`` buckets."""
+
+    method = "hashing"
+    # Practically the same words; 0.91 already separates "10:00" from "18:00"
+    default_threshold = 0.95
+    # Scores follow spelling, so similar texts may need different answers
+    semantic = False
+
+    def __init__(self, dim: int = 1024, ngram: int = 3):
+        self.dim = dim
+        self.ngram = ngram
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            padded = f" {' '.join(_WORDS.findall(text.casefold()))} "
+            for i in range(len(padded) - self.ngram + 1):
+                bucket = zlib.crc32(padded[i:i + self.ngram].encode()) % self.dim
+                vectors[row, bucket] += 1.0
+        return _normalize_rows(vectors)
+
+
+class TransformerEmbedder:
+    """Mean-pooled hidden states of a sentence-embedding model, on the CPU."""
+
+    method = "transformer"
+    default_threshold = 0.85
+    semantic = True
+
+    def __init__(self, model: str, threads: int = EMBEDDING_THREADS, max_length: int = 128):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        torch.set_num_threads(threads)
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model)
+        self.model = AutoModel.from_pretrained(model).eval()
+        self.dim = self.model.config.hidden_size
+        self.max_length = max_length
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        torch = self.torch
+        with torch.inference_mode():
+            batch = self.tokenizer(list(texts), padding=True, truncation=True,
+                                   max_length=self.max_length, return_tensors="pt")
+            hidden = self.model(**batch).last_hidden_state
+            mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        return _normalize_rows(pooled.numpy().astype(np.float32))
+
+
+def load_embedder(model: str = EMBEDDING_MODEL):
+    if model:
+        try:
+            return TransformerEmbedder(model)
+        except Exception as e:
+            logger.error(f"Error loading embedding model {model}, using hashing: {e}")
+    return HashingEmbedder()
@@ -0,0 +1,213 @@
+"""Semantic answer cache backed by each company's FAQ.
+
+FAQ questions of a company are embedded once (see ``embeddings``) into a
+matrix; an incoming message is embedded and compared against it with one
+matrix-vector product. When the best cosine similarity reaches the
+threshold the FAQ answer is sent as is and the LLM is not called.
+
+Besides the curated FAQ, LLM answers the webhook considers safe to reuse
+(first message of a conversation, no handoff, no error) are remembered as
+"validated" answers, at most FAQ_CACHE_MAX_VALIDATED per company, newest
+kept. Only a semantic embedder (a configured EMBEDDING_MODEL) reuses them:
+with the hashing fallback "запишите на 10:00" would be answered with the
+reply to "запишите на 18:00". A company's index is rebuilt when its config version changes or its
+FAQs are edited, which also drops the validated answers.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from embeddings import load_embedder
+from response_cache import is_personal
+
+logger = logging.getLogger("uvicorn")
+
+FAQ_CACHE_THRESHOLD = os.getenv("FAQ_CACHE_THRESHOLD")
+FAQ_CACHE_MAX_VALIDATED = int(os.getenv("FAQ_CACHE_MAX_VALIDATED", "200"))
+
+
+class CachedAnswer(NamedTuple):
+    answer: str
+    # "faq" or "validated"
+    source: str
+    score: float
+    question: str
+
+
+class _CompanyIndex:
+    __slots__ = ("config_version", "vectors", "entries", "validated", "validated_vectors")
+
+    def __init__(self, config_version: int, vectors: np.ndarray, entries: List[Tuple[str, str]]):
+        self.config_version = config_version
+        self.vectors = vectors
+        # (question, answer) per row of ``vectors``
+        self.entries = entries
+        self.validated: Deque[Tuple[np.ndarray, str, str]] = deque(maxlen=FAQ_CACHE_MAX_VALIDATED)
+        # Stacked rows of ``validated``, rebuilt after it changes
+        self.validated_vectors: Optional[np.ndarray] = None
+
+
+class _CompanyStats:
+    __slots__ = ("lookups", "faq_hits", "validated_hits", "saved_seconds")
+
+    def __init__(self):
+        self.lookups = 0
+        self.faq_hits = 0
+        self.validated_hits = 0
+        self.saved_seconds = 0.0
+
+
+def load_faqs(company_id: int) -> List[Tuple[str, str]]:
+    """(question, answer) pairs of a company (blocking, run it on the DB pool)."""
+    from admin_panel.models import FAQ
+    return list(FAQ.objects.filter(company_id=company_id).values_list("question", "answer"))
+
+
+class FAQCache:
+    """Per-company semantic lookup of FAQ and validated answers.
+
+    Args:
+        run_db: Awaitable runner for blocking ORM calls (``repository.run_db``)
+        embedder: Object with ``embed(texts) -> normalized rows``
+        threshold: Minimum cosine similarity for a hit
+        reuse_validated: Remember and serve LLM answers (default: only
+            when the embedder is ``semantic``)
+        expected_latency: Seconds a reply would have taken from the LLM,
+            used to report the latency saved by hits
+    """
+
+    def __init__(self, run_db, embedder=None, threshold: Optional[float] = None,
+                 reuse_validated: Optional[bool] = None,
+                 expected_latency: Callable[[], Optional[float]] = lambda: None):
+        self.run_db = run_db
+        self.embedder = embedder or load_embedder()
+        if threshold is None:
+            threshold = float(FAQ_CACHE_THRESHOLD) if FAQ_CACHE_THRESHOLD else self.embedder.default_threshold
+        self.threshold = threshold
+        self.reuse_validated = self.embedder.semantic if reuse_validated is None else reuse_validated
+        self.expected_latency = expected_latency
+        self.indexes: Dict[int, _CompanyIndex] = {}
+        self.company_stats: Dict[int, _CompanyStats] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # The same text is embedded for the lookup and again if its answer is remembered
+        self._embed_one = lru_cache(maxsize=1024)(self._embed_uncached)
+
+    def _embed_uncached(self, text: str) -> np.ndarray:
+        return self.embedder.embed([text])[0]
+
+    async def _vector(self, text: str) -> np.ndarray:
+        return await asyncio.to_thread(self._embed_one, text)
+
+    async def _index(self, company_id: int, config_version: int) -> _CompanyIndex:
+        index = self.indexes.get(company_id)
+        if index is not None and index.config_version >= config_version:
+            return index
+        lock = self._locks.setdefault(company_id, asyncio.Lock())
+        async with lock:
+            index = self.indexes.get(company_id)
+            if index is None or index.config_version < config_version:
+                entries = await self.run_db(load_faqs, company_id)
+                questions = [question for question, _ in entries]
+                vectors = await asyncio.to_thread(self.embedder.embed, questions) if entries else None
+                index = self.indexes[company_id] = _CompanyIndex(config_version, vectors, entries)
+                logger.info(f"Indexed {len(entries)} FAQs of company {company_id}")
+        return index
+
+    def _stats(self, company_id: int) -> _CompanyStats:
+        stats = self.company_stats.get(company_id)
+        if stats is None:
+            stats = self.company_stats[company_id] = _CompanyStats()
+        return stats
+
+    async def lookup(self, company_id: int, config_version: int, text: str) -> Optional[CachedAnswer]:
+        """Return the closest FAQ or validated answer above the threshold."""
+        started = time.perf_counter()
+        stats = self._stats(company_id)
+        stats.lookups += 1
+        index = await self._index(company_id, config_version)
+        if index.vectors is None and not index.validated:
+            return None
+        vector = await self._vector(text)
+
+        best = None
+        if index.vectors is not None:
+            scores = index.vectors @ vector
+            row = int(np.argmax(scores))
+            question, answer = index.entries[row]
+            best = CachedAnswer(answer, "faq", float(scores[row]), question)
+        if index.validated:
+            if index.validated_vectors is None:
+                index.validated_vectors = np.vstack([v for v, _, _ in index.validated])
+            scores = index.validated_vectors @ vector
+            row = int(np.argmax(scores))
+            if best is None or scores[row] > best.score:
+                _, question, answer = index.validated[row]
+                best = CachedAnswer(answer, "validated", float(scores[row]), question)
+
+        if best is None or best.score < self.threshold:
+            return None
+        if best.source == "faq":
+            stats.faq_hits += 1
+        else:
+            stats.validated_hits += 1
+        expected = self.expected_latency()
+        if expected is not None:
+            stats.saved_seconds += max(0.0, expected - (time.perf_counter() - started))
+        return best
+
+    async def remember(self, company_id: int, config_version: int, text: str, answer: str) -> None:
+        """Keep an LLM answer for reuse on similar questions of the same company."""
+        if not self.reuse_validated:
+            return
+        index = await self._index(company_id, config_version)
+        index.validated.append((await self._vector(text), text, answer))
+        index.validated_vectors = None
+
+    def invalidate(self, company_id: int) -> None:
+        self.indexes.pop(company_id, None)
+
+    def stats(self) -> Dict[str, object]:
+        companies = {}
+        for company_id, stats in self.company_stats.items():
+            hits = stats.faq_hits + stats.validated_hits
+            companies[company_id] = {
+                "lookups": stats.lookups,
+                "faq_hits": stats.faq_hits,
+                "validated_hits": stats.validated_hits,
+                "hit_rate": round(hits / stats.lookups, 4) if stats.lookups else 0.0,
+                "latency_saved": round(stats.saved_seconds, 3),
+            }
+        return {"embedder": self.embedder.method, "threshold": self.threshold,
+                "reuse_validated": self.reuse_validated, "companies": companies}
+
+
+def is_reusable(text: str, reply: str, history: list, client) -> bool:
+    """Whether the LLM answer ``reply`` to ``text`` may be served to other clients.
+
+    Only answers to the first message of a conversation qualify (the prompt
+    held nothing client-specific besides the name), only if the message is
+    not about the client (``response_cache.is_personal``: "запишите меня на
+    10:00") and only if the answer does not mention the client's name.
+    """
+    if history or getattr(client, "summary", "") or is_personal(text):
+        return False
+    name = (getattr(client, "name", "") or "").strip()
+    return not (name and name.casefold() in reply.casefold())
+
+
+def connect_signals(cache: FAQCache) -> None:
+    """Rebuild a company's index after its FAQs are edited in this process."""
+    from django.db.models.signals import post_delete, post_save
+    from admin_panel.models import FAQ
+
+    def on_change(sender, instance, **kwargs):
+        cache.invalidate(instance.company_id)
+
+    post_save.connect(on_change, sender=FAQ, weak=False, dispatch_uid="faq_cache_save")
+    post_delete.connect(on_change, sender=FAQ, weak=False, dispatch_uid="faq_cache_delete")
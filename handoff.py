@@ -0,0 +1,117 @@
+"""Detection of replies that should be handed off to a human operator.
+
+A company's handoff triggers and the built-in uncertainty phrases are
+compiled once into a single regular expression. The phrases are merged
+into a trie first ("не знаю|не уверен" becomes "не (?:знаю|уверен)"), so
+at each position of the reply the regex walks shared prefixes once instead
+of trying every phrase in turn, the same work an Aho-Corasick automaton
+does, but inside the C regex engine. Matching runs on the casefolded
+reply, so "Оператор", "ОПЕРАТОР" and "оператор" are the same trigger.
+
+With only a few phrases, CPython's substring search beats any regex, so
+small lists are checked one ``in`` at a time on the casefolded reply
+(still without re-parsing or re-lowering the triggers per call).
+
+Matchers are cached by trigger list; ``CompanyProfile`` keeps the one for
+its triggers, so a profile compiles it once per config version.
+"""
+import os
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+# Triggers match whole words only ("help" does not fire on "helpful")
+HANDOFF_WORD_BOUNDARIES = os.getenv("HANDOFF_WORD_BOUNDARIES", "false").lower() in ("1", "true", "yes")
+
+# Used when a company has no triggers of its own
+DEFAULT_TRIGGERS = ("help",)
+
+UNCERTAINTY_PHRASES = (
+    "не знаю", "не уверен", "не могу ответить",
+    "не располагаю информацией", "не могу помочь",
+    "извините, но я не могу", "к сожалению, я не могу",
+)
+
+# Very short replies with one of these words look like a fallback
+FALLBACK_WORDS = ("извините", "понимаю", "попробуйте")
+FALLBACK_MAX_LENGTH = 10
+
+# Up to this many phrases substring checks are faster than the combined regex
+SUBSTRING_MAX_PHRASES = 24
+
+
+class HandoffMatch(NamedTuple):
+    # The trigger or phrase as configured
+    trigger: str
+    # "trigger", "uncertainty" or "fallback"
+    source: str
+
+
+def _trie_pattern(phrases: Iterable[str]) -> str:
+    """One regex alternation for ``phrases`` with common prefixes factored out."""
+    trie: Dict[str, dict] = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        # The empty key marks the end of a phrase
+        node[""] = {}
+
+    def render(node: dict) -> str:
+        ends = "" in node
+        branches = [re.escape(char) + render(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        if len(branches) == 1 and not ends:
+            return branches[0]
+        pattern = "(?:" + "|".join(branches) + ")"
+        return pattern + "?" if ends else pattern
+
+    return render(trie)
+
+
+class HandoffMatcher:
+    """Company triggers and uncertainty phrases, compiled for matching casefolded replies."""
+
+    def __init__(self, triggers: Iterable[str] = (), word_boundaries: bool = HANDOFF_WORD_BOUNDARIES):
+        self.word_boundaries = word_boundaries
+        # casefolded phrase -> match reported for it; company triggers win over built-ins
+        self.phrases: Dict[str, HandoffMatch] = {}
+        for phrase in UNCERTAINTY_PHRASES:
+            self.phrases[phrase.casefold()] = HandoffMatch(phrase, "uncertainty")
+        for trigger in triggers or DEFAULT_TRIGGERS:
+            if trigger.strip():
+                self.phrases[trigger.strip().casefold()] = HandoffMatch(trigger.strip(), "trigger")
+        self.substrings: Optional[Tuple[str, ...]] = None
+        self.pattern = None
+        if not word_boundaries and len(self.phrases) <= SUBSTRING_MAX_PHRASES:
+            self.substrings = tuple(self.phrases)
+            return
+        alternatives = _trie_pattern(self.phrases)
+        if word_boundaries:
+            alternatives = rf"(?<!\w)(?:{alternatives})(?!\w)"
+        self.pattern = re.compile(alternatives)
+
+    def match(self, reply: str) -> Optional[HandoffMatch]:
+        """The first phrase found in ``reply``, or None."""
+        if not reply:
+            return None
+        folded = reply.casefold()
+        if self.substrings is not None:
+            for phrase in self.substrings:
+                if phrase in folded:
+                    return self.phrases[phrase]
+        else:
+            found = self.pattern.search(folded)
+            if found is not None:
+                return self.phrases[found.group()]
+        if len(reply.strip()) < FALLBACK_MAX_LENGTH:
+            for word in FALLBACK_WORDS:
+                if word in folded:
+                    return HandoffMatch(word, "fallback")
+        return None
+
+
+@lru_cache(maxsize=1024)
+def compile_matcher(triggers: Tuple[str, ...], word_boundaries: bool = HANDOFF_WORD_BOUNDARIES) -> HandoffMatcher:
+    return HandoffMatcher(triggers, word_boundaries)
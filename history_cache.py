@@ -0,0 +1,153 @@
+"""Recent conversation turns per (company, client), kept in memory.
+
+Building a prompt needs the last few messages of the conversation. Instead
+of querying ``Message`` for every update, each conversation keeps a ring
+buffer of its last ``HISTORY_CACHE_TURNS`` messages: it is filled from the
+database the first time the conversation is read and appended to whenever
+an exchange is saved. Conversations are evicted least recently used first
+once the buffers together exceed ``HISTORY_CACHE_MAX_BYTES``.
+
+Reads and appends happen on the event loop, and the chat scheduler runs
+the updates of one chat one after another, so a read never races the write
+of the same conversation. The cache lives in one webhook process, so every
+conversation is cached at a version, ``Client.updated_at``: saving an
+exchange (in any process) or deleting a message moves it, and a read with
+the client row just loaded for the update misses when the versions differ.
+"""
+import os
+import sys
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Hashable, Iterable, List, Optional
+
+HISTORY_CACHE_TURNS = int(os.getenv("HISTORY_CACHE_TURNS", "10"))
+HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Approximate cost of one cached message besides its text: the dict, the
+# role string reference and the deque slot
+MESSAGE_OVERHEAD = 250
+CONVERSATION_OVERHEAD = 700
+
+
+def message_size(message: Dict[str, str]) -> int:
+    return MESSAGE_OVERHEAD + sys.getsizeof(message.get("content", ""))
+
+
+class _Conversation:
+    __slots__ = ("messages", "size", "version")
+
+    def __init__(self, turns: int, version: Hashable = None):
+        self.messages: Deque[Dict[str, str]] = deque(maxlen=turns)
+        self.size = CONVERSATION_OVERHEAD
+        self.version = version
+
+    def append(self, message: Dict[str, str]) -> None:
+        if len(self.messages) == self.messages.maxlen:
+            self.size -= message_size(self.messages[0])
+        self.messages.append(message)
+        self.size += message_size(message)
+
+
+class HistoryCache:
+    """Ring buffers of recent messages by conversation, LRU-evicted by memory."""
+
+    def __init__(self, turns: int = HISTORY_CACHE_TURNS, max_bytes: int = HISTORY_CACHE_MAX_BYTES):
+        self.turns = turns
+        self.max_bytes = max_bytes
+        self.conversations: "OrderedDict[Hashable, _Conversation]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, limit: int, version: Hashable = None) -> Optional[List[Dict[str, str]]]:
+        """Return the last ``limit`` messages, oldest first, or None on a miss.
+
+        A conversation cached at another ``version`` is a miss.
+        """
+        conversation = self.conversations.get(key)
+        # Longer histories than the buffer holds always come from the database
+        if conversation is None or limit > self.turns or conversation.version != version:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conversations.move_to_end(key)
+        messages = list(conversation.messages)
+        return messages[-limit:] if limit else []
+
+    def load(self, key: Hashable, messages: Iterable[Dict[str, str]], version: Hashable = None) -> None:
+        """Store a conversation read from the database at ``version``, oldest message first."""
+        conversation = _Conversation(self.turns, version)
+        for message in messages:
+            conversation.append(message)
+        self._replace(key, conversation)
+
+    def append(self, key: Hashable, messages: Iterable[Dict[str, str]],
+               since: Hashable = None, version: Hashable = None) -> None:
+        """Add messages saved on top of version ``since``, moving the conversation to ``version``.
+
+        Conversations that are not cached are left alone and ones cached at
+        another version are dropped; the next read loads them from the
+        database including these messages.
+        """
+        conversation = self.conversations.get(key)
+        if conversation is None:
+            return
+        if conversation.version != since:
+            self.invalidate(key)
+            return
+        conversation.version = version
+        before = conversation.size
+        for message in messages:
+            conversation.append(message)
+        self.bytes += conversation.size - before
+        self.conversations.move_to_end(key)
+        self._evict()
+
+    def invalidate(self, key: Hashable) -> None:
+        conversation = self.conversations.pop(key, None)
+        if conversation is not None:
+            self.bytes -= conversation.size
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "conversations": len(self.conversations),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def _replace(self, key: Hashable, conversation: _Conversation) -> None:
+        self.invalidate(key)
+        self.conversations[key] = conversation
+        self.bytes += conversation.size
+        self._evict()
+
+    def _evict(self) -> None:
+        # The most recent conversation stays even if it alone is over the limit
+        while self.bytes > self.max_bytes and len(self.conversations) > 1:
+            _, conversation = self.conversations.popitem(last=False)
+            self.bytes -= conversation.size
+            self.evictions += 1
+
+
+def connect_signals(cache: HistoryCache) -> None:
+    """Drop cached conversations whose messages or client are deleted in this process."""
+    from django.db.models.signals import post_delete
+    from admin_panel.models import Message
+    from users.models import Client
+
+    def on_message_delete(sender, instance, **kwargs):
+        cache.invalidate((instance.company_id, instance.user_id))
+
+    def on_client_delete(sender, instance, **kwargs):
+        cache.invalidate((instance.company_id, instance.pk))
+
+    post_delete.connect(on_message_delete, sender=Message, weak=False, dispatch_uid="history_cache_message")
+    post_delete.connect(on_client_delete, sender=Client, weak=False, dispatch_uid="history_cache_client")
+
+
+history_cache = HistoryCache()
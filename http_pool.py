@@ -0,0 +1,225 @@
+"""Shared outbound HTTP for the bot: one keep-alive connection pool per host.
+
+Telegram and the translation service go through ``pool``, the
+``HTTPPool`` created when the app starts and closed when it stops. Each
+host gets its own ``httpx.AsyncClient``, so a slow destination can only
+exhaust its own connections. HTTP/2 is used when the ``h2`` package is
+installed. Timeouts and retries come from the host's ``Destination``:
+
+- failures to connect (the request was never sent) are always retried
+- ``retry_statuses`` (by default 429 and 503, "not processed") are retried
+  after Retry-After or an exponential backoff
+- read errors are retried only for ``retry_methods``, so a POST that may
+  have reached Telegram is not sent twice
+
+Per host the pool keeps request, retry and failure counts, latency
+percentiles over recent requests, and how many requests are in flight
+against the connection limit (saturation); see ``stats``. The LLM
+providers keep their own pools in ``llm_clients``.
+"""
+import asyncio
+import importlib.util
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, FrozenSet, Optional
+
+import httpx
+
+logger = logging.getLogger("uvicorn")
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+# HTTP/2 needs the optional h2 package (pip install httpx[http2])
+HTTP2 = (os.getenv("HTTP2", "true").lower() in ("1", "true", "yes")
+         and importlib.util.find_spec("h2") is not None)
+
+# Latency percentiles are computed over this many recent requests per host
+LATENCY_SAMPLES = 1000
+# Longest Retry-After we are willing to wait, in seconds
+MAX_RETRY_AFTER = 5.0
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+@dataclass(frozen=True)
+class Destination:
+    """Timeouts, retry policy and connection limits for one host."""
+    timeout: float = HTTP_TIMEOUT
+    connect_timeout: float = HTTP_CONNECT_TIMEOUT
+    retries: int = HTTP_RETRIES
+    # Seconds before the first retry, doubled for each next one
+    backoff: float = 0.2
+    retry_statuses: FrozenSet[int] = frozenset({429, 503})
+    # Methods also retried after a read error or timeout
+    retry_methods: FrozenSet[str] = IDEMPOTENT_METHODS
+    max_connections: int = HTTP_MAX_CONNECTIONS
+    max_keepalive_connections: int = HTTP_MAX_KEEPALIVE_CONNECTIONS
+    http2: bool = True
+
+    def retryable_error(self, method: str, error: httpx.TransportError) -> bool:
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+            return True
+        return method.upper() in self.retry_methods
+
+    def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Seconds to wait before retry number ``attempt`` (1-based)."""
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), MAX_RETRY_AFTER)
+        except ValueError:
+            pass
+        return self.backoff * 2 ** (attempt - 1)
+
+
+DEFAULT_DESTINATION = Destination()
+
+
+@dataclass
+class HostStats:
+    """Counters and recent latencies of one host's requests."""
+    max_connections: int
+    requests: int = 0
+    failures: int = 0
+    retries: int = 0
+    pool_timeouts: int = 0
+    in_flight: int = 0
+    peak_in_flight: int = 0
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_SAMPLES))
+
+    def started(self) -> None:
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def finished(self, seconds: float, failed: bool = False) -> None:
+        self.in_flight -= 1
+        self.latencies.append(seconds)
+        self.failures += failed
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+
+        def percentile(share: float) -> float:
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * share))] * 1000, 1) if latencies else 0.0
+
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "retries": self.retries,
+            "pool_timeouts": self.pool_timeouts,
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            # Share of the host's connection limit in use
+            "saturation": round(self.in_flight / self.max_connections, 3),
+            "peak_saturation": round(self.peak_in_flight / self.max_connections, 3),
+        }
+
+
+class HTTPPool:
+    """Async HTTP clients by host, with per-destination policies and metrics.
+
+    Args:
+        destinations: Policies by host name; other hosts get ``default``
+        transport: Transport for every client (tests use ``httpx.MockTransport``)
+    """
+
+    def __init__(self, destinations: Optional[Dict[str, Destination]] = None,
+                 default: Destination = DEFAULT_DESTINATION,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.destinations = dict(destinations or {})
+        self.default = default
+        self.transport = transport
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+        self.hosts: Dict[str, HostStats] = {}
+
+    def configure(self, host: str, destination: Destination) -> None:
+        """Set the policy for ``host``; takes effect for clients created afterwards."""
+        self.destinations[host] = destination
+
+    def destination(self, host: str) -> Destination:
+        return self.destinations.get(host, self.default)
+
+    def client(self, host: str) -> httpx.AsyncClient:
+        """The pooled client for ``host``, created on first use."""
+        client = self.clients.get(host)
+        if client is None:
+            destination = self.destination(host)
+            client = self.clients[host] = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=destination.max_connections,
+                    max_keepalive_connections=destination.max_keepalive_connections,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(destination.timeout, connect=destination.connect_timeout),
+                http2=HTTP2 and destination.http2,
+                transport=self.transport,
+            )
+        return client
+
+    async def start(self) -> None:
+        """Create the clients of the configured hosts up front (TLS setup is not free)."""
+        for host in self.destinations:
+            self.client(host)
+        logger.info(f"HTTP pool ready for {len(self.clients)} hosts (HTTP/2: {HTTP2})")
+
+    async def aclose(self) -> None:
+        clients, self.clients = self.clients, {}
+        await asyncio.gather(*(client.aclose() for client in clients.values()), return_exceptions=True)
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request through the host's pool, retrying as its destination allows."""
+        host = httpx.URL(url).host
+        destination = self.destination(host)
+        client = self.client(host)
+        stats = self.hosts.get(host)
+        if stats is None:
+            stats = self.hosts[host] = HostStats(destination.max_connections)
+        attempt = 0
+        while True:
+            stats.started()
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                stats.finished(time.perf_counter() - started, failed=True)
+                stats.pool_timeouts += isinstance(e, httpx.PoolTimeout)
+                if attempt >= destination.retries or not destination.retryable_error(method, e):
+                    raise
+                retry_after = None
+                logger.warning(f"{method} {host} failed ({type(e).__name__}), retrying")
+            else:
+                stats.finished(time.perf_counter() - started, failed=response.status_code >= 500)
+                if attempt >= destination.retries or response.status_code not in destination.retry_statuses:
+                    return response
+                retry_after = response.headers.get("Retry-After")
+                await response.aclose()
+                logger.warning(f"{method} {host} returned {response.status_code}, retrying")
+            attempt += 1
+            stats.retries += 1
+            await asyncio.sleep(destination.delay(attempt, retry_after))
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "http2": HTTP2,
+            "hosts": {host: stats.snapshot() for host, stats in self.hosts.items()},
+        }
+
+
+# Shared by every outbound caller in the bot process
+pool = HTTPPool()
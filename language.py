@@ -0,0 +1,162 @@
+"""Deterministic language detection for short ru/kz/en client messages.
+
+Only the languages a company can be configured for (``Company.language``)
+are told apart, in microseconds and with the same answer for the same
+text every time:
+
+1. Script. Letters only Kazakh uses (ә ғ қ ң ө ұ ү һ і, and the Latin "i"
+   Kazakh users type for "і" inside Cyrillic words) mean Kazakh; mostly
+   Latin letters mean English.
+2. Other Cyrillic text is scored by a character trigram model of Russian
+   and Kazakh, trained at import from the small samples below, with a
+   prior towards Russian, the more common language of Cyrillic messages.
+
+Messages that are too short to tell ("ок", "?", "100") are not trusted:
+``detect_for_client`` answers them with the client's last confidently
+detected language, remembered in ``Client.settings``.
+"""
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# Client.settings key of the last confidently detected language
+CLIENT_LANGUAGE_KEY = "detected_language"
+
+# Fewer letters than this never change a client's remembered language
+MIN_CONFIDENT_LETTERS = 8
+# Mean log-likelihood ratio per trigram needed to trust a ru/kz decision
+MIN_MARGIN = 0.15
+# log P(ru) - log P(kz) before looking at the text
+RUSSIAN_PRIOR = math.log(3)
+
+KAZAKH_LETTERS = frozenset("әғқңөұүһі")
+_LETTERS = re.compile(r"[^\W\d_]+")
+# A Latin "i" between Cyrillic letters stands for the Kazakh "і" (сiз, бiлу)
+_LATIN_I_IN_CYRILLIC = re.compile(r"(?<=[а-яё])i|i(?=[а-яё])")
+
+RUSSIAN_SAMPLE = """
+здравствуйте добрый день подскажите пожалуйста сколько стоит абонемент на месяц
+хочу записаться на прием к врачу на завтра утром можно ли перенести запись на другое время
+какие у вас цены на услуги и есть ли скидки для студентов и пенсионеров
+где вы находитесь как до вас доехать есть ли парковка рядом с офисом
+спасибо большое за помощь всего доброго до свидания
+у меня вопрос по оплате можно оплатить картой или только наличными
+во сколько вы открываетесь в субботу и работаете ли вы в воскресенье
+мне нужна консультация специалиста по этому вопросу свяжите меня с менеджером
+я не могу дозвониться до администратора ответьте пожалуйста как можно скорее
+сколько длится процедура и нужно ли как-то готовиться заранее
+а если я опоздаю на десять минут меня примут или придется переносить
+отправьте пожалуйста прайс на все услуги и адрес филиала в центре города
+можно ли прийти с ребенком есть ли детская группа по выходным
+как отменить заказ и вернуть деньги за неиспользованное занятие
+понятно хорошо договорились тогда до встречи
+это очень дорого а есть что-нибудь подешевле для начинающих
+ваш бот ничего не понимает позовите живого человека
+какие документы нужны для записи и можно ли все сделать онлайн
+""".split()
+
+KAZAKH_SAMPLE = """
+сәлеметсіз бе қайырлы күн айтыңызшы бір айлық абонемент қанша тұрады
+ертең таңертең дәрігердің қабылдауына жазылғым келеді жазылуды басқа уақытқа ауыстыруға бола ма
+қызметтеріңіздің бағасы қандай студенттер мен зейнеткерлерге жеңілдік бар ма
+сіздер қай жерде орналасқансыздар қалай жетуге болады кеңсенің жанында көлік тұрағы бар ма
+көмегіңіз үшін көп рахмет сау болыңыз көріскенше
+менің төлем бойынша сұрағым бар картамен төлеуге бола ма әлде тек қолма-қол ақша ма
+сенбі күні нешеде ашыласыздар жексенбі күні жұмыс істейсіздер ме
+маған осы мәселе бойынша маманның кеңесі керек мені менеджермен байланыстырыңызшы
+әкімшіге қоңырау шала алмай жатырмын тезірек жауап беріңізші
+процедура қанша уақытқа созылады алдын ала дайындалу керек пе
+он минутқа кешіксем мені қабылдайсыздар ма әлде ауыстыру керек пе
+барлық қызметтердің бағасын және қала орталығындағы филиалдың мекенжайын жіберіңізші
+баламен келуге бола ма демалыс күндері балалар тобы бар ма
+тапсырысты қалай болдырмауға болады пайдаланылмаған сабақ үшін ақшаны қайтара аласыздар ма
+түсінікті жақсы келістік онда кездескенше
+бұл өте қымбат бастаушыларға арзанырақ бірдеңе бар ма
+сіздің ботыңыз ештеңе түсінбейді тірі адамды шақырыңыз
+жазылу үшін қандай құжаттар керек барлығын онлайн жасауға бола ма
+рахмет жарайды иә жоқ бар ма калай кандай канша керек болады
+""".split()
+
+
+class Detection(NamedTuple):
+    # "ru", "kz", "en" or None when the text has no letters
+    language: Optional[str]
+    # Whether the text was long and clear enough to remember for the client
+    confident: bool
+
+
+def _trigrams(word: str):
+    padded = f" {word} "
+    return (padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _train(words) -> Tuple[Dict[str, float], float]:
+    counts = Counter(trigram for word in words for trigram in _trigrams(word))
+    total = sum(counts.values()) + len(counts) + 1
+    # Add-one smoothing; unseen trigrams get the log-probability returned second
+    return {trigram: math.log((count + 1) / total) for trigram, count in counts.items()}, math.log(1 / total)
+
+
+_RUSSIAN, _RUSSIAN_UNSEEN = _train(RUSSIAN_SAMPLE)
+_KAZAKH, _KAZAKH_UNSEEN = _train(KAZAKH_SAMPLE)
+
+
+def _script_counts(words) -> Tuple[int, int]:
+    cyrillic = latin = 0
+    for word in words:
+        for char in word:
+            if "а" <= char <= "я" or char == "ё" or char in KAZAKH_LETTERS:
+                cyrillic += 1
+            elif "a" <= char <= "z":
+                latin += 1
+    return cyrillic, latin
+
+
+@lru_cache(maxsize=4096)
+def detect(text: str) -> Detection:
+    """Language of ``text`` and whether it is certain enough to remember."""
+    words = _LETTERS.findall(_LATIN_I_IN_CYRILLIC.sub("і", text.casefold()))
+    cyrillic, latin = _script_counts(words)
+    letters = cyrillic + latin
+    if not letters:
+        return Detection(None, False)
+    confident = letters >= MIN_CONFIDENT_LETTERS
+    if latin > cyrillic:
+        return Detection("en", confident)
+    if any(char in KAZAKH_LETTERS for word in words for char in word):
+        return Detection("kz", True)
+
+    margin = RUSSIAN_PRIOR
+    trigrams = 0
+    for word in words:
+        for trigram in _trigrams(word):
+            margin += _RUSSIAN.get(trigram, _RUSSIAN_UNSEEN) - _KAZAKH.get(trigram, _KAZAKH_UNSEEN)
+            trigrams += 1
+    language = "ru" if margin >= 0 else "kz"
+    return Detection(language, confident and abs(margin) / trigrams >= MIN_MARGIN)
+
+
+def detect_language(text: str) -> Optional[str]:
+    return detect(text).language
+
+
+def detect_for_client(text: str, settings: dict, default: Optional[str] = None) -> Tuple[Optional[str], bool]:
+    """Language of a client's message, falling back to their remembered one.
+
+    A confident detection is remembered in ``settings`` (``Client.settings``)
+    under CLIENT_LANGUAGE_KEY; short or unclear messages get the remembered
+    language, or ``default`` (the company language) for a new client.
+
+    Returns:
+        tuple: The language, and whether ``settings`` changed and should be saved
+    """
+    detection = detect(text)
+    remembered = settings.get(CLIENT_LANGUAGE_KEY)
+    if detection.confident:
+        if detection.language != remembered:
+            settings[CLIENT_LANGUAGE_KEY] = detection.language
+            return detection.language, True
+        return detection.language, False
+    return remembered or detection.language or default, False
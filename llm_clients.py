@@ -0,0 +1,84 @@
+"""Async OpenAI-compatible LLM clients with tuned connection pools.
+
+Each provider gets its own ``AsyncOpenAI`` client on top of a keep-alive
+``httpx.AsyncClient``, so a single worker can have hundreds of completions
+in flight without opening a new connection for each of them.
+"""
+import os
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Sequence
+
+import httpx
+from openai import AsyncOpenAI
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "200"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "50"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+
+
+class Provider(NamedTuple):
+    """An LLM backend: display name, client and model to request."""
+    name: str
+    client: AsyncOpenAI
+    model: str
+
+
+def create_http_client(transport: Optional[httpx.AsyncBaseTransport] = None) -> httpx.AsyncClient:
+    """Create the pooled HTTP client used underneath one provider."""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        transport=transport,
+    )
+
+
+def create_client(api_key: Optional[str], base_url: Optional[str] = None,
+                  http_client: Optional[httpx.AsyncClient] = None) -> AsyncOpenAI:
+    """Create an async OpenAI-compatible client with its own connection pool."""
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=LLM_TIMEOUT,
+        max_retries=LLM_MAX_RETRIES,
+        http_client=http_client or create_http_client(),
+    )
+
+
+async def complete(provider: Provider, messages: List[Dict[str, str]],
+                   timeout: Optional[float] = None) -> str:
+    """Request a single chat completion from a provider."""
+    completion = await provider.client.chat.completions.create(
+        model=provider.model,
+        messages=messages,
+        timeout=timeout or LLM_TIMEOUT,
+    )
+    return completion.choices[0].message.content
+
+
+async def stream(provider: Provider, messages: List[Dict[str, str]],
+                 timeout: Optional[float] = None) -> AsyncIterator[str]:
+    """Stream a chat completion from a provider as text chunks."""
+    response = await provider.client.chat.completions.create(
+        model=provider.model,
+        messages=messages,
+        stream=True,
+        timeout=timeout or LLM_TIMEOUT,
+    )
+    try:
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        await response.close()
+
+
+async def close(providers: Sequence[Provider]) -> None:
+    """Close the connection pools of all providers."""
+    for provider in providers:
+        await provider.client.close()
@@ -0,0 +1,301 @@
+"""Latency-driven routing and hedged requests across LLM providers.
+
+Every call records its latency in a rolling window per provider. Providers
+are ranked by learned weights (fast and reliable first) and, in hedging
+mode, a second provider is fired when the first has not answered within
+its own p95 latency; the first reply wins and the other call is cancelled.
+Non-streaming completions return the first token together with the last,
+so time to completion is what is measured for them; streamed replies
+(``ReplyStream``) record and hedge on the time to the first chunk.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+import llm_clients
+from llm_clients import Provider
+
+logger = logging.getLogger("uvicorn")
+
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "10"))
+# Used until a provider has enough samples for a meaningful p95
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "3"))
+LLM_HEDGE_MIN_SAMPLES = 20
+
+# Upper bounds (seconds) of the histogram buckets exposed for inspection
+HISTOGRAM_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, float("inf"))
+
+
+class ProviderStats:
+    """Rolling latency samples and outcome counters of one provider."""
+
+    __slots__ = ("latencies", "outcomes", "calls", "errors", "cancelled", "wins")
+
+    def __init__(self, window: int):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.wins = 0
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+
+class LatencyTracker:
+    """Learns provider weights from a rolling latency histogram."""
+
+    def __init__(self, window: int = LLM_LATENCY_WINDOW):
+        self.window = window
+        self.stats: Dict[str, ProviderStats] = {}
+
+    def _stats(self, name: str) -> ProviderStats:
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = ProviderStats(self.window)
+        return stats
+
+    def record(self, name: str, latency: float, ok: bool = True) -> None:
+        """Record a finished call."""
+        stats = self._stats(name)
+        stats.calls += 1
+        stats.latencies.append(latency)
+        stats.outcomes.append(ok)
+        if not ok:
+            stats.errors += 1
+
+    def record_cancelled(self, name: str, elapsed: float) -> None:
+        """Record a call cancelled by a faster one; it took at least ``elapsed``.
+
+        Only a call that already outlived its hedge delay is a latency sample
+        (a slow one, in the tail). One cancelled sooner was merely beaten and
+        its truncated time would drag p50/p95 down.
+        """
+        stats = self._stats(name)
+        stats.cancelled += 1
+        if elapsed >= self.hedge_delay(name):
+            stats.latencies.append(elapsed)
+
+    def record_win(self, name: str) -> None:
+        self._stats(name).wins += 1
+
+    def weights(self, names: Sequence[str]) -> Dict[str, float]:
+        """Routing weights (summing to 1): inverse median latency scaled by success rate.
+
+        Providers without samples get the best known weight so they are
+        tried and measured.
+        """
+        raw = {}
+        for name in names:
+            stats = self.stats.get(name)
+            median = stats.percentile(0.5) if stats else None
+            if median is not None:
+                raw[name] = (1.0 - stats.error_rate) / max(median, 1e-3)
+        best = max(raw.values(), default=1.0)
+        for name in names:
+            raw.setdefault(name, best)
+        total = sum(raw.values()) or 1.0
+        return {name: value / total for name, value in raw.items()}
+
+    def rank(self, providers: Sequence[Provider]) -> List[Provider]:
+        """Providers ordered by weight, configured order breaking ties."""
+        weights = self.weights([p.name for p in providers])
+        return sorted(providers, key=lambda p: -weights[p.name])
+
+    def expected_latency(self) -> Optional[float]:
+        """Median latency of the fastest measured provider, None before any call."""
+        medians = [stats.percentile(0.5) for stats in self.stats.values() if stats.latencies]
+        return min(medians) if medians else None
+
+    def hedge_delay(self, name: str) -> float:
+        """How long to wait for ``name`` before firing a backup request."""
+        stats = self.stats.get(name)
+        if stats is None or len(stats.latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY
+        return min(max(stats.percentile(0.95), LLM_HEDGE_MIN_DELAY), LLM_HEDGE_MAX_DELAY)
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Per-provider stats for inspection (e.g. a metrics endpoint)."""
+        weights = self.weights(list(self.stats))
+        result = {}
+        for name, stats in self.stats.items():
+            histogram = dict.fromkeys((str(bound) for bound in HISTOGRAM_BUCKETS), 0)
+            for latency in stats.latencies:
+                bound = next(b for b in HISTOGRAM_BUCKETS if latency <= b)
+                histogram[str(bound)] += 1
+            result[name] = {
+                "weight": round(weights[name], 4),
+                "p50": stats.percentile(0.5),
+                "p95": stats.percentile(0.95),
+                "hedge_delay": self.hedge_delay(name),
+                "error_rate": round(stats.error_rate, 4),
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "cancelled": stats.cancelled,
+                "wins": stats.wins,
+                "histogram": histogram,
+            }
+        return result
+
+
+async def _timed(tracker: LatencyTracker, provider: Provider, messages: List[Dict[str, str]],
+                 timeout: Optional[float]) -> str:
+    started = time.perf_counter()
+    try:
+        reply = await llm_clients.complete(provider, messages, timeout)
+    except asyncio.CancelledError:
+        tracker.record_cancelled(provider.name, time.perf_counter() - started)
+        raise
+    except Exception:
+        tracker.record(provider.name, time.perf_counter() - started, ok=False)
+        raise
+    if not reply:
+        tracker.record(provider.name, time.perf_counter() - started, ok=False)
+        raise ValueError(f"Empty reply from {provider.name}")
+    tracker.record(provider.name, time.perf_counter() - started)
+    return reply
+
+
+async def generate_routed(providers: Sequence[Provider], messages: List[Dict[str, str]],
+                          tracker: LatencyTracker, timeout: Optional[float] = None) -> Tuple[str, str]:
+    """Try providers one after another, fastest first."""
+    last_error = None
+    for provider in tracker.rank(providers):
+        try:
+            reply = await _timed(tracker, provider, messages, timeout)
+            tracker.record_win(provider.name)
+            return reply, provider.name
+        except Exception as e:
+            logger.warning(f"LLM provider {provider.name} failed: {e}")
+            last_error = e
+    raise RuntimeError(f"All LLM providers failed: {last_error}")
+
+
+async def _race(providers: Sequence[Provider], tracker: LatencyTracker,
+                start: Callable[[Provider], Awaitable], hedge: bool):
+    """Run ``start`` on the fastest provider, hedging and falling back to the others.
+
+    Returns:
+        tuple: (result of the winning ``start`` call, winning provider)
+    """
+    queue = tracker.rank(providers)
+    running: Dict[asyncio.Task, Provider] = {}
+    last_error = None
+
+    def launch():
+        provider = queue.pop(0)
+        running[asyncio.create_task(start(provider))] = provider
+        return provider
+
+    try:
+        hedge_after = tracker.hedge_delay(launch().name)
+        while running:
+            done, _ = await asyncio.wait(
+                running, timeout=hedge_after if hedge and queue else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                backup = launch()
+                logger.info(f"Hedging LLM request with {backup.name} after {hedge_after:.2f}s")
+                hedge_after = tracker.hedge_delay(backup.name)
+                continue
+            for task in done:
+                provider = running.pop(task)
+                if task.exception() is None:
+                    tracker.record_win(provider.name)
+                    return task.result(), provider
+                last_error = task.exception()
+                logger.warning(f"LLM provider {provider.name} failed: {last_error}")
+            # Everything that finished failed, move on to the next provider
+            if queue:
+                hedge_after = tracker.hedge_delay(launch().name)
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            # Losers may have finished in the same round as the winner
+            for result in await asyncio.gather(*running, return_exceptions=True):
+                if isinstance(result, tuple) and hasattr(result[0], "aclose"):
+                    await result[0].aclose()
+    raise RuntimeError(f"All LLM providers failed: {last_error}")
+
+
+async def generate_hedged(providers: Sequence[Provider], messages: List[Dict[str, str]],
+                          tracker: LatencyTracker, timeout: Optional[float] = None) -> Tuple[str, str]:
+    """Send to the fastest provider and hedge with the next one after its p95.
+
+    A backup is also started right away when a running call fails. The
+    first successful reply is returned and the calls still running are
+    cancelled.
+    """
+    reply, provider = await _race(
+        providers, tracker, lambda p: _timed(tracker, p, messages, timeout), hedge=True,
+    )
+    return reply, provider.name
+
+
+class ReplyStream:
+    """Streams a reply from the fastest provider, optionally hedged.
+
+    Iterate it for text chunks; ``service_used`` is set once a provider has
+    produced its first chunk. A provider failing before that falls through
+    to the next one, after that the error is raised to the caller.
+    """
+
+    def __init__(self, providers: Sequence[Provider], messages: List[Dict[str, str]],
+                 tracker: LatencyTracker, hedge: bool = False, timeout: Optional[float] = None):
+        self.providers = providers
+        self.messages = messages
+        self.tracker = tracker
+        self.hedge = hedge
+        self.timeout = timeout
+        self.service_used: Optional[str] = None
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._chunks()
+
+    async def _chunks(self) -> AsyncIterator[str]:
+        chunks, first = await self._first_chunk()
+        try:
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    async def _start(self, provider: Provider):
+        """Open a stream and wait for its first chunk, recording the latency."""
+        started = time.perf_counter()
+        chunks = llm_clients.stream(provider, self.messages, self.timeout)
+        try:
+            first = await chunks.__anext__()
+        except asyncio.CancelledError:
+            self.tracker.record_cancelled(provider.name, time.perf_counter() - started)
+            await chunks.aclose()
+            raise
+        except BaseException:
+            self.tracker.record(provider.name, time.perf_counter() - started, ok=False)
+            await chunks.aclose()
+            raise
+        self.tracker.record(provider.name, time.perf_counter() - started)
+        return chunks, first
+
+    async def _first_chunk(self):
+        (chunks, first), provider = await _race(self.providers, self.tracker, self._start, self.hedge)
+        self.service_used = provider.name
+        return chunks, first
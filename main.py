@@ -1,14 +1,14 @@
 from fastapi import FastAPI, Request, Depends
+import asyncio
 import os
 from datetime import datetime
-from typing import Dict, Any
+from functools import lru_cache
+from typing import Dict, Any, Optional
 from dotenv import load_dotenv
-from openai import OpenAI
 from database import SessionLocal
 from sqlalchemy.orm import Session
 import django
 import logging
-import pytz
 from django.conf import settings
 
 logger = logging.getLogger("uvicorn")
@@ -21,21 +21,89 @@ django.setup()
 
 from web.admin_panel.models import Message
 from users.models import Company, Client
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+from admin_panel import analytics
+import repository
+import llm_clients
+import llm_routing
+import telegram_api
+import profiles
+import handoff
+import http_pool
+import history_cache
+import language
+import summaries
+import faq_cache
+import response_cache
+import retrieval
+import rules
+import prompts
+from prompts import build_prompt
+import tenants
+import translation
+import vector_store
+import work_queue
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 NEBIUS_API_KEY = os.getenv("NEBIUS_API_KEY")
+TELEGRAM_STREAMING = os.getenv("TELEGRAM_STREAMING", "false").lower() in ("1", "true", "yes")
+LLM_HEDGING = os.getenv("LLM_HEDGING", "false").lower() in ("1", "true", "yes")
 HANDOFF_PHRASE = os.getenv("HANDOFF_PHRASE", "Позвольте мне передать ваш вопрос нашему специалисту. Ожидайте, пожалуйста.")
 
-# OpenAI Client
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-nebius_client = OpenAI(
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+NEBIUS_MODEL = os.getenv("NEBIUS_MODEL", "meta-llama/Meta-Llama-3.1-70B-Instruct")
+
+# LLM clients (async, each with its own keep-alive connection pool)
+openai_client = llm_clients.create_client(api_key=OPENAI_API_KEY)
+nebius_client = llm_clients.create_client(
     base_url="https://api.studio.nebius.com/v1/",
     api_key=NEBIUS_API_KEY
 )
+llm_providers = [
+    llm_clients.Provider("OpenAI", openai_client, OPENAI_MODEL),
+    llm_clients.Provider("Nebius", nebius_client, NEBIUS_MODEL),
+]
+llm_latency = llm_routing.LatencyTracker()
+# Background summary calls are timed apart so their long prompts do not skew live routing
+summary_latency = llm_routing.LatencyTracker()
+
+# Telegram token -> company, kept in memory
+tenant_table = tenants.TenantTable()
+
+# Durable queue of accepted updates, drained by the workers started below
+update_queue = work_queue.WorkQueue()
+
+# Compiled company profiles, one per config version
+profile_cache = profiles.ProfileCache()
 
 # FastAPI App
 app = FastAPI()
 
+# Welcome, thanks, off-hours and restricted-topic replies, checked before anything else
+rule_stage = rules.RuleStage()
+
+# Replies to literally repeated messages
+reply_cache = response_cache.ResponseCache()
+
+# FAQ answers (and reusable LLM answers) matched by meaning, per company
+answer_cache = faq_cache.FAQCache(repository.run_db, expected_latency=llm_latency.expected_latency)
+
+# BM25 over FAQs and policies, the best matches are added to the prompt; with an
+# EMBEDDING_MODEL also nearest neighbours from the memory-mapped vector stores
+retriever = retrieval.Retriever(
+    repository.run_db,
+    vectors=vector_store.VectorStores(answer_cache.embedder.dim) if answer_cache.embedder.semantic else None,
+    embedder=answer_cache.embedder,
+)
+
+# Translates the rare reply the model wrote in the wrong language
+translator = translation.Translator()
+
+# Folds old turns of long conversations into Client.summary in the background
+summarizer = summaries.Summarizer(
+    repository.run_db,
+    lambda messages: llm_routing.generate_routed(llm_providers, messages, summary_latency),
+    overloaded=lambda: summaries.llm_busy(app.state.queue_workers.scheduler, llm_latency),
+)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -43,10 +111,155 @@ def get_db():
     finally:
         db.close()
 
+@app.on_event("startup")
+async def start_http_pool():
+    await http_pool.pool.start()
+
+@app.on_event("startup")
+async def load_tenant_table():
+    try:
+        tenant_table.replace(await repository.run_db(tenants.fetch_rows))
+    except Exception as e:
+        # The webhook falls back to database lookups until a refresh succeeds
+        logger.error(f"Error loading tenant table: {e}")
+    tenants.connect_signals(tenant_table)
+    profiles.connect_signals(profile_cache)
+    history_cache.connect_signals(history_cache.history_cache)
+    faq_cache.connect_signals(answer_cache)
+    retrieval.connect_signals(retriever, asyncio.get_running_loop())
+    app.state.tenant_refresh = asyncio.create_task(
+        tenants.refresh_periodically(tenant_table, repository.run_db)
+    )
+    logger.info(f"Loaded {len(tenant_table.by_token)} tenants")
+
+@app.on_event("startup")
+async def start_update_queue():
+    await update_queue.open()
+    app.state.queue_workers = work_queue.QueueWorkers(update_queue, process_update)
+    app.state.queue_workers.start()
+
+@app.on_event("shutdown")
+async def stop_update_queue():
+    # Before the clients below are closed, so in-flight updates can finish
+    await app.state.queue_workers.stop()
+    await update_queue.close()
+
+@app.on_event("startup")
+async def start_analytics_flush():
+    app.state.analytics_flush = asyncio.create_task(analytics.flush_periodically(repository.run_db))
+
+@app.on_event("shutdown")
+async def flush_analytics():
+    # After the queue workers stopped, before the database pools close
+    app.state.analytics_flush.cancel()
+    try:
+        await repository.run_db(analytics.accumulator.flush, write=True)
+    except Exception as e:
+        logger.error(f"Error flushing analytics: {e}")
+
+@app.on_event("startup")
+async def start_summarizer():
+    app.state.summarizer = asyncio.create_task(summarizer.run_periodically())
+
+@app.on_event("shutdown")
+async def stop_summarizer():
+    app.state.summarizer.cancel()
+
+@app.on_event("shutdown")
+async def stop_tenant_refresh():
+    app.state.tenant_refresh.cancel()
+
+@app.on_event("shutdown")
+async def shutdown_db_pool():
+    repository.shutdown_executors(wait=False)
+
+@app.on_event("shutdown")
+async def shutdown_llm_clients():
+    await llm_clients.close(llm_providers)
+
+@app.on_event("shutdown")
+async def shutdown_http_pool():
+    await http_pool.pool.aclose()
+
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics/tenants")
+async def tenant_metrics():
+    return tenant_table.stats()
+
+@app.get("/metrics/queue")
+async def queue_metrics():
+    return {**await update_queue.stats(), "scheduler": app.state.queue_workers.stats()}
+
+@app.get("/metrics/dedup")
+async def dedup_metrics():
+    """Redelivered updates dropped since startup, by company."""
+    hits = {}
+    for token, count in update_queue.duplicates_by_token.items():
+        record = tenant_table.by_token.get(token)
+        name = record.name if record else "unknown"
+        hits[name] = hits.get(name, 0) + count
+    return {"total": update_queue.duplicates, "companies": hits}
+
+@app.get("/metrics/analytics")
+async def analytics_metrics():
+    return analytics.accumulator.stats()
+
+@app.get("/metrics/profiles")
+async def profile_metrics():
+    return profile_cache.stats()
+
+@app.get("/metrics/history")
+async def history_metrics():
+    return history_cache.history_cache.stats()
+
+@app.get("/metrics/prompts")
+async def prompt_metrics():
+    return {**prompts.prefix_cache.stats(), "tokens": prompts.token_stats.stats()}
+
+@app.get("/metrics/summaries")
+async def summary_metrics():
+    return summarizer.stats()
+
+@app.get("/metrics/responses")
+async def response_cache_metrics():
+    return reply_cache.stats()
+
+@app.get("/metrics/faq")
+async def faq_metrics():
+    """Semantic cache hits and the LLM time they saved, by company."""
+    stats = answer_cache.stats()
+    companies = {}
+    for company_id, company_stats in stats["companies"].items():
+        profile = profile_cache.profiles.get(company_id)
+        companies[profile.name if profile else str(company_id)] = company_stats
+    return {**stats, "companies": companies}
+
+@app.get("/metrics/retrieval")
+async def retrieval_metrics():
+    return retriever.stats()
+
+@app.get("/metrics/rules")
+async def rules_metrics():
+    """Messages answered with a canned reply, i.e. LLM calls avoided."""
+    return rule_stage.stats()
+
+@app.get("/metrics/http")
+async def http_metrics():
+    """Outbound requests per host: latency, retries and connection pool saturation."""
+    return http_pool.pool.stats()
+
+@app.get("/metrics/translation")
+async def translation_metrics():
+    """How often replies needed translating and the time it added."""
+    return translator.stats()
+
+@app.get("/metrics/llm")
+async def llm_metrics():
+    return {"hedging": LLM_HEDGING, "providers": llm_latency.snapshot()}
+
 
 
 def get_company_settings(company_id: int, db: Session) -> Dict[str, Any]:
@@ -110,320 +323,312 @@ def get_company_settings(company_id: int, db: Session) -> Dict[str, Any]:
         }
     }  
 
+def load_company_policy(company_id: int) -> Dict[str, Any]:
+    """Load the script profile for a company outside of a request session."""
+    db = SessionLocal()
+    try:
+        return get_company_settings(company_id, db)
+    finally:
+        db.close()
+
+async def get_profile(company) -> Optional[profiles.CompanyProfile]:
+    """Return the compiled profile for ``company``, compiling it on a version change."""
+    profile = profile_cache.get(company.pk, company.config_version)
+    if profile is None:
+        profile = await repository.run_db(profiles.load_profile, company.pk)
+        if profile is not None:
+            profile_cache.put(profile)
+    return profile
+
 def is_working_hours(working_hours: Dict[str, str], timezone_str: str = "Asia/Almaty") -> bool:
     """Check if current time is within working hours.
-    
+
+    Webhook code should use ``profile.is_open()``; this compiles (once per
+    distinct value, cached) the same weekly schedule from raw settings.
+
     Args:
         working_hours: Dictionary mapping weekdays to time ranges (e.g., {"monday": "9:00-18:00"})
         timezone_str: Timezone string (default: "Asia/Almaty")
-        
+
     Returns:
         bool: True if current time is within working hours, False otherwise
     """
-    try:
-        # Get current time in the specified timezone
-        tz = pytz.timezone(timezone_str)
-        now = datetime.now(tz)
-        current_weekday = now.strftime("%A").lower()
-        
-        # Get working hours for current day (case-insensitive)
-        day_hours = working_hours.get(current_weekday)
-        if not day_hours:
-            return False
-            
-        # Parse working hours (format: "HH:MM-HH:MM")
-        try:
-            start_time_str, end_time_str = day_hours.strip().split("-")
-            start_time = datetime.strptime(start_time_str.strip(), "%H:%M").time()
-            end_time = datetime.strptime(end_time_str.strip(), "%H:%M").time()
-        except (ValueError, AttributeError) as e:
-            logger.error(f"Invalid time format in working hours: {day_hours}. Error: {e}")
-            return False
-            
-        current_time = now.time()
-        
-        # Handle overnight working hours (e.g., 22:00-06:00)
-        if end_time < start_time:
-            return current_time >= start_time or current_time <= end_time
-        return start_time <= current_time <= end_time
-        
-    except pytz.exceptions.UnknownTimeZoneError as e:
-        logger.error(f"Unknown timezone: {timezone_str}. Error: {e}")
-        return True  # Default to True to avoid blocking messages due to timezone issues
-    except Exception as e:
-        logger.error(f"Error checking working hours: {e}", exc_info=True)
-        return True  # Default to True to avoid blocking messages on error  # Default to available if there's an error
+    return _weekly_schedule(tuple(working_hours.items()), timezone_str).is_open()
 
-def build_prompt(script_profile: dict, user_message: str, history: list = None, 
-                user_settings: dict = None, user_data: Client = None) -> str:
-    """Create a prompt for the AI model using the script profile.
-    
-    Args:
-        script_profile: Bot's script profile configuration
-        user_message: Current user message
-        history: List of previous messages in the conversation
-        user_settings: User-specific settings
-        user_data: Client model instance with additional user info
-        
-    Returns:
-        str: Formatted prompt for the AI model
+@lru_cache(maxsize=1024)
+def _weekly_schedule(working_hours: tuple, timezone_str: str) -> profiles.WeeklySchedule:
+    schedule = profiles.compile_schedule("is_working_hours", working_hours)
+    return profiles.compile_weekly_schedule(schedule, timezone_str)
+
+def should_handoff(reply: str, handoff_triggers: tuple = ()) -> Optional[handoff.HandoffMatch]:
+    """Check if the conversation should be handed off to a human operator.
+
+    Returns the trigger or phrase that fired, or None.
     """
-    if history is None:
-        history = []
-    if user_settings is None:
-        user_settings = {}
+    return handoff.compile_matcher(tuple(handoff_triggers)).match(reply)
 
-    # Build context sections
-    sections = []
-    
-    # 1. Bot Identity and Role
-    company_name = script_profile.get('company', 'компания')
-    sections.append(f"""Ты - {company_name} чат-бот. 
-Ты вежливый и профессиональный ассистент, который помогает клиентам с их вопросами.""")
-    
-    # 2. Working Hours
-    working_hours = script_profile.get('working_hours', {})
-    if working_hours:
-        working_hours_list = [
-            f"- {day.capitalize()}: {hours if hours else 'Выходной'}" 
-            for day, hours in working_hours.items()
-        ]
-        sections.append("\n\nЧасы работы:\n" + "\n".join(working_hours_list))
-    
-    # 3. Company Information
-    company_info = script_profile.get('company_info', {})
-    if company_info:
-        info_lines = []
-        if desc := company_info.get('description'):
-            info_lines.append(desc)
-        if address := company_info.get('address'):
-            info_lines.append(f"Адрес: {address}")
-        if phone := company_info.get('phone'):
-            info_lines.append(f"Телефон: {phone}")
-        if email := company_info.get('email'):
-            info_lines.append(f"Email: {email}")
-        if website := company_info.get('website'):
-            info_lines.append(f"Сайт: {website}")
-            
-        if info_lines:
-            sections.append("\n\nО компании:\n" + "\n".join(info_lines))
-    
-    # 6. User Context
-    if user_data:
-        user_info = []
-        if full_name := getattr(user_data, 'full_name', ''):
-            user_info.append(f"Имя: {full_name}")
-        if phone := getattr(user_data, 'phone_number', ''):
-            user_info.append(f"Телефон: {phone}")
-            
-        if user_info:
-            sections.append("\n\nИнформация о пользователе:\n" + "\n".join(user_info))
-    
-    # 7. Conversation History
-    if history:
-        history_lines = ["\n\nИстория переписки:"]
-        for msg in history[-5:]:  # Last 5 messages for context
-            role = "Пользователь" if msg.get("role") == "user" else "Ассистент"
-            history_lines.append(f"{role}: {msg.get('content', '')}")
-        sections.append("\n".join(history_lines))
-    
-    # 8. Current Message
-    sections.append(f"\n\nПользователь: {user_message}")
+
+async def generate_ai_response(messages: list):
+    """Generate a reply from the currently fastest provider.
     
-    # 9. Instructions
-    tone = script_profile.get('bot_settings', {}).get('tone', 'вежливым и профессиональным')
-    off_topic = script_profile.get('messages', {}).get('off_topic', 'вежливо укажи на это')
-    unknown = script_profile.get('messages', {}).get('unknown', 'предложи связаться с оператором')
+    With LLM_HEDGING enabled a backup request goes to the other provider
+    when the first one is slower than its usual p95, otherwise the other
+    provider is only a fallback.
     
-    instructions = f"""
-    Инструкции:
-    1. Отвечай на том же языке, на котором был задан вопрос.
-    2. Будь {tone}.
-    3. Если вопрос не по теме, {off_topic}.
-    4. Если не знаешь ответа, {unknown}.
+    Returns:
+        tuple: (reply text, name of the service used)
     """
-    
-    sections.append(instructions)
-    
-    # Combine all sections
-    system_prompt = "".join(sections)
-    
-    # Prepare messages for the chat model
-    messages = [{"role": "system", "content": system_prompt}]
-    
-    # Add conversation history
-    for msg in history[-10:]:  # Last 10 messages for context
-        role = "user" if msg.get("role") == "user" else "assistant"
-        messages.append({"role": role, "content": msg.get("content", "")})
-    
-    # Add current user message
-    messages.append({"role": "user", "content": user_message})
-    
-    return messages
+    if LLM_HEDGING:
+        return await llm_routing.generate_hedged(llm_providers, messages, llm_latency)
+    return await llm_routing.generate_routed(llm_providers, messages, llm_latency)
 
 
-def should_handoff(reply: str, handoff_triggers: list = None):
-    """Check if the conversation should be handed off to a human operator."""
-    if not reply:
-        return False
-        
-    handoff_triggers = handoff_triggers or ["help"]
-    reply_lower = reply.lower()
-    
-    # Check for handoff trigger phrases
-    for trigger in handoff_triggers:
-        if isinstance(trigger, str) and trigger.lower() in reply_lower:
-            return True
-    
-    # Check for uncertainty in the response
-    uncertainty_phrases = [
-        "не знаю", "не уверен", "не могу ответить", 
-        "не располагаю информацией", "не могу помочь",
-        "извините, но я не могу", "к сожалению, я не могу"
-    ]
-    
-    for phrase in uncertainty_phrases:
-        if phrase in reply_lower:
-            return True
+def stream_ai_response(messages: list) -> llm_routing.ReplyStream:
+    """Stream a reply chunk by chunk, see generate_ai_response.
     
-    # Check if the response is too short or seems like a fallback
-    if len(reply.strip()) < 10 and any(word in reply_lower for word in ["извините", "понимаю", "попробуйте"]):
-        return True
-            
-    return False
+    The name of the service used is available as ``service_used`` once
+    the first chunk has arrived.
+    """
+    return llm_routing.ReplyStream(llm_providers, messages, llm_latency, hedge=LLM_HEDGING)
+
+
+async def send_telegram_message(bot_token: str, chat_id: int, text: str):
+    """Send a message to a Telegram chat of the company's bot (``bot_token``)."""
+    return await telegram_api.send_message(bot_token, chat_id, text)
+
+
+async def notify_admin(bot_token: str, admin_id: str, client: Client, user_message: str,
+                       profile: profiles.CompanyProfile):
+    """Notify the company admin that a conversation needs an operator."""
+    username = f" (@{client.username})" if client.username else ""
+    text = (
+        f"Требуется оператор\n"
+        f"Компания: {profile.name}\n"
+        f"Клиент: {client.name}{username}\n"
+        f"Сообщение: {user_message}"
+    )
+    await send_telegram_message(bot_token, admin_id, text)
+
+
+async def resolve_company(company_token: str):
+    """Get company by token (the routing table knows every token once loaded)."""
+    if tenant_table.loaded:
+        return tenant_table.lookup(company_token)
+    return await repository.get_company_by_token(company_token)
 
 
 @app.post("/webhook/{company_token}")
-async def webhook(request: Request, company_token: str, db: Session = Depends(get_db)):
+async def webhook(request: Request, company_token: str):
+    """Accept an update: validate it, persist it and answer Telegram right away.
+    
+    The update is processed by the queue workers (see process_update), so
+    slow LLM calls no longer keep Telegram waiting and redelivering.
+    """
+    company = await resolve_company(company_token)
+    if not company:
+        logger.error(f"Company not found with token: {company_token}")
+        return {"status": "error", "message": "Company not found"}
+
     try:
-        # Get company by token
-        company = db.query(Company).filter(Company.telegram_token == company_token).first()
+        data = await request.json()
+    except ValueError:
+        return {"status": "error", "message": "Invalid update"}
+    if not isinstance(data, dict) or "update_id" not in data:
+        return {"status": "error", "message": "Invalid update"}
+
+    queue_id = await update_queue.enqueue(company_token, data)
+    return {"status": "queued" if queue_id else "duplicate"}
+
+
+async def process_update(update: work_queue.QueuedUpdate):
+    """Handle one queued update and log the outcome.
+
+    A failure before the reply reached Telegram propagates, so the queue
+    retries the update and parks it as dead after its last attempt.
+    """
+    last_attempt = update.attempts >= work_queue.WORK_QUEUE_MAX_ATTEMPTS
+    result = await handle_update(update.company_token, update.payload,
+                                 retry=update.attempts > 1, last_attempt=last_attempt)
+    logger.info(f"Processed update {update.payload.get('update_id')}: {result}")
+    return result
+
+
+async def handle_update(company_token: str, data: Dict[str, Any], retry: bool = False,
+                        last_attempt: bool = True):
+    """Answer one Telegram update.
+
+    Errors raised before the reply was sent are re-raised for the queue to
+    retry. An LLM failure is retried as well unless this is the
+    ``last_attempt`` (or a streamed reply is already visible), in which case
+    the company's error message is sent instead.
+
+    The exchange is stored with its ``update_id`` right after the reply is
+    sent, and a ``retry`` whose exchange is stored is dropped. A client can
+    therefore only get a reply twice if the process dies between the
+    Telegram send and that save; a save that fails is logged and the
+    update is not retried.
+    """
+    # Set once the reply reached the client, a retry after that would send it twice
+    delivered = False
+    try:
+        company = await resolve_company(company_token)
         if not company:
             logger.error(f"Company not found with token: {company_token}")
             return {"status": "error", "message": "Company not found"}
             
-        # Load company policy
-        script_profile = load_company_policy(company.id)
+        # Compiled company profile (recompiled only when the company was saved)
+        profile = await get_profile(company)
+        if profile is None:
+            logger.error(f"Company {company.pk} disappeared before its profile was loaded")
+            return {"status": "error", "message": "Company not found"}
         
-        # Process webhook data
-        data = await request.json()
         logger.info(f"Received webhook data: {data}")
         
         # Handle different update types
         if "message" in data:
             message = data["message"]
             chat_id = message["chat"]["id"]
-            telegram_user_id = message["from"]["id"]
+
+            # Answered before the previous attempt crashed or was interrupted
+            if retry and await repository.is_answered(company, data["update_id"]):
+                logger.info(f"Update {data['update_id']} was already answered")
+                return {"status": "duplicate"}
             
             # Get or create client
-            client = db.query(Client).filter(Client.telegram_id == telegram_user_id, Client.company == company).first()
-            if not client:
-                # Create new client
-                client = Client(
-                    telegram_id=telegram_user_id,
-                    company=company,
-                    username=message["from"].get("username"),
-                    settings={"preferred_language": "ru"}  # Default language
-                )
-                db.add(client)
-                db.commit()
-                db.refresh(client)
-            
-            # Update client data if available
-            if "first_name" in message["from"]:
-                client.username = message["from"].get("username", "")
-                db.commit()
-                db.refresh(client)
+            client = await repository.get_or_create_client(company, message["from"])
             
             # Get text message
             text = message.get("text", "").strip()
-            # Get conversation history for this client
-            history = db.query(Message).filter(
-                Message.company == company,
-                Message.user == client
-            ).order_by(Message.timestamp.desc()).limit(10).all()  # Last 10 messages
-            
-            # Get user settings
-            user_settings = client.settings or {}
-            
-            # Detect language of incoming message
-            detected_language = detect_language(text)
-    
-            # Build the prompt with detected language
-            messages = build_prompt(script_profile, text, history, user_settings, client, detected_language)
+
+            # Detect language of incoming message, short ones get the client's usual language
+            if client.settings is None:
+                client.settings = {}
+            detected_language, remembered = language.detect_for_client(text, client.settings, profile.language)
+            if remembered:
+                await repository.save_client_settings(client)
+
             reply = None
             service_used = None
-            
-            try:
-                reply, service_used = await generate_ai_response(messages)
-            except Exception as e:
-                logger.error(f"Error generating AI response: {e}")
-                reply = script_profile.get('messages', {}).get('error', 'Произошла ошибка при обработке запроса. Пожалуйста, попробуйте позже.')
+            streaming_reply = None
+            history = []
+            # Set when the LLM produced the reply
+            generated = False
+
+            # /start, thanks, off hours and restricted topics get the company's canned reply
+            if canned := rule_stage.apply(profile, text):
+                logger.info(f"Answered with the {canned.rule} rule: {text}")
+                reply, service_used = canned.reply, "rules"
+            # The same question was answered recently: no history, prompt or LLM needed
+            elif text and (reply := reply_cache.get(company.pk, profile.config_version, text, detected_language)) is not None:
+                logger.info(f"Answered from the response cache: {text}")
+                service_used = "cache"
+            # A close enough FAQ (or earlier validated) answer skips the LLM
+            elif cached := (await answer_cache.lookup(company.pk, profile.config_version, text) if text else None):
+                logger.info(f"Answered from {cached.source} (score {cached.score:.2f}): {cached.question}")
+                reply, service_used = cached.answer, "FAQ"
+            else:
+                # Get conversation history for this client
+                history = await repository.get_history(company, client, limit=10)  # Last 10 messages
+
+                # Get user settings
+                user_settings = client.settings or {}
+
+                # FAQ and policy entries relevant to the message
+                knowledge = await retriever.retrieve(company.pk, profile.config_version, text) if text else []
+
+                # Build the prompt with detected language
+                messages = build_prompt(profile, text, history, user_settings, client,
+                                        detected_language=detected_language, knowledge=knowledge)
+                logger.info(f"Prompt tokens for {company.name}: {messages.tokens}")
+
+                try:
+                    if TELEGRAM_STREAMING:
+                        # Show the reply while it is generated, the final text is set below
+                        streaming_reply = telegram_api.StreamingReply(company_token, chat_id)
+                        stream = stream_ai_response(messages)
+                        async for chunk in stream:
+                            await streaming_reply.feed(chunk)
+                        reply, service_used = streaming_reply.text, stream.service_used
+                        logger.info(f"Time to first visible text: {streaming_reply.time_to_first_text}")
+                    else:
+                        reply, service_used = await generate_ai_response(messages)
+                    generated = True
+                except Exception as e:
+                    logger.error(f"Error generating AI response: {e}")
+                    if not last_attempt and (streaming_reply is None or streaming_reply.message_id is None):
+                        raise
+                    reply = profile.messages.error or 'Произошла ошибка при обработке запроса. Пожалуйста, попробуйте позже.'
                 
-            # If reply is in English but detected language was Russian, translate it
-            if detected_language == 'ru' and is_english(reply):
-                reply = translate_to_russian(reply)
+            # The prompt pins the language; a reply that still came back in English is translated
+            reply = await translator.ensure_language(reply, detected_language)
                 
-            # Save the user message
-            user_message = Message.create_with_response_time(
-                content=text,
-                company=company,
-                user=client,
-                is_bot_response=False
-            )
-
-            # Save the bot response
-            bot_response = Message.create_with_response_time(
-                content=reply,
-                company=company,
-                user=client,
-                is_bot_response=True
-            )
-
-            # Update daily analytics
-            Analytics.update_daily_analytics(company)
-
             # Добавляем информацию об использованном сервисе
             reply_with_service = f"{reply}\n\n[Использован: {service_used}]"
 
+            async def record():
+                # Save the user message and the bot response, update daily analytics
+                await repository.save_exchange(company, client, text, reply, update_id=data["update_id"])
+                summarizer.touch(client.pk)
+
+            async def deliver(body):
+                nonlocal delivered
+                # In streaming mode the reply message already exists, finalize it
+                if streaming_reply is not None:
+                    await streaming_reply.finish(body)
+                else:
+                    await send_telegram_message(company_token, chat_id, body)
+                delivered = True
+                await record()
+
             # Проверка необходимости передачи оператору
             handoff_phrase = os.getenv("HANDOFF_PHRASE", "Позвольте мне передать ваш вопрос нашему специалисту")
             logger.info(f"Проверка необходимости передачи оператору. Ответ: {reply}")
             logger.info(f"Handoff phrase: {handoff_phrase}")
             
-            if should_handoff(reply, script_profile.get("handoff_trigger", [])):
-                logger.info("Обнаружена необходимость передачи оператору")
-                admin_settings = script_profile.get("admin_settings", {})
-                admin_id = admin_settings.get("admin_id")
-                notifications_enabled = admin_settings.get("notifications_enabled", False)
+            if service_used != "rules" and (handoff_match := profile.handoff_matcher.match(reply)):
+                logger.info(f"Обнаружена необходимость передачи оператору: "
+                            f"{handoff_match.source} \"{handoff_match.trigger}\"")
+                admin_id = profile.admin_id
+                notifications_enabled = profile.notifications_enabled
                 
                 logger.info(f"Настройки админа: ID={admin_id}, notifications_enabled={notifications_enabled}")
                 
                 if not admin_id or not notifications_enabled:
-                    logger.error(f"Неверные настройки админа: {admin_settings}")
-                    await send_telegram_message(chat_id, "Извините, не удалось связаться с оператором. Попробуйте позже.")
+                    logger.error(f"Неверные настройки админа: ID={admin_id}, notifications_enabled={notifications_enabled}")
+                    if streaming_reply is not None and streaming_reply.message_id is not None:
+                        await streaming_reply.finish(reply_with_service)
+                    await send_telegram_message(company_token, chat_id, "Извините, не удалось связаться с оператором. Попробуйте позже.")
+                    delivered = True
+                    await record()
                     return {"status": "handoff_failed", "reason": "invalid_admin_settings"}
 
                 try:
                     # Отправляем уведомление админу до ответа пользователю
-                    await notify_admin(admin_id, user_info, user_message, script_profile)
+                    await notify_admin(company_token, admin_id, client, text, profile)
                     logger.info("Уведомление админу отправлено успешно")
-                    
-                    # Отправляем ответ пользователю
-                    await send_telegram_message(chat_id, reply_with_service)
-                    return {"status": "handoff_required"}
+                    result = {"status": "handoff_required"}
                 except Exception as notify_error:
                     logger.error(f"Ошибка при уведомлении админа: {notify_error}")
-                    # Даже если не удалось уведомить админа, отправляем ответ пользователю
-                    await send_telegram_message(chat_id, reply_with_service)
-                    return {"status": "handoff_failed", "reason": "notification_error"}
+                    result = {"status": "handoff_failed", "reason": "notification_error"}
+
+                # Отправляем ответ пользователю, даже если не удалось уведомить админа
+                await deliver(reply_with_service)
+                return result
             else:
                 # Если не требуется передача оператору, просто отправляем ответ
-                await send_telegram_message(chat_id, reply_with_service)
+                if service_used == "FAQ":
+                    reply_cache.put(company.pk, profile.config_version, text, detected_language, reply)
+                elif generated and faq_cache.is_reusable(text, reply, history, client):
+                    await answer_cache.remember(company.pk, profile.config_version, text, reply)
+                    reply_cache.put(company.pk, profile.config_version, text, detected_language, reply)
+                await deliver(reply_with_service)
                 return {"status": "ok", "service_used": service_used}
 
     except Exception as e:
-        logger.error(f"Unexpected error in webhook: {e}")
+        if not delivered:
+            logger.error(f"Error handling update {data.get('update_id')}, will retry: {e}")
+            raise
+        logger.error(f"Unexpected error in webhook after the reply was sent: {e}")
         return {"status": "error", "error": "Internal server error"}
 
 
@@ -0,0 +1,417 @@
+"""Compiled, immutable company profiles.
+
+``CompanyProfile`` holds everything the webhook needs about a company with
+list fields, triggers and working hours already parsed. Profiles are
+compiled once per ``Company.config_version`` (bumped on every save) and
+cached, so a settings change in the admin panel is picked up on the next
+message without a restart.
+
+Working hours are compiled with the profile into a ``WeeklySchedule``:
+open intervals in minutes since Monday 00:00 local time and the resolved
+timezone, so "is the company open" is a timezone conversion and a bisect.
+``ScheduleTable`` stacks many schedules into arrays to answer "which of
+these companies are open now" in one vectorized pass.
+"""
+import logging
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from datetime import datetime, timezone as dt_timezone, tzinfo
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pytz
+
+from handoff import HandoffMatcher, compile_matcher
+from rules import DEFAULT_REFUSALS, RuleSet, compile_rules
+
+logger = logging.getLogger("uvicorn")
+
+# Same default as Company.history_token_budget
+HISTORY_TOKEN_BUDGET = 1500
+
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+# (start, end) in minutes since midnight, None when closed
+DayHours = Optional[Tuple[int, int]]
+# Configured hours that could not be parsed: closed in the schedule, but not
+# a reason to tell the client the company is closed
+UNKNOWN_HOURS: DayHours = (-1, -1)
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def parse_list(value: Any) -> Tuple[str, ...]:
+    """Normalize a JSON list or a comma separated string into a tuple of strings."""
+    if not value:
+        return ()
+    if isinstance(value, str):
+        value = value.split(",")
+    return tuple(item.strip() for item in value if isinstance(item, str) and item.strip())
+
+
+def parse_hours(value: Optional[str]) -> DayHours:
+    """Parse "HH:MM-HH:MM" into minutes since midnight.
+
+    Raises:
+        ValueError: if the value is not a valid range
+    """
+    if not value or not value.strip():
+        return None
+    start, end = value.strip().split("-")
+    return _parse_time(start), _parse_time(end)
+
+
+def _parse_time(value: str) -> int:
+    hours, minutes = value.strip().split(":")
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or (hours == 24 and minutes):
+        raise ValueError(f"Invalid time: {value}")
+    return hours * 60 + minutes
+
+
+@lru_cache(maxsize=None)
+def resolve_timezone(name: str) -> tzinfo:
+    try:
+        return pytz.timezone(name)
+    except pytz.exceptions.UnknownTimeZoneError:
+        logger.error(f"Unknown timezone {name}, using UTC")
+        return pytz.utc
+
+
+def minute_of_week(tz: tzinfo, now: Optional[datetime] = None) -> int:
+    """Minutes since Monday 00:00 in ``tz`` at ``now`` (aware, defaults to the current time)."""
+    local = (now or datetime.now(dt_timezone.utc)).astimezone(tz)
+    return local.weekday() * MINUTES_PER_DAY + local.hour * 60 + local.minute
+
+
+@dataclass(frozen=True, slots=True)
+class WeeklySchedule:
+    """Open intervals [start, end) in minutes of the week, Monday 00:00 local time first."""
+    starts: Tuple[int, ...]
+    ends: Tuple[int, ...]
+    tz: tzinfo
+    # Weekdays (0 is Monday) whose hours could not be parsed
+    unknown_days: Tuple[int, ...] = ()
+
+    @classmethod
+    def compile(cls, schedule: Tuple[DayHours, ...], timezone: str) -> "WeeklySchedule":
+        """Build from parsed hours per weekday.
+
+        Overnight hours (22:00-06:00) run into the next day, Sunday night
+        into Monday; equal start and end mean closed. The closing minute is
+        still open, as in the original per-message check ("9:00-18:00"
+        answers at 18:00, not at 18:01), so a stored end is one minute
+        after the configured one.
+        """
+        intervals = []
+        unknown_days = tuple(day for day, hours in enumerate(schedule) if hours == UNKNOWN_HOURS)
+        for day, hours in enumerate(schedule):
+            if hours is None or hours[0] == hours[1]:
+                continue
+            start = day * MINUTES_PER_DAY + hours[0]
+            end = day * MINUTES_PER_DAY + hours[1] + (MINUTES_PER_DAY if hours[1] < hours[0] else 0)
+            # "24:00" already ends the day
+            end += hours[1] < MINUTES_PER_DAY
+            if end > MINUTES_PER_WEEK:
+                intervals.append((0, end - MINUTES_PER_WEEK))
+                end = MINUTES_PER_WEEK
+            intervals.append((start, end))
+        merged: List[List[int]] = []
+        for start, end in sorted(intervals):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return cls(tuple(start for start, _ in merged), tuple(end for _, end in merged), resolve_timezone(timezone),
+                   unknown_days)
+
+    def is_open_at(self, minute: int) -> bool:
+        i = bisect_right(self.starts, minute) - 1
+        return i >= 0 and minute < self.ends[i]
+
+    def is_open(self, now: Optional[datetime] = None) -> bool:
+        return self.is_open_at(minute_of_week(self.tz, now))
+
+    def is_closed(self, now: Optional[datetime] = None) -> bool:
+        """Outside the working hours, as far as known: False on a day whose hours did not parse."""
+        minute = minute_of_week(self.tz, now)
+        return not self.is_open_at(minute) and minute // MINUTES_PER_DAY not in self.unknown_days
+
+
+@lru_cache(maxsize=4096)
+def compile_weekly_schedule(schedule: Tuple[DayHours, ...], timezone: str) -> WeeklySchedule:
+    return WeeklySchedule.compile(schedule, timezone)
+
+
+@dataclass(frozen=True, slots=True)
+class BotMessages:
+    welcome: Optional[str] = None
+    fallback: Optional[str] = None
+    handoff: Optional[str] = None
+    off_hours: Optional[str] = None
+    thanks: Optional[str] = None
+    error: Optional[str] = None
+    off_topic: Optional[str] = None
+    unknown: Optional[str] = None
+
+
+@dataclass(frozen=True, slots=True)
+class CompanyInfo:
+    description: Optional[str] = None
+    address: Optional[str] = None
+    phone: Optional[str] = None
+    email: Optional[str] = None
+    website: Optional[str] = None
+
+
+@dataclass(frozen=True, slots=True)
+class CompanyProfile:
+    """Everything the bot needs about one company, parsed once."""
+    company_id: Optional[int]
+    config_version: int
+    name: str
+    language: str = "ru"
+    timezone: str = "Asia/Almaty"
+    # (weekday, "HH:MM-HH:MM") as configured, for display in the prompt
+    working_hours: Tuple[Tuple[str, str], ...] = ()
+    # Parsed hours per weekday, Monday first
+    schedule: Tuple[DayHours, ...] = (None,) * 7
+    messages: BotMessages = BotMessages()
+    info: CompanyInfo = CompanyInfo()
+    allowed_topics: Tuple[str, ...] = ()
+    restricted_topics: Tuple[str, ...] = ()
+    handoff_triggers: Tuple[str, ...] = ()
+    tone: Optional[str] = None
+    admin_id: Optional[str] = None
+    notifications_enabled: bool = False
+    response_delay: int = 0
+    typing_duration: int = 0
+    max_retries: int = 3
+    enable_analytics: bool = True
+    collect_feedback: bool = True
+    available_languages: Tuple[str, ...] = ()
+    # Tokens of conversation history sent with each prompt
+    history_token_budget: int = HISTORY_TOKEN_BUDGET
+    # Welcome/thanks/off-hours messages and topic refusals are sent without the LLM
+    canned_replies_enabled: bool = True
+    # Compiled from handoff_triggers
+    handoff_matcher: HandoffMatcher = field(init=False, repr=False, compare=False)
+    # Compiled from schedule and timezone
+    weekly_schedule: WeeklySchedule = field(init=False, repr=False, compare=False)
+    # Compiled from messages and restricted_topics
+    rules: RuleSet = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "handoff_matcher", compile_matcher(self.handoff_triggers))
+        object.__setattr__(self, "weekly_schedule", compile_weekly_schedule(self.schedule, self.timezone))
+        refusal = self.messages.off_topic or DEFAULT_REFUSALS.get(self.language, DEFAULT_REFUSALS["ru"])
+        object.__setattr__(self, "rules", compile_rules(
+            self.messages.welcome, self.messages.thanks, self.messages.off_hours, refusal, self.restricted_topics))
+
+    def is_open(self, now: Optional[datetime] = None) -> bool:
+        """Whether the company is within its working hours."""
+        return self.weekly_schedule.is_open(now)
+
+    def is_closed(self, now: Optional[datetime] = None) -> bool:
+        """Whether the company is known to be outside its working hours (see WeeklySchedule.is_closed)."""
+        return self.weekly_schedule.is_closed(now)
+
+    @classmethod
+    def from_company(cls, company) -> "CompanyProfile":
+        """Compile a profile from a ``users.Company`` instance."""
+        working_hours = tuple((day, getattr(company, f"{day}_hours") or "") for day in WEEKDAYS)
+        return cls(
+            company_id=company.pk,
+            config_version=company.config_version,
+            name=company.name,
+            language=company.language,
+            timezone=company.timezone,
+            working_hours=working_hours,
+            schedule=compile_schedule(company.name, working_hours),
+            messages=BotMessages(
+                welcome=company.welcome_message,
+                fallback=company.fallback_message,
+                handoff=company.handoff_message,
+                off_hours=company.off_hours_message,
+                thanks=company.thanks_message,
+            ),
+            info=CompanyInfo(
+                description=company.description,
+                address=company.address,
+                phone=company.phone,
+                email=company.email,
+                website=company.website,
+            ),
+            allowed_topics=parse_list(company.allowed_topics),
+            restricted_topics=parse_list(company.restricted_topics),
+            handoff_triggers=parse_list(company.handoff_trigger),
+            admin_id=company.admin_id,
+            notifications_enabled=company.notifications_enabled,
+            response_delay=company.response_delay,
+            typing_duration=company.typing_duration,
+            max_retries=company.max_retries,
+            enable_analytics=company.enable_analytics,
+            collect_feedback=company.collect_feedback,
+            available_languages=parse_list(company.available_languages),
+            history_token_budget=company.history_token_budget,
+            canned_replies_enabled=company.canned_replies_enabled,
+        )
+
+    @classmethod
+    def from_script_profile(cls, script_profile: Dict[str, Any]) -> "CompanyProfile":
+        """Compile a profile from a script profile dict (e.g. a policy JSON file)."""
+        messages = script_profile.get("messages") or {}
+        info = script_profile.get("company_info") or {}
+        admin = script_profile.get("admin_settings") or {}
+        bot = script_profile.get("bot_settings") or {}
+        working_hours = tuple((script_profile.get("working_hours") or {}).items())
+        name = script_profile.get("company", "компания")
+        return cls(
+            company_id=script_profile.get("company_id"),
+            config_version=script_profile.get("config_version", 0),
+            name=name,
+            language=script_profile.get("language", "ru"),
+            timezone=script_profile.get("timezone", "Asia/Almaty"),
+            working_hours=working_hours,
+            schedule=compile_schedule(name, working_hours),
+            messages=BotMessages(**{
+                field: messages.get(field) for field in BotMessages.__dataclass_fields__
+            }),
+            info=CompanyInfo(**{
+                field: info.get(field) for field in CompanyInfo.__dataclass_fields__
+            }),
+            allowed_topics=parse_list(script_profile.get("allowed_topics")),
+            restricted_topics=parse_list(script_profile.get("restricted_topics")),
+            handoff_triggers=parse_list(script_profile.get("handoff_trigger")),
+            tone=bot.get("tone"),
+            admin_id=admin.get("admin_id"),
+            notifications_enabled=admin.get("notifications_enabled", False),
+            response_delay=bot.get("response_delay", 0),
+            typing_duration=bot.get("typing_duration", 0),
+            max_retries=bot.get("max_retries", 3),
+            enable_analytics=bot.get("enable_analytics", True),
+            collect_feedback=bot.get("collect_feedback", True),
+            available_languages=parse_list(bot.get("available_languages")),
+            history_token_budget=bot.get("history_token_budget", HISTORY_TOKEN_BUDGET),
+            canned_replies_enabled=bot.get("canned_replies_enabled", True),
+        )
+
+
+def compile_schedule(company_name: str, working_hours: Iterable[Tuple[str, str]]) -> Tuple[DayHours, ...]:
+    """Parse (weekday, "HH:MM-HH:MM") pairs into hours for Monday..Sunday.
+
+    Invalid values are logged under the company name and kept as
+    ``UNKNOWN_HOURS``: closed for the schedule, unknown for the off-hours reply.
+    """
+    configured = dict(working_hours)
+    schedule = []
+    for day in WEEKDAYS:
+        try:
+            schedule.append(parse_hours(configured.get(day)))
+        except ValueError:
+            logger.error(f"Invalid working hours for {company_name} on {day}: {configured.get(day)}")
+            schedule.append(UNKNOWN_HOURS)
+    return tuple(schedule)
+
+
+class ScheduleTable:
+    """Weekly schedules of many companies stacked into arrays.
+
+    Each company is a row of interval starts and ends, padded with empty
+    intervals; the current minute of the week is computed once per
+    timezone, then one broadcast comparison answers for every company.
+    """
+
+    def __init__(self, schedules: Dict[int, WeeklySchedule]):
+        self.company_ids = np.array(list(schedules), dtype=np.int64)
+        width = max((len(schedule.starts) for schedule in schedules.values()), default=0) or 1
+        self.starts = np.zeros((len(schedules), width), dtype=np.int32)
+        self.ends = np.zeros((len(schedules), width), dtype=np.int32)
+        rows_by_tz: Dict[tzinfo, List[int]] = {}
+        for row, schedule in enumerate(schedules.values()):
+            self.starts[row, :len(schedule.starts)] = schedule.starts
+            self.ends[row, :len(schedule.ends)] = schedule.ends
+            rows_by_tz.setdefault(schedule.tz, []).append(row)
+        self.rows_by_tz = {tz: np.array(rows, dtype=np.int64) for tz, rows in rows_by_tz.items()}
+
+    @classmethod
+    def from_profiles(cls, profiles: Iterable[CompanyProfile]) -> "ScheduleTable":
+        return cls({profile.company_id: profile.weekly_schedule for profile in profiles})
+
+    def open_mask(self, now: Optional[datetime] = None) -> np.ndarray:
+        """Boolean array, True for rows (``company_ids`` order) open at ``now``."""
+        now = now or datetime.now(dt_timezone.utc)
+        minutes = np.empty(len(self.company_ids), dtype=np.int32)
+        for tz, rows in self.rows_by_tz.items():
+            minutes[rows] = minute_of_week(tz, now)
+        minutes = minutes[:, None]
+        return ((self.starts <= minutes) & (minutes < self.ends)).any(axis=1)
+
+    def open_companies(self, now: Optional[datetime] = None) -> List[int]:
+        return self.company_ids[self.open_mask(now)].tolist()
+
+
+def fetch_schedule_table() -> ScheduleTable:
+    """Schedules of all companies (blocking, run it on the DB pool)."""
+    from users.models import Company
+    fields = ["pk", "timezone"] + [f"{day}_hours" for day in WEEKDAYS]
+    schedules = {}
+    for row in Company._base_manager.values_list(*fields):
+        company_id, timezone, hours = row[0], row[1], row[2:]
+        schedule = compile_schedule(str(company_id), zip(WEEKDAYS, (value or "" for value in hours)))
+        schedules[company_id] = compile_weekly_schedule(schedule, timezone)
+    return ScheduleTable(schedules)
+
+
+class ProfileCache:
+    """Compiled profiles by company id, valid for one config version each."""
+
+    def __init__(self):
+        self.profiles: Dict[int, CompanyProfile] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, company_id: int, config_version: int) -> Optional[CompanyProfile]:
+        """Return the cached profile unless it is older than ``config_version``."""
+        profile = self.profiles.get(company_id)
+        # A newer profile can come from a save signal before the caller's
+        # version (e.g. from the tenant table) has been refreshed
+        if profile is None or profile.config_version < config_version:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return profile
+
+    def put(self, profile: CompanyProfile) -> CompanyProfile:
+        self.profiles[profile.company_id] = profile
+        return profile
+
+    def invalidate(self, company_id: int) -> None:
+        self.profiles.pop(company_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"profiles": len(self.profiles), "hits": self.hits, "misses": self.misses}
+
+
+def load_profile(company_id: int) -> Optional[CompanyProfile]:
+    """Read a company and compile its profile (blocking, run it on the DB pool)."""
+    from users.models import Company
+    company = Company._base_manager.filter(pk=company_id).first()
+    return CompanyProfile.from_company(company) if company else None
+
+
+def connect_signals(cache: ProfileCache) -> None:
+    """Recompile a company's profile as soon as it is saved in this process."""
+    from django.db.models.signals import post_delete, post_save
+    from users.models import Company
+
+    def on_save(sender, instance, **kwargs):
+        cache.put(CompanyProfile.from_company(instance))
+
+    def on_delete(sender, instance, **kwargs):
+        cache.invalidate(instance.pk)
+
+    post_save.connect(on_save, sender=Company, weak=False, dispatch_uid="profile_cache_save")
+    post_delete.connect(on_delete, sender=Company, weak=False, dispatch_uid="profile_cache_delete")
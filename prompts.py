@@ -0,0 +1,256 @@
+"""Chat prompt assembly for the company bot.
+
+The system prompt is split in two. The static prefix (identity, working
+hours, company info, instructions) depends only on the company profile, so
+it is rendered once per config version and reused verbatim; keeping it as
+the first message makes it byte-identical across calls and lets providers
+serve it from their prompt cache. History follows as chat messages, and the
+per-request context (user info, language) comes last, right before the
+current message, so the cacheable prefix stays as long as possible. Older
+turns of long conversations are represented by the client's rolling
+summary (see ``summaries``), placed between the prefix and the history.
+FAQ and policy snippets retrieved for the message (see ``retrieval``) go
+after the history, ahead of the per-request context.
+
+History is chosen newest first until the company's history token budget is
+spent. Messages carry their token count (stored with each ``Message``), so
+selection costs one addition per turn and nothing is re-tokenized.
+"""
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from profiles import CompanyProfile
+from token_counter import counter
+
+HISTORY_MESSAGES = 10
+
+LANGUAGE_NAMES = {"ru": "русском", "kz": "казахском", "en": "английском"}
+
+
+def render_static_prefix(profile: CompanyProfile) -> str:
+    """Render the part of the system prompt that only changes with the profile."""
+    sections = []
+
+    # 1. Bot Identity and Role
+    sections.append(f"""Ты - {profile.name} чат-бот.
+Ты вежливый и профессиональный ассистент, который помогает клиентам с их вопросами.""")
+
+    # 2. Working Hours
+    if profile.working_hours:
+        working_hours_list = [
+            f"- {day.capitalize()}: {hours if hours else 'Выходной'}"
+            for day, hours in profile.working_hours
+        ]
+        sections.append("\n\nЧасы работы:\n" + "\n".join(working_hours_list))
+
+    # 3. Company Information
+    info = profile.info
+    info_lines = []
+    if info.description:
+        info_lines.append(info.description)
+    if info.address:
+        info_lines.append(f"Адрес: {info.address}")
+    if info.phone:
+        info_lines.append(f"Телефон: {info.phone}")
+    if info.email:
+        info_lines.append(f"Email: {info.email}")
+    if info.website:
+        info_lines.append(f"Сайт: {info.website}")
+    if info_lines:
+        sections.append("\n\nО компании:\n" + "\n".join(info_lines))
+
+    # 4. Instructions
+    tone = profile.tone or 'вежливым и профессиональным'
+    off_topic = profile.messages.off_topic or 'вежливо укажи на это'
+    unknown = profile.messages.unknown or 'предложи связаться с оператором'
+    default_language = LANGUAGE_NAMES.get(profile.language, LANGUAGE_NAMES["ru"])
+    sections.append(f"""
+
+Инструкции:
+1. Отвечай на языке сообщения пользователя (он указан перед сообщением), по умолчанию на {default_language} языке. Не переходи на английский, если пользователь пишет не по-английски.
+2. Будь {tone}.
+3. Если вопрос не по теме, {off_topic}.
+4. Если не знаешь ответа, {unknown}.""")
+
+    return "".join(sections)
+
+
+class PrefixCache:
+    """Rendered static prefixes by company id, valid for one config version each."""
+
+    def __init__(self):
+        # company id -> (config version, prefix, prefix tokens)
+        self.prefixes: Dict[int, Tuple[int, str, int]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, profile: CompanyProfile) -> str:
+        return self.lookup(profile)[0]
+
+    def lookup(self, profile: CompanyProfile) -> Tuple[str, int]:
+        """Return the prefix and its token count."""
+        # Profiles built from a plain dict have no id and are not cached
+        if profile.company_id is None:
+            prefix = render_static_prefix(profile)
+            return prefix, counter.count(prefix)
+        cached = self.prefixes.get(profile.company_id)
+        if cached is not None and cached[0] == profile.config_version:
+            self.hits += 1
+            return cached[1], cached[2]
+        self.misses += 1
+        prefix = render_static_prefix(profile)
+        tokens = counter.count(prefix)
+        self.prefixes[profile.company_id] = (profile.config_version, prefix, tokens)
+        return prefix, tokens
+
+    def stats(self) -> Dict[str, int]:
+        return {"prefixes": len(self.prefixes), "hits": self.hits, "misses": self.misses}
+
+
+prefix_cache = PrefixCache()
+
+
+class Prompt(list):
+    """Chat messages for the model, with the prompt size in tokens."""
+
+    def __init__(self, messages=(), tokens: int = 0):
+        super().__init__(messages)
+        self.tokens = tokens
+
+
+class TokenStats:
+    """Prompt sizes since startup."""
+
+    def __init__(self):
+        self.prompts = 0
+        self.tokens = 0
+        self.max_tokens = 0
+        self.history_tokens = 0
+        # History messages left out because they did not fit the budget
+        self.history_dropped = 0
+
+    def record(self, tokens: int, history_tokens: int, history_dropped: int) -> None:
+        self.prompts += 1
+        self.tokens += tokens
+        self.max_tokens = max(self.max_tokens, tokens)
+        self.history_tokens += history_tokens
+        self.history_dropped += history_dropped
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "prompts": self.prompts,
+            "avg_tokens": round(self.tokens / self.prompts, 1) if self.prompts else 0.0,
+            "max_tokens": self.max_tokens,
+            "avg_history_tokens": round(self.history_tokens / self.prompts, 1) if self.prompts else 0.0,
+            "history_dropped": self.history_dropped,
+            "tokenizer": counter.method,
+        }
+
+
+token_stats = TokenStats()
+
+
+@lru_cache(maxsize=4096)
+def _context_tokens(context: str) -> int:
+    # The request context repeats for every message of a client
+    return counter.count(context)
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    tokens = message.get("tokens")
+    return counter.count(message.get("content", "")) if tokens is None else tokens
+
+
+def select_history(history: list, budget: int) -> Tuple[list, int]:
+    """Pick the most recent messages whose tokens fit ``budget``.
+
+    Stops at the first message that does not fit, so the selection is
+    always a contiguous tail of the conversation.
+
+    Returns:
+        tuple: Selected messages oldest first, and their total tokens
+    """
+    selected = []
+    used = 0
+    for msg in reversed(history[-HISTORY_MESSAGES:]):
+        tokens = message_tokens(msg)
+        if used + tokens > budget:
+            break
+        used += tokens
+        selected.append(msg)
+    selected.reverse()
+    return selected, used
+
+
+def render_summary(summary: str) -> str:
+    return f"Краткое содержание предыдущего разговора с клиентом:\n{summary}"
+
+
+def render_knowledge(snippets: List[str]) -> str:
+    return "Справочная информация компании по вопросу клиента:\n\n" + "\n\n".join(snippets)
+
+
+def render_request_context(user_data=None, detected_language: Optional[str] = None) -> str:
+    """Render the per-request part of the system prompt, empty when there is none."""
+    lines = []
+    if user_data:
+        if full_name := getattr(user_data, 'full_name', ''):
+            lines.append(f"Имя: {full_name}")
+        if phone := getattr(user_data, 'phone_number', ''):
+            lines.append(f"Телефон: {phone}")
+        if lines:
+            lines.insert(0, "Информация о пользователе:")
+    if language := LANGUAGE_NAMES.get(detected_language):
+        lines.append(f"Сообщение пользователя на {language} языке. Ответь на {language} языке.")
+    return "\n".join(lines)
+
+
+def build_prompt(profile, user_message: str, history: list = None,
+                 user_settings: dict = None, user_data=None,
+                 detected_language: Optional[str] = None, knowledge: List[str] = None) -> Prompt:
+    """Create the chat messages for the AI model.
+
+    Args:
+        profile: Compiled CompanyProfile (a script profile dict is compiled on the fly)
+        user_message: Current user message
+        history: List of previous messages in the conversation, oldest first,
+            optionally with their ``tokens``
+        user_settings: User-specific settings
+        user_data: Client model instance with additional user info and
+            the conversation summary
+        detected_language: Language code of ``user_message``
+        knowledge: FAQ and policy snippets relevant to ``user_message``
+
+    Returns:
+        Prompt: Messages for the chat completions API, with ``tokens`` set
+    """
+    if isinstance(profile, dict):
+        profile = CompanyProfile.from_script_profile(profile)
+
+    prefix, tokens = prefix_cache.lookup(profile)
+    messages = Prompt([{"role": "system", "content": prefix}])
+
+    if summary := getattr(user_data, 'summary', ''):
+        messages.append({"role": "system", "content": render_summary(summary)})
+        tokens += getattr(user_data, 'summary_token_count', 0) or counter.count(summary)
+
+    history = history or []
+    selected, history_tokens = select_history(history, profile.history_token_budget)
+    for msg in selected:
+        role = "user" if msg.get("role") == "user" else "assistant"
+        messages.append({"role": role, "content": msg.get("content", "")})
+    tokens += history_tokens
+
+    if knowledge:
+        rendered = render_knowledge(knowledge)
+        messages.append({"role": "system", "content": rendered})
+        tokens += counter.count(rendered)
+
+    if context := render_request_context(user_data, detected_language):
+        messages.append({"role": "system", "content": context})
+        tokens += _context_tokens(context)
+
+    messages.append({"role": "user", "content": user_message})
+    messages.tokens = tokens + counter.count(user_message)
+    token_stats.record(messages.tokens, history_tokens, min(len(history), HISTORY_MESSAGES) - len(selected))
+    return messages
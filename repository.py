@@ -0,0 +1,242 @@
+"""Awaitable data access for the webhook hot path.
+
+The Django ORM is blocking, so every query the webhook needs is executed on a
+bounded thread pool dedicated to the database alias instead of on the event
+loop. Updates from different chats can then overlap while one of them waits
+on a slow write.
+
+Functions taking a ``company`` only use its ``pk``, so a Company instance
+and a ``tenants.TenantRecord`` both work.
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from users.models import Company, Client
+from admin_panel.models import Message
+from admin_panel.analytics import accumulator as analytics
+from history_cache import history_cache
+from token_counter import counter
+
+logger = logging.getLogger("uvicorn")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+# SQLite has a single writer and fails multi-statement write transactions
+# that race for the lock instead of waiting, so writes get their own pool.
+DB_WRITE_POOL_SIZE = os.getenv("DB_WRITE_POOL_SIZE")
+
+_executors: Dict[Tuple[str, bool], ThreadPoolExecutor] = {}
+
+
+def _pool_size(using: str, write: bool) -> int:
+    if not write:
+        return DB_POOL_SIZE
+    if DB_WRITE_POOL_SIZE:
+        return int(DB_WRITE_POOL_SIZE)
+    return 1 if connections[using].vendor == "sqlite" else DB_POOL_SIZE
+
+
+def get_executor(using: str = DEFAULT_DB_ALIAS, write: bool = False) -> ThreadPoolExecutor:
+    """Return the thread pool bound to a database alias, creating it lazily."""
+    key = (using, write)
+    executor = _executors.get(key)
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=_pool_size(using, write),
+            thread_name_prefix=f"db-{using}-{'write' if write else 'read'}",
+        )
+        _executors[key] = executor
+    return executor
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    """Stop all database thread pools (called on application shutdown)."""
+    for executor in _executors.values():
+        executor.shutdown(wait=wait)
+    _executors.clear()
+
+
+def _call(func: Callable, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # Pool threads keep their connection between calls; only drop the
+        # ones that broke so the next call reconnects.
+        for conn in connections.all(initialized_only=True):
+            if conn.connection is not None and conn.errors_occurred and not conn.is_usable():
+                conn.close()
+
+
+async def run_db(func: Callable, *args, using: str = DEFAULT_DB_ALIAS,
+                 write: bool = False, **kwargs) -> Any:
+    """Run a blocking ORM callable on the database pool and await its result.
+
+    Args:
+        func: Callable doing the ORM work
+        using: Database alias whose pool should run it
+        write: Route to the alias' write pool (transactions, bulk writes)
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_executor(using, write)
+    return await loop.run_in_executor(executor, partial(_call, func, *args, **kwargs))
+
+
+# Blocking implementations
+
+def _get_company_by_token(token: str) -> Optional[Company]:
+    # The default manager filters by the current admin request, the webhook
+    # has none, so go through the unfiltered base manager.
+    return Company._base_manager.filter(telegram_token=token).first()
+
+
+def _get_client(company: Company, telegram_id: int) -> Optional[Client]:
+    return Client.objects.filter(company_id=company.pk, telegram_id=telegram_id).first()
+
+
+def _create_or_update_client(company: Company, telegram_user: Dict[str, Any],
+                             client: Optional[Client] = None) -> Client:
+    username = telegram_user.get("username") or ""
+    if client is None:
+        full_name = " ".join(
+            part for part in (telegram_user.get("first_name"), telegram_user.get("last_name")) if part
+        )
+        client, created = Client.objects.get_or_create(
+            company_id=company.pk,
+            telegram_id=telegram_user["id"],
+            defaults={
+                "name": full_name or username or str(telegram_user["id"]),
+                "username": username,
+                "settings": {"preferred_language": "ru"},  # Default language
+            },
+        )
+        if created:
+            analytics.record_new_client(company.pk, client)
+    else:
+        client.username = username
+        client.save(update_fields=["username", "updated_at"])
+    return client
+
+
+def _save_client_settings(client: Client) -> None:
+    Client.objects.filter(pk=client.pk).update(settings=client.settings)
+
+
+def _get_history(company: Company, client: Client, limit: int = 10) -> List[Dict[str, Any]]:
+    rows = (
+        Message.objects.filter(company_id=company.pk, user=client)
+        .order_by("-timestamp")
+        .values_list("content", "is_bot_response", "token_count")[:limit]
+    )
+    # Oldest first, in the shape build_prompt expects. Messages stored
+    # before token counts existed are counted here.
+    return [
+        {
+            "role": "assistant" if is_bot else "user",
+            "content": content,
+            "tokens": counter.count(content) if tokens is None else tokens,
+        }
+        for content, is_bot, tokens in reversed(rows)
+    ]
+
+
+def _is_answered(company: Company, update_id: int) -> bool:
+    return Message.objects.filter(company_id=company.pk, update_id=update_id).exists()
+
+
+def _save_exchange(company: Company, client: Client, text: str, reply: str,
+                   update_id: Optional[int] = None) -> Tuple[Message, Message]:
+    text_tokens, reply_tokens = counter.count_batch((text, reply))
+    with transaction.atomic():
+        user_message = Message.create_with_response_time(
+            content=text,
+            company=company,
+            user=client,
+            is_bot_response=False,
+            token_count=text_tokens,
+            update_id=update_id
+        )
+        bot_response = Message.create_with_response_time(
+            content=reply,
+            company=company,
+            user=client,
+            is_bot_response=True,
+            token_count=reply_tokens,
+            update_id=update_id
+        )
+        # The history cached for this client by other processes is now stale
+        client.updated_at = Client.touch(client.pk)
+    try:
+        analytics.record_messages(company.pk, (user_message, bot_response))
+    except Exception as e:
+        logger.error(f"Error updating daily analytics: {e}")
+    return user_message, bot_response
+
+
+# Awaitable repository API
+
+async def get_company_by_token(token: str) -> Optional[Company]:
+    """Find the company that owns a Telegram bot token."""
+    return await run_db(_get_company_by_token, token)
+
+
+async def get_or_create_client(company: Company, telegram_user: Dict[str, Any]) -> Client:
+    """Get or create the client for a Telegram ``from`` object.
+
+    The lookup runs on the read pool; only a new client or a changed
+    username goes through the write pool.
+    """
+    client = await run_db(_get_client, company, telegram_user["id"])
+    if client is None:
+        return await run_db(_create_or_update_client, company, telegram_user, write=True)
+    if "first_name" in telegram_user and client.username != (telegram_user.get("username") or ""):
+        return await run_db(_create_or_update_client, company, telegram_user, client, write=True)
+    return client
+
+
+async def save_client_settings(client: Client) -> None:
+    """Persist ``client.settings`` (e.g. the remembered message language)."""
+    await run_db(_save_client_settings, client, write=True)
+
+
+async def get_history(company: Company, client: Client, limit: int = 10) -> List[Dict[str, Any]]:
+    """Return the last ``limit`` messages of a conversation, oldest first, with their tokens.
+
+    Served from the history cache; a miss reads the conversation once and
+    caches it.
+    """
+    key = (company.pk, client.pk)
+    history = history_cache.get(key, limit, client.updated_at)
+    if history is not None:
+        return history
+    if limit > history_cache.turns:
+        return await run_db(_get_history, company, client, limit)
+    history = await run_db(_get_history, company, client, history_cache.turns)
+    history_cache.load(key, history, client.updated_at)
+    return history[-limit:] if limit else []
+
+
+async def is_answered(company: Company, update_id: int) -> bool:
+    """Whether the exchange for Telegram update ``update_id`` was already stored."""
+    return await run_db(_is_answered, company, update_id)
+
+
+async def save_exchange(company: Company, client: Client, text: str, reply: str,
+                        update_id: Optional[int] = None) -> Tuple[Message, Message]:
+    """Persist a user message with the bot reply and count them in daily analytics.
+
+    ``update_id`` marks the exchange as the answer to that Telegram update
+    (see ``is_answered``).
+    """
+    since = client.updated_at
+    user_message, bot_response = await run_db(_save_exchange, company, client, text, reply, update_id,
+                                              write=True)
+    history_cache.append((company.pk, client.pk), (
+        {"role": "user", "content": text, "tokens": user_message.token_count},
+        {"role": "assistant", "content": reply, "tokens": bot_response.token_count},
+    ), since, client.updated_at)
+    return user_message, bot_response
@@ -0,0 +1,129 @@
+"""First-tier cache of replies to literally repeated messages.
+
+Many messages are the same few words ("привет", "цена?", "адрес"). Replies
+are stored under (company, config version, normalized text, language) and
+served for RESPONSE_CACHE_TTL seconds without building a prompt or calling
+the LLM. The cache holds at most RESPONSE_CACHE_SIZE replies, least
+recently used first out.
+
+A company's entries are dropped as soon as a newer config version is
+seen; saving the company, its FAQs or its policies bumps the version.
+Messages that refer to the client themselves (first person pronouns,
+numbers, e-mail addresses) are never looked up or stored.
+"""
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+_PERSONAL = re.compile(
+    r"\b(?:я|мне|меня|мной|мой|моя|мое|моё|мои|моего|моей|моих|моему|мы|нам|нас|наш|наша|наше|наши|"
+    r"мен|маған|мені|менің|біз|бізге|біздің|"
+    r"i|me|my|mine|we|us|our)\b|\d|@",
+    re.IGNORECASE,
+)
+
+CacheKey = Tuple[int, int, str, Optional[str]]
+
+
+def normalize(text: str) -> str:
+    """Casefold, drop punctuation and collapse whitespace ("Цена?!" -> "цена")."""
+    text = _PUNCTUATION.sub(" ", text.casefold().replace("ё", "е"))
+    return _SPACES.sub(" ", text).strip()
+
+
+def is_personal(text: str) -> bool:
+    """Whether the reply to ``text`` likely depends on who is asking."""
+    return bool(_PERSONAL.search(text))
+
+
+class ResponseCache:
+    """Replies by normalized message, with a TTL and LRU eviction by count."""
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, size: int = RESPONSE_CACHE_SIZE,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self.size = size
+        self.clock = clock
+        # key -> (expires at, reply)
+        self.entries: "OrderedDict[CacheKey, Tuple[float, str]]" = OrderedDict()
+        self.versions: Dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.expired = 0
+        self.evicted = 0
+        self.invalidated = 0
+
+    def _key(self, company_id: int, config_version: int, text: str, language: Optional[str]) -> Optional[CacheKey]:
+        if is_personal(text):
+            return None
+        normalized = normalize(text)
+        return (company_id, config_version, normalized, language) if normalized else None
+
+    def _observe_version(self, company_id: int, config_version: int) -> None:
+        known = self.versions.get(company_id)
+        if known is None or config_version > known:
+            self.versions[company_id] = config_version
+            if known is not None:
+                self.invalidate(company_id)
+
+    def get(self, company_id: int, config_version: int, text: str, language: Optional[str]) -> Optional[str]:
+        """Return a fresh cached reply, or None (also for personal messages)."""
+        key = self._key(company_id, config_version, text, language)
+        if key is None:
+            self.bypassed += 1
+            return None
+        self._observe_version(company_id, config_version)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] <= self.clock():
+            del self.entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, company_id: int, config_version: int, text: str, language: Optional[str], reply: str) -> None:
+        key = self._key(company_id, config_version, text, language)
+        if key is None:
+            return
+        self._observe_version(company_id, config_version)
+        if config_version < self.versions[company_id]:
+            # Produced with a configuration that has changed since
+            return
+        self.entries[key] = (self.clock() + self.ttl, reply)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evicted += 1
+
+    def invalidate(self, company_id: int) -> None:
+        """Drop every reply of a company."""
+        stale = [key for key in self.entries if key[0] == company_id]
+        for key in stale:
+            del self.entries[key]
+        self.invalidated += len(stale)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "bypassed": self.bypassed,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "invalidated": self.invalidated,
+        }
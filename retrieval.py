@@ -0,0 +1,372 @@
+"""Per-company BM25 retrieval over FAQ and Policy rows for prompt grounding.
+
+Each company gets an inverted index (term -> {document: term frequency})
+of its FAQs and active policies. ``Retriever.retrieve`` scores the message
+against it with Okapi BM25 and returns the best snippets that together fit
+RETRIEVAL_TOKEN_BUDGET; build_prompt sends them after the history.
+
+With a semantic embedder (EMBEDDING_MODEL, see ``embeddings``) the same
+rows are also embedded into the company's ``vector_store``, which finds
+rephrasings that share no words with the FAQ. Both rankings are merged
+with reciprocal rank fusion; the snippets still come from the BM25 index.
+
+The index is updated one document at a time: saves and deletes in this
+process are applied directly through signals, and a newer company config
+version (FAQ and policy edits bump it, wherever they happen) triggers a
+delta sync that only re-reads rows changed since the last one and drops
+deleted ids. Tokenizing runs on the database pool; only dict updates and
+lookups happen on the event loop.
+"""
+import asyncio
+import logging
+import math
+import os
+import re
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from token_counter import counter
+from vector_store import VectorStores, index_company, split_key
+
+logger = logging.getLogger("uvicorn")
+
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "600"))
+# Dense matches below this cosine similarity are not relevant enough to send
+RETRIEVAL_DENSE_MIN_SCORE = float(os.getenv("RETRIEVAL_DENSE_MIN_SCORE", "0.5"))
+# Reciprocal rank fusion constant, the usual 60 keeps one ranking from dominating
+FUSION_K = 60
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Words are cut to this many characters, a cheap stemmer for inflected ru/kz words
+STEM_LENGTH = 5
+
+_WORDS = re.compile(r"\w+")
+STOPWORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было вот от меня
+еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас нибудь опять уж вам ведь
+там потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам чтоб без будто чего раз
+тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь этом один почти мой тем чтобы
+нее сейчас были куда зачем всех никогда можно при наконец два об другой хоть после над больше тот через эти
+нас про всего них какая много разве три эту моя впрочем свою этой перед иногда лучше чуть том нельзя такой им
+более всегда конечно всю между у вас ваш ваша ваши
+the a an and or of to in on for is are be do does can what how when where which you your i my we our it
+және мен бар ма ме ба бе па пе қалай не неше қашан
+""".split())
+
+# (kind, row id), kind is "faq" or "policy"
+DocKey = Tuple[str, int]
+
+
+def terms(text: str) -> List[str]:
+    words = _WORDS.findall(text.casefold().replace("ё", "е"))
+    return [word[:STEM_LENGTH] for word in words if word not in STOPWORDS and not word.isdigit()]
+
+
+class Document(NamedTuple):
+    key: DocKey
+    frequencies: Dict[str, int]
+    length: int
+    snippet: str
+    tokens: int
+
+
+def prepare(key: DocKey, text: str, snippet: str) -> Document:
+    """Tokenize a row into a document (pure, safe to run on any thread)."""
+    words = terms(text)
+    return Document(key, dict(Counter(words)), len(words), snippet, counter.count(snippet))
+
+
+def faq_document(faq_id: int, question: str, answer: str) -> Document:
+    # The question carries the vocabulary clients use, count it twice
+    return prepare(("faq", faq_id), f"{question} {question} {answer}", f"Вопрос: {question}\nОтвет: {answer}")
+
+
+def policy_document(policy_id: int, title: str, content: str) -> Document:
+    return prepare(("policy", policy_id), f"{title} {content}", f"{title}: {content}")
+
+
+class BM25Index:
+    """Inverted index of one company's documents.
+
+    Postings are kept as dicts for cheap incremental updates and compiled
+    per term into numpy arrays of (slot, BM25 term weight) on first use, so
+    a query is a few vectorized additions into a score array. Weights use
+    the average document length at compile time; all terms are recompiled
+    once it drifts by more than ``AVERAGE_DRIFT``.
+    """
+
+    AVERAGE_DRIFT = 0.05
+
+    def __init__(self):
+        self.documents: Dict[DocKey, Document] = {}
+        self.slots: Dict[DocKey, int] = {}
+        self.keys: List[Optional[DocKey]] = []
+        self.free_slots: List[int] = []
+        # Document length by slot, grown by doubling
+        self.lengths = np.zeros(64)
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.compiled: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.compiled_average = 0.0
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add(self, document: Document) -> None:
+        """Add or replace a document."""
+        self.remove(document.key)
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.keys[slot] = document.key
+        else:
+            slot = len(self.keys)
+            self.keys.append(document.key)
+            if slot == len(self.lengths):
+                self.lengths = np.concatenate([self.lengths, np.zeros(slot)])
+        self.lengths[slot] = document.length
+        self.slots[document.key] = slot
+        self.documents[document.key] = document
+        self.total_length += document.length
+        for term, frequency in document.frequencies.items():
+            self.postings.setdefault(term, {})[slot] = frequency
+            self.compiled.pop(term, None)
+
+    def remove(self, key: DocKey) -> None:
+        document = self.documents.pop(key, None)
+        if document is None:
+            return
+        slot = self.slots.pop(key)
+        self.keys[slot] = None
+        self.free_slots.append(slot)
+        self.total_length -= document.length
+        for term in document.frequencies:
+            posting = self.postings[term]
+            del posting[slot]
+            if not posting:
+                del self.postings[term]
+            self.compiled.pop(term, None)
+
+    def _average_length(self) -> float:
+        average = self.total_length / len(self.documents) or 1.0
+        if abs(average - self.compiled_average) > self.AVERAGE_DRIFT * self.compiled_average:
+            self.compiled.clear()
+            self.compiled_average = average
+        return self.compiled_average
+
+    def _compiled(self, term: str, posting: Dict[int, int], average_length: float) -> Tuple[np.ndarray, np.ndarray]:
+        compiled = self.compiled.get(term)
+        if compiled is None:
+            slots = np.fromiter(posting.keys(), dtype=np.int64, count=len(posting))
+            frequencies = np.fromiter(posting.values(), dtype=np.float64, count=len(posting))
+            norms = BM25_K1 * (1.0 - BM25_B + BM25_B * self.lengths[slots] / average_length)
+            compiled = self.compiled[term] = (slots, frequencies * (BM25_K1 + 1.0) / (frequencies + norms))
+        return compiled
+
+    def search(self, query: str, k: int = RETRIEVAL_TOP_K) -> List[Tuple[float, Document]]:
+        """Top ``k`` documents by BM25 score, best first."""
+        count = len(self.documents)
+        if not count:
+            return []
+        average_length = self._average_length()
+        scores = None
+        for term in set(terms(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            slots, weights = self._compiled(term, posting, average_length)
+            idf = math.log(1.0 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+            if scores is None:
+                scores = np.zeros(len(self.keys))
+            scores[slots] += idf * weights
+        if scores is None:
+            return []
+        if k < len(scores):
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[slot]), self.documents[self.keys[slot]]) for slot in top if scores[slot] > 0]
+
+
+def fuse(*rankings: List[Document], k: int = FUSION_K) -> List[Document]:
+    """Documents of several rankings ordered by reciprocal rank fusion."""
+    scores: Dict[DocKey, float] = {}
+    documents: Dict[DocKey, Document] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, 1):
+            scores[document.key] = scores.get(document.key, 0.0) + 1.0 / (k + rank)
+            documents[document.key] = document
+    return [documents[key] for key in sorted(scores, key=scores.__getitem__, reverse=True)]
+
+
+class _CompanyIndex:
+    __slots__ = ("index", "config_version", "synced_at")
+
+    def __init__(self):
+        self.index = BM25Index()
+        self.config_version = -1
+        # Rows updated after this were not read by the last sync yet
+        self.synced_at: Optional[datetime] = None
+
+
+def load_changes(company_id: int, since: Optional[datetime]) -> Tuple[Set[DocKey], List[Document], datetime]:
+    """Ids of all indexable rows plus documents for rows changed since ``since``.
+
+    Blocking, run it on the database pool.
+    """
+    from django.utils import timezone
+    from admin_panel.models import FAQ, Policy
+
+    now = timezone.now()
+    faqs = FAQ.objects.filter(company_id=company_id)
+    policies = Policy.objects.filter(company_id=company_id, is_active=True)
+    keys = {("faq", pk) for pk in faqs.values_list("id", flat=True)}
+    keys.update(("policy", pk) for pk in policies.values_list("id", flat=True))
+    if since is not None:
+        faqs = faqs.filter(updated_at__gte=since)
+        policies = policies.filter(updated_at__gte=since)
+    documents = [faq_document(*row) for row in faqs.values_list("id", "question", "answer")]
+    documents += [policy_document(*row) for row in policies.values_list("id", "title", "content")]
+    return keys, documents, now
+
+
+class Retriever:
+    """BM25 indexes by company id, kept in step with FAQ and Policy rows.
+
+    Args:
+        run_db: Awaitable runner for blocking ORM calls (``repository.run_db``)
+        vectors: Per-company vector stores for the dense path, None for BM25 only
+        embedder: Embedder of the stores' vectors (its ``dim`` is theirs)
+    """
+
+    def __init__(self, run_db, top_k: int = RETRIEVAL_TOP_K, token_budget: int = RETRIEVAL_TOKEN_BUDGET,
+                 vectors: Optional[VectorStores] = None, embedder=None,
+                 dense_min_score: float = RETRIEVAL_DENSE_MIN_SCORE):
+        self.run_db = run_db
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.vectors = vectors if embedder is not None else None
+        self.embedder = embedder
+        self.dense_min_score = dense_min_score
+        self.dense_hits = 0
+        self.companies: Dict[int, _CompanyIndex] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self.retrievals = 0
+        self.snippets = 0
+        self.syncs = 0
+        self.updates = 0
+
+    async def _company(self, company_id: int, config_version: int) -> BM25Index:
+        company = self.companies.get(company_id)
+        if company is not None and company.config_version >= config_version:
+            return company.index
+        async with self._locks.setdefault(company_id, asyncio.Lock()):
+            company = self.companies.setdefault(company_id, _CompanyIndex())
+            if company.config_version < config_version:
+                keys, documents, synced_at = await self.run_db(load_changes, company_id, company.synced_at)
+                for key in [key for key in company.index.documents if key not in keys]:
+                    company.index.remove(key)
+                for document in documents:
+                    company.index.add(document)
+                if self.vectors is not None:
+                    try:
+                        await self.run_db(index_company, self.vectors.get(company_id), self.embedder, company_id)
+                    except Exception as e:
+                        logger.error(f"Error indexing vectors of company {company_id}: {e}")
+                company.config_version = config_version
+                company.synced_at = synced_at
+                self.syncs += 1
+                logger.info(f"Synced retrieval index of company {company_id}: "
+                            f"{len(documents)} changed, {len(company.index)} total")
+        return company.index
+
+    def _dense_search(self, company_id: int, text: str) -> List[Tuple[int, float]]:
+        query = self.embedder.embed([text])[0]
+        return self.vectors.get(company_id).search(query, self.top_k)
+
+    async def _dense(self, company_id: int, index: BM25Index, text: str) -> List[Document]:
+        """Documents of the nearest vectors, best first (empty if the store fails)."""
+        try:
+            results = await asyncio.to_thread(self._dense_search, company_id, text)
+        except Exception as e:
+            logger.error(f"Error searching vectors of company {company_id}: {e}")
+            return []
+        # The store is shared by all workers and may lag or lead this index by a sync
+        documents = [index.documents.get(split_key(key)) for key, score in results if score >= self.dense_min_score]
+        return [document for document in documents if document is not None]
+
+    async def retrieve(self, company_id: int, config_version: int, text: str) -> List[str]:
+        """Snippets most relevant to ``text`` that together fit the token budget."""
+        index = await self._company(company_id, config_version)
+        self.retrievals += 1
+        ranked = [document for _, document in index.search(text, self.top_k)]
+        if self.vectors is not None:
+            dense = await self._dense(company_id, index, text)
+            self.dense_hits += len(dense)
+            ranked = fuse(ranked, dense)[:self.top_k]
+        selected = []
+        remaining = self.token_budget
+        for document in ranked:
+            if document.tokens <= remaining:
+                selected.append(document.snippet)
+                remaining -= document.tokens
+        self.snippets += len(selected)
+        return selected
+
+    def apply(self, company_id: int, document: Optional[Document] = None, removed: Optional[DocKey] = None) -> None:
+        """Add, replace or remove one document of a loaded company index."""
+        company = self.companies.get(company_id)
+        if company is None:
+            return
+        if removed is not None:
+            company.index.remove(removed)
+        if document is not None:
+            company.index.add(document)
+        self.updates += 1
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "companies": len(self.companies),
+            "documents": sum(len(company.index) for company in self.companies.values()),
+            "retrievals": self.retrievals,
+            "avg_snippets": round(self.snippets / self.retrievals, 2) if self.retrievals else 0.0,
+            "syncs": self.syncs,
+            "updates": self.updates,
+            "dense": self.vectors is not None,
+            "dense_hits": self.dense_hits,
+        }
+
+
+def connect_signals(retriever: Retriever, loop: asyncio.AbstractEventLoop) -> None:
+    """Apply FAQ and Policy saves and deletes made in this process to the loaded indexes.
+
+    Signals fire on database pool threads, so the update is tokenized there
+    and handed to the event loop.
+    """
+    from django.db.models.signals import post_delete, post_save
+    from admin_panel.models import FAQ, Policy
+
+    def on_faq_save(sender, instance, **kwargs):
+        document = faq_document(instance.pk, instance.question, instance.answer)
+        loop.call_soon_threadsafe(retriever.apply, instance.company_id, document)
+
+    def on_policy_save(sender, instance, **kwargs):
+        if instance.is_active:
+            document = policy_document(instance.pk, instance.title, instance.content)
+            loop.call_soon_threadsafe(retriever.apply, instance.company_id, document)
+        else:
+            loop.call_soon_threadsafe(retriever.apply, instance.company_id, None, ("policy", instance.pk))
+
+    def on_delete(kind):
+        def handler(sender, instance, **kwargs):
+            loop.call_soon_threadsafe(retriever.apply, instance.company_id, None, (kind, instance.pk))
+        return handler
+
+    post_save.connect(on_faq_save, sender=FAQ, weak=False, dispatch_uid="retrieval_faq_save")
+    post_save.connect(on_policy_save, sender=Policy, weak=False, dispatch_uid="retrieval_policy_save")
+    post_delete.connect(on_delete("faq"), sender=FAQ, weak=False, dispatch_uid="retrieval_faq_delete")
+    post_delete.connect(on_delete("policy"), sender=Policy, weak=False, dispatch_uid="retrieval_policy_delete")
@@ -0,0 +1,150 @@
+"""Canned replies served before the LLM is called.
+
+Many messages need no model at all: ``/start``, a bare greeting, a
+"спасибо", anything sent outside working hours, or a question about a
+topic the company has ruled out. Each company's welcome, thanks and
+off-hours messages and its restricted topics are compiled with its
+profile into a ``RuleSet``; checking a message is a normalization, a few
+set lookups and, only when the company has restricted topics, one regex
+search. Companies turn the stage off with ``canned_replies_enabled``; a
+rule without its message configured never fires.
+
+Rules in order (the first that fires wins):
+
+1. ``/start``: the welcome message
+2. a thanks-only message ("спасибо!", "рахмет", "thanks"): the thanks message
+3. outside working hours: the off-hours message
+4. a greeting-only message ("здравствуйте", "сәлем"): the welcome message
+5. a restricted topic keyword: a polite refusal
+
+Restricted topics match by word stem: trailing vowels are dropped from
+each word and any ending is allowed, so "политика" also catches
+"политике" and "ставки на спорт" catches "ставками на спорте".
+"""
+import re
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Tuple
+
+START_COMMANDS = frozenset({"/start"})
+
+GREETINGS = frozenset({
+    "привет", "приветствую", "здравствуйте", "здравствуй", "здрасте", "добрый день", "доброе утро",
+    "добрый вечер", "доброго дня", "салам", "салем", "сәлем", "сәлеметсіз бе", "салеметсиз бе",
+    "сәлеметсіз", "қайырлы күн", "кайырлы кун", "қайырлы таң", "қайырлы кеш", "hi", "hello", "hey",
+    "good morning", "good afternoon", "good evening",
+})
+
+THANKS = frozenset({
+    "спасибо", "спасибо большое", "большое спасибо", "спасибочки", "спс", "благодарю",
+    "благодарю вас", "спасибо вам", "спасибо огромное", "огромное спасибо", "рахмет", "рақмет",
+    "көп рахмет", "коп рахмет", "рахмет сізге", "thanks", "thank you", "thank you so much",
+    "thanks a lot", "thx", "ок спасибо", "ok спасибо", "хорошо спасибо", "понятно спасибо",
+    "жақсы рахмет", "жаксы рахмет",
+})
+
+# Used for restricted topics when the company has no off-topic message
+DEFAULT_REFUSALS = {
+    "ru": "К сожалению, я не могу обсуждать эту тему. Могу рассказать о наших услугах.",
+    "kz": "Өкінішке қарай, бұл тақырыпты талқылай алмаймын. Қызметтеріміз туралы айтып бере аламын.",
+    "en": "Sorry, I can't discuss this topic. I'm happy to tell you about our services.",
+}
+
+# Anything longer is a real question, not a greeting or thanks
+SHORT_MESSAGE_LENGTH = 40
+
+_WORD = re.compile(r"\w+")
+# Russian and Kazakh inflections mostly change the vowels at the end of a word
+_ENDING = re.compile(r"[аеёиоуыэюяйьъіәөүұ]+$")
+MIN_STEM_LENGTH = 3
+
+
+def normalize(text: str) -> str:
+    """Casefolded ``text`` without punctuation, emoji or repeated spaces."""
+    return " ".join(_WORD.findall(text.casefold()))
+
+
+def topic_pattern(topic: str) -> str:
+    """Regex for ``topic`` with every word reduced to its stem."""
+    stems = []
+    for word in topic.casefold().split():
+        stem = _ENDING.sub("", word)
+        stems.append(re.escape(stem if len(stem) >= MIN_STEM_LENGTH else word) + r"\w*")
+    return r"\s+".join(stems)
+
+
+class CannedReply(NamedTuple):
+    # "welcome", "thanks", "off_hours" or "restricted"
+    rule: str
+    reply: str
+
+
+class RuleSet:
+    """One company's canned replies and restricted topics, compiled for matching messages."""
+
+    def __init__(self, welcome: Optional[str] = None, thanks: Optional[str] = None,
+                 off_hours: Optional[str] = None, refusal: Optional[str] = None,
+                 restricted_topics: Tuple[str, ...] = ()):
+        self.welcome = CannedReply("welcome", welcome) if welcome else None
+        self.thanks = CannedReply("thanks", thanks) if thanks else None
+        self.off_hours = CannedReply("off_hours", off_hours) if off_hours else None
+        self.refusal = CannedReply("restricted", refusal) if refusal else None
+        topics = sorted({topic_pattern(topic) for topic in restricted_topics if topic.strip()})
+        self.restricted = re.compile(r"\b(?:" + "|".join(topics) + ")") if topics and self.refusal else None
+
+    def match(self, text: str, is_closed) -> Optional[CannedReply]:
+        """The canned reply for ``text``, or None when the LLM should answer.
+
+        ``is_closed`` is called (at most once) only when the company has an
+        off-hours message; it is False when the hours are not known, so a
+        configuration error never turns into "we are closed".
+        """
+        stripped = text.strip()
+        if self.welcome and stripped.split("@", 1)[0].casefold() in START_COMMANDS:
+            return self.welcome
+        short = normalize(stripped) if len(stripped) <= SHORT_MESSAGE_LENGTH else None
+        if self.thanks and short in THANKS:
+            return self.thanks
+        if self.off_hours and is_closed():
+            return self.off_hours
+        if self.welcome and short in GREETINGS:
+            return self.welcome
+        if self.restricted and self.restricted.search(stripped.casefold()):
+            return self.refusal
+        return None
+
+
+@lru_cache(maxsize=4096)
+def compile_rules(welcome: Optional[str], thanks: Optional[str], off_hours: Optional[str],
+                  refusal: Optional[str], restricted_topics: Tuple[str, ...]) -> RuleSet:
+    """Rule set for these settings, shared by profiles that have the same ones."""
+    return RuleSet(welcome, thanks, off_hours, refusal, restricted_topics)
+
+
+class RuleStage:
+    """Applies the profile's rules to incoming messages and counts the LLM calls they save."""
+
+    def __init__(self):
+        self.checked = 0
+        self.served: Counter = Counter()
+
+    def apply(self, profile, text: str, now: Optional[datetime] = None) -> Optional[CannedReply]:
+        """The canned reply ``profile`` has for ``text``, if any."""
+        if not profile.canned_replies_enabled or not text:
+            return None
+        self.checked += 1
+        canned = profile.rules.match(text, lambda: profile.is_closed(now))
+        if canned is not None:
+            self.served[canned.rule] += 1
+        return canned
+
+    def stats(self) -> Dict[str, float]:
+        avoided = sum(self.served.values())
+        return {
+            "checked": self.checked,
+            # Every canned reply is one LLM call that was not made
+            "llm_calls_avoided": avoided,
+            "avoided_rate": round(avoided / self.checked, 4) if self.checked else 0.0,
+            **{f"served_{rule}": self.served[rule] for rule in ("welcome", "thanks", "off_hours", "restricted")},
+        }
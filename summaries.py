@@ -0,0 +1,236 @@
+"""Rolling conversation summaries, maintained off the request path.
+
+Prompts carry at most the last ``HISTORY_MESSAGES`` raw turns. For clients
+with longer conversations the ``Summarizer`` folds the turns that fell out
+of that window into ``Client.summary`` with one LLM call (previous summary
+plus the new old turns in, updated summary out), and build_prompt sends
+the summary in place of those turns. Once a client has a summary every
+turn older than the window is folded on the next pass, so nothing between
+the summary and the raw history is left out of the prompt for longer.
+
+The work is bounded: only clients that talked since the last pass are
+looked at, a pass folds at most SUMMARY_CLIENTS_PER_RUN clients and
+SUMMARY_BATCH_MESSAGES messages each, every company spends at most
+``Company.summary_daily_tokens`` a day, and a pass is skipped (or cut
+short) while ``overloaded()`` says live replies need the LLM.
+"""
+import asyncio
+import logging
+import os
+from datetime import date
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from prompts import HISTORY_MESSAGES
+from token_counter import counter
+
+logger = logging.getLogger("uvicorn")
+
+SUMMARY_INTERVAL = float(os.getenv("SUMMARY_INTERVAL", "300"))
+# Old messages a client must have beyond the raw history window for a first summary
+SUMMARY_MIN_MESSAGES = int(os.getenv("SUMMARY_MIN_MESSAGES", "20"))
+SUMMARY_BATCH_MESSAGES = int(os.getenv("SUMMARY_BATCH_MESSAGES", "60"))
+SUMMARY_CLIENTS_PER_RUN = int(os.getenv("SUMMARY_CLIENTS_PER_RUN", "20"))
+# Summaries wait while the providers answer slower than this (p95, seconds)
+SUMMARY_MAX_LLM_LATENCY = float(os.getenv("SUMMARY_MAX_LLM_LATENCY", "8"))
+SUMMARY_MAX_WORDS = 150
+
+SUMMARY_INSTRUCTIONS = f"""Ты ведешь краткое резюме переписки чат-бота компании с клиентом.
+Обнови резюме с учетом новых сообщений. Сохрани то, что пригодится в следующих разговорах:
+имя и предпочтения клиента, записи, заказы, договоренности и нерешенные вопросы.
+Не более {SUMMARY_MAX_WORDS} слов. Ответь только текстом резюме."""
+
+
+class Candidate(NamedTuple):
+    client_id: int
+    company_id: int
+    daily_tokens: int
+    summary: str
+    summary_message_id: Optional[int]
+    # Messages after ``summary_message_id``
+    unsummarized: int
+
+
+def find_candidates(client_ids: Iterable[int], min_messages: int = SUMMARY_MIN_MESSAGES) -> List[Candidate]:
+    """Clients with unsummarized messages outside the raw history.
+
+    A first summary waits for more than ``min_messages`` of them, an existing
+    one is brought up to the start of the history window.
+    """
+    from django.db.models import Count, F, Q
+    from users.models import Client
+
+    unsummarized = Count(
+        "messages",
+        filter=Q(summary_message_id__isnull=True) | Q(messages__id__gt=F("summary_message_id")),
+    )
+    rows = (
+        Client.objects.filter(id__in=list(client_ids), company__summary_daily_tokens__gt=0)
+        .annotate(unsummarized=unsummarized)
+        .filter(Q(summary_message_id__isnull=False, unsummarized__gt=HISTORY_MESSAGES)
+                | Q(unsummarized__gt=HISTORY_MESSAGES + min_messages))
+        .order_by("-unsummarized")
+        .values_list("id", "company_id", "company__summary_daily_tokens",
+                     "summary", "summary_message_id", "unsummarized")
+    )
+    return [Candidate(*row) for row in rows]
+
+
+def load_turns(candidate: Candidate, limit: int = SUMMARY_BATCH_MESSAGES) -> List[Tuple[int, str, bool]]:
+    """The oldest unsummarized messages, leaving the raw history window alone."""
+    from admin_panel.models import Message
+
+    count = min(limit, candidate.unsummarized - HISTORY_MESSAGES)
+    if count <= 0:
+        return []
+    messages = Message.objects.filter(user_id=candidate.client_id)
+    if candidate.summary_message_id is not None:
+        messages = messages.filter(id__gt=candidate.summary_message_id)
+    return list(messages.order_by("id").values_list("id", "content", "is_bot_response")[:count])
+
+
+def save_summary(candidate: Candidate, summary: str, tokens: int, last_message_id: int) -> bool:
+    """Store a new summary unless another pass already moved it on."""
+    from users.models import Client
+
+    return bool(
+        Client.objects.filter(pk=candidate.client_id, summary_message_id=candidate.summary_message_id)
+        .update(summary=summary, summary_message_id=last_message_id, summary_token_count=tokens)
+    )
+
+
+def build_summary_prompt(summary: str, turns: Iterable[Tuple[int, str, bool]]) -> List[Dict[str, str]]:
+    lines = [f"{'Бот' if is_bot else 'Клиент'}: {content}" for _, content, is_bot in turns]
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": f"Текущее резюме:\n{summary or 'нет'}\n\nНовые сообщения:\n" + "\n".join(lines)},
+    ]
+
+
+def llm_busy(scheduler, tracker, max_latency: float = SUMMARY_MAX_LLM_LATENCY) -> bool:
+    """Whether live updates are queueing up or every provider is slow or failing."""
+    if scheduler.pending >= scheduler.concurrency:
+        return True
+    measured = [stats for stats in tracker.stats.values() if stats.latencies]
+    return bool(measured) and all(
+        stats.percentile(0.95) > max_latency or stats.error_rate > 0.5 for stats in measured
+    )
+
+
+class SummaryBudget:
+    """LLM tokens spent on summaries per company, reset every day."""
+
+    def __init__(self):
+        self.day = date.today()
+        self.spent: Dict[int, int] = {}
+
+    def allows(self, company_id: int, daily_tokens: int) -> bool:
+        self._roll()
+        return self.spent.get(company_id, 0) < daily_tokens
+
+    def charge(self, company_id: int, tokens: int) -> None:
+        self._roll()
+        self.spent[company_id] = self.spent.get(company_id, 0) + tokens
+
+    def _roll(self) -> None:
+        today = date.today()
+        if today != self.day:
+            self.day = today
+            self.spent.clear()
+
+
+class Summarizer:
+    """Folds old turns of recently active clients into their summary."""
+
+    def __init__(self, run_db: Callable[..., Awaitable], generate: Callable[[list], Awaitable[Tuple[str, str]]],
+                 overloaded: Callable[[], bool] = lambda: False,
+                 clients_per_run: int = SUMMARY_CLIENTS_PER_RUN, batch_messages: int = SUMMARY_BATCH_MESSAGES,
+                 min_messages: int = SUMMARY_MIN_MESSAGES):
+        self.run_db = run_db
+        self.generate = generate
+        self.overloaded = overloaded
+        self.clients_per_run = clients_per_run
+        self.batch_messages = batch_messages
+        self.min_messages = min_messages
+        self.budget = SummaryBudget()
+        # Clients with new messages since the last pass
+        self.touched: Set[int] = set()
+        self.passes = 0
+        self.folded = 0
+        self.messages_folded = 0
+        self.tokens_spent = 0
+        self.skipped_overloaded = 0
+        self.skipped_budget = 0
+        self.errors = 0
+
+    def touch(self, client_id: int) -> None:
+        """Note that a client's conversation grew (cheap, called per message)."""
+        self.touched.add(client_id)
+
+    async def run_once(self) -> int:
+        """Run one pass and return how many summaries were updated."""
+        if not self.touched:
+            return 0
+        if self.overloaded():
+            self.skipped_overloaded += 1
+            return 0
+        self.passes += 1
+        client_ids, self.touched = self.touched, set()
+        candidates = await self.run_db(find_candidates, client_ids, self.min_messages)
+        folded = 0
+        for i, candidate in enumerate(candidates):
+            if i >= self.clients_per_run or self.overloaded():
+                if i < self.clients_per_run:
+                    self.skipped_overloaded += 1
+                # Try the rest on the next pass
+                self.touched.update(c.client_id for c in candidates[i:])
+                break
+            if not self.budget.allows(candidate.company_id, candidate.daily_tokens):
+                self.skipped_budget += 1
+                continue
+            try:
+                folded += await self.summarize(candidate)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error summarizing conversation of client {candidate.client_id}: {e}")
+        self.folded += folded
+        return folded
+
+    async def summarize(self, candidate: Candidate) -> bool:
+        turns = await self.run_db(load_turns, candidate, self.batch_messages)
+        if not turns:
+            return False
+        prompt = build_summary_prompt(candidate.summary, turns)
+        summary, _ = await self.generate(prompt)
+        summary = summary.strip()
+        tokens = counter.count(summary)
+        spent = sum(counter.count(message["content"]) for message in prompt) + tokens
+        self.budget.charge(candidate.company_id, spent)
+        self.tokens_spent += spent
+        saved = await self.run_db(save_summary, candidate, summary, tokens, turns[-1][0], write=True)
+        if saved:
+            self.messages_folded += len(turns)
+            # Long backlogs are folded one batch per pass
+            if candidate.unsummarized - len(turns) > HISTORY_MESSAGES:
+                self.touched.add(candidate.client_id)
+        return saved
+
+    async def run_periodically(self, interval: float = SUMMARY_INTERVAL) -> None:
+        """Run a pass every ``interval`` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Error in summary pass: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending_clients": len(self.touched),
+            "passes": self.passes,
+            "folded": self.folded,
+            "messages_folded": self.messages_folded,
+            "tokens_spent": self.tokens_spent,
+            "skipped_overloaded": self.skipped_overloaded,
+            "skipped_budget": self.skipped_budget,
+            "errors": self.errors,
+        }
@@ -0,0 +1,156 @@
+"""Telegram Bot API calls used by the webhook.
+
+Besides plain ``sendMessage`` this provides ``StreamingReply``, which shows
+an LLM reply while it is still being generated: the first sentence is sent
+as a new message and the rest is added with throttled ``editMessageText``
+calls that stay within Telegram's per-chat rate limits.
+
+Requests go through the shared ``http_pool.pool``; the Bot API host gets
+its own timeout and retries only requests that never reached Telegram
+(failed connects), so a message is never sent twice. Rate limits (429)
+are left to the caller, ``StreamingReply`` backs off as told.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import http_pool
+
+logger = logging.getLogger("uvicorn")
+
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+TELEGRAM_TIMEOUT = float(os.getenv("TELEGRAM_TIMEOUT", "10"))
+# Telegram allows about one message (edits included) per second in a chat
+TELEGRAM_EDIT_INTERVAL = float(os.getenv("TELEGRAM_EDIT_INTERVAL", "1.0"))
+# Send the first message after this many characters even without a full sentence
+TELEGRAM_FIRST_FLUSH_CHARS = int(os.getenv("TELEGRAM_FIRST_FLUSH_CHARS", "160"))
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+SENTENCE_END = re.compile(r"[.!?…](\s|$)|\n")
+
+http_pool.pool.configure(urlsplit(TELEGRAM_API_URL).hostname, http_pool.Destination(
+    timeout=TELEGRAM_TIMEOUT,
+    retry_statuses=frozenset(),
+    retry_methods=frozenset(),
+))
+
+
+async def call(token: str, method: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Call a Bot API method and return the decoded response body."""
+    response = await http_pool.pool.post(f"{TELEGRAM_API_URL}/bot{token}/{method}", json=payload)
+    data = response.json()
+    if not data.get("ok"):
+        logger.error(f"Telegram {method} failed: {data.get('description')}")
+    return data
+
+
+def split_text(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Split text into chunks Telegram accepts, preferring line breaks."""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+
+async def send_message(token: str, chat_id: int, text: str) -> Optional[int]:
+    """Send a message, splitting long text. Returns the id of the first message."""
+    message_id = None
+    for part in split_text(text):
+        data = await call(token, "sendMessage", {"chat_id": chat_id, "text": part})
+        if message_id is None and data.get("ok"):
+            message_id = data["result"]["message_id"]
+    return message_id
+
+
+async def edit_message_text(token: str, chat_id: int, message_id: int, text: str) -> Dict[str, Any]:
+    return await call(token, "editMessageText", {
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "text": text,
+    })
+
+
+class StreamingReply:
+    """Progressively displays a reply in one Telegram message.
+
+    Feed it chunks as they arrive and call ``finish`` with the final text.
+    """
+
+    def __init__(self, token: str, chat_id: int, edit_interval: float = TELEGRAM_EDIT_INTERVAL):
+        self.token = token
+        self.chat_id = chat_id
+        self.edit_interval = edit_interval
+        self.text = ""
+        self.message_id: Optional[int] = None
+        self.first_visible_at: Optional[float] = None
+        self.edits = 0
+        self._shown = ""
+        self._next_edit_at = 0.0
+        self._started = time.monotonic()
+
+    @property
+    def time_to_first_text(self) -> Optional[float]:
+        """Seconds from creation until the user saw the first text."""
+        if self.first_visible_at is None:
+            return None
+        return self.first_visible_at - self._started
+
+    async def feed(self, chunk: str) -> None:
+        """Append a chunk and update the message if it is due."""
+        self.text += chunk
+        if self.message_id is None:
+            if SENTENCE_END.search(self.text) or len(self.text) >= TELEGRAM_FIRST_FLUSH_CHARS:
+                await self._send_first()
+        elif time.monotonic() >= self._next_edit_at:
+            await self._edit(self.text)
+
+    async def finish(self, final_text: str) -> None:
+        """Show the final text: edit the streamed message or send a new one."""
+        if self.message_id is None:
+            self.message_id = await send_message(self.token, self.chat_id, final_text)
+            self._mark_visible()
+            return
+        parts = split_text(final_text)
+        # The final edit must land, so wait for the cadence (or a rate limit)
+        for _ in range(3):
+            if parts[0] == self._shown:
+                break
+            await asyncio.sleep(max(0.0, self._next_edit_at - time.monotonic()))
+            await self._edit(parts[0])
+        for part in parts[1:]:
+            await call(self.token, "sendMessage", {"chat_id": self.chat_id, "text": part})
+
+    async def _send_first(self) -> None:
+        text = self.text[:TELEGRAM_MESSAGE_LIMIT]
+        self.message_id = await send_message(self.token, self.chat_id, text)
+        self._shown = text
+        self._mark_visible()
+        self._next_edit_at = time.monotonic() + self.edit_interval
+
+    async def _edit(self, text: str) -> None:
+        text = text[:TELEGRAM_MESSAGE_LIMIT]
+        if text == self._shown:
+            return
+        data = await edit_message_text(self.token, self.chat_id, self.message_id, text)
+        self._next_edit_at = time.monotonic() + self.edit_interval
+        if data.get("ok"):
+            self._shown = text
+            self.edits += 1
+        else:
+            # Back off as told when rate limited
+            retry_after = data.get("parameters", {}).get("retry_after")
+            if retry_after:
+                self._next_edit_at = time.monotonic() + retry_after
+
+    def _mark_visible(self) -> None:
+        if self.first_visible_at is None:
+            self.first_visible_at = time.monotonic()
@@ -0,0 +1,138 @@
+"""In-process routing table from Telegram bot token to company.
+
+The table is loaded once at startup and kept current through ``post_save``
+and ``post_delete`` signals on ``Company``, so the webhook resolves its
+tenant (or rejects an unknown token) without touching the database.
+
+Saves made by another process (the admin panel, another bot worker) send
+no signal here, and neither does ``Company.bump_config_version`` (a
+``QuerySet.update``, used when FAQs or policies change). Every
+TENANT_VERSION_POLL_SECONDS one aggregate query reads a fingerprint of the
+companies table (count, highest id, sum of config versions); any save,
+bump, insert or delete changes it and triggers a reload. The table is also
+reloaded every TENANT_TABLE_REFRESH_SECONDS regardless, so another
+process's change reaches this one within the poll interval, plus the
+query time.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger("uvicorn")
+
+TENANT_TABLE_REFRESH_SECONDS = float(os.getenv("TENANT_TABLE_REFRESH_SECONDS", "60"))
+TENANT_VERSION_POLL_SECONDS = float(os.getenv("TENANT_VERSION_POLL_SECONDS", "2"))
+
+
+class TenantRecord(NamedTuple):
+    """The few company fields the webhook needs to route an update."""
+    id: int
+    name: str
+    telegram_token: str
+    # Company.config_version when the record was read, see profiles.ProfileCache
+    config_version: int = 0
+
+    @property
+    def pk(self) -> int:
+        # Lets the record stand in for a Company in ``company_id=company.pk`` lookups
+        return self.id
+
+
+class TenantTable:
+    """Token -> TenantRecord map with hit/miss counters."""
+
+    def __init__(self):
+        self.by_token: Dict[str, TenantRecord] = {}
+        self.token_by_id: Dict[int, str] = {}
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def replace(self, rows: Iterable[Tuple]) -> None:
+        """Swap in a full set of (id, name, telegram_token[, config_version]) rows."""
+        by_token = {}
+        token_by_id = {}
+        for row in rows:
+            record = TenantRecord(*row)
+            if record.telegram_token:
+                by_token[record.telegram_token] = record
+                token_by_id[record.id] = record.telegram_token
+        self.by_token, self.token_by_id = by_token, token_by_id
+        self.loaded = True
+
+    def upsert(self, company_id: int, name: str, token: Optional[str], config_version: int = 0) -> None:
+        """Add or update one company, dropping its previous token."""
+        self.remove(company_id)
+        if token:
+            self.by_token[token] = TenantRecord(company_id, name, token, config_version)
+            self.token_by_id[company_id] = token
+
+    def remove(self, company_id: int) -> None:
+        token = self.token_by_id.pop(company_id, None)
+        if token is not None:
+            self.by_token.pop(token, None)
+
+    def lookup(self, token: str) -> Optional[TenantRecord]:
+        """Resolve a token; None means no company owns it."""
+        record = self.by_token.get(token)
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return record
+
+    def stats(self) -> Dict[str, int]:
+        return {"tenants": len(self.by_token), "hits": self.hits, "misses": self.misses}
+
+
+def fetch_rows():
+    """Read (id, name, telegram_token, config_version) of every company with a bot token."""
+    from users.models import Company
+    # The default manager filters by the admin request, so use the base one
+    return list(
+        Company._base_manager.exclude(telegram_token__isnull=True)
+        .exclude(telegram_token="")
+        .values_list("id", "name", "telegram_token", "config_version")
+    )
+
+
+def fetch_fingerprint() -> Tuple[int, int, int]:
+    """(companies, highest id, sum of config versions), changed by every save, bump or delete."""
+    from django.db.models import Count, Max, Sum
+    from users.models import Company
+    totals = Company._base_manager.aggregate(count=Count("id"), last=Max("id"), versions=Sum("config_version"))
+    return totals["count"], totals["last"] or 0, totals["versions"] or 0
+
+
+def connect_signals(table: TenantTable) -> None:
+    """Keep ``table`` in sync with Company saves and deletes in this process."""
+    from django.db.models.signals import post_delete, post_save
+    from users.models import Company
+
+    def on_save(sender, instance, **kwargs):
+        table.upsert(instance.pk, instance.name, instance.telegram_token, instance.config_version)
+
+    def on_delete(sender, instance, **kwargs):
+        table.remove(instance.pk)
+
+    post_save.connect(on_save, sender=Company, weak=False, dispatch_uid="tenant_table_save")
+    post_delete.connect(on_delete, sender=Company, weak=False, dispatch_uid="tenant_table_delete")
+
+
+async def refresh_periodically(table: TenantTable, run_db, interval: float = TENANT_TABLE_REFRESH_SECONDS,
+                               poll_interval: float = TENANT_VERSION_POLL_SECONDS) -> None:
+    """Reload the table when the companies change, and every ``interval`` seconds, until cancelled."""
+    fingerprint = None
+    reloaded_at = time.monotonic()
+    while True:
+        await asyncio.sleep(poll_interval)
+        try:
+            current = await run_db(fetch_fingerprint)
+            if current == fingerprint and time.monotonic() - reloaded_at < interval:
+                continue
+            table.replace(await run_db(fetch_rows))
+            fingerprint, reloaded_at = current, time.monotonic()
+        except Exception as e:
+            logger.error(f"Error refreshing tenant table: {e}")
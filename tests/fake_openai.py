@@ -0,0 +1,92 @@
+"""Minimal OpenAI-compatible server for tests and benchmarks.
+
+Serves ``POST /v1/chat/completions`` with a fixed reply after a configurable
+delay, as one JSON body or, with ``"stream": true``, as server-sent events
+with one chunk per word. Use it in-process through ``httpx.ASGITransport`` or run it with
+uvicorn for a real socket:
+
+    uvicorn tests.fake_openai:app --port 8808
+"""
+import asyncio
+import json
+import time
+import uuid
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+import llm_clients
+
+
+def create_app(reply: str = "Здравствуйте! Чем могу помочь?", delay: float = 0.0,
+               fail: bool = False, chunk_delay: float = 0.0) -> FastAPI:
+    """Create a fake completions app.
+
+    Args:
+        reply: Text returned as the assistant message
+        delay: Seconds to wait before answering (simulated model latency)
+        fail: Answer every request with HTTP 500
+        chunk_delay: Seconds between streamed chunks
+    """
+    fake = FastAPI()
+    fake.state.requests = 0
+
+    @fake.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        fake.state.requests += 1
+        if delay:
+            await asyncio.sleep(delay)
+        if fail:
+            return JSONResponse({"error": {"message": "fake failure"}}, status_code=500)
+        if body.get("stream"):
+            return StreamingResponse(stream_chunks(body.get("model", "fake")), media_type="text/event-stream")
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    async def stream_chunks(model):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        words = reply.split(" ")
+        for i, word in enumerate(words):
+            if i and chunk_delay:
+                await asyncio.sleep(chunk_delay)
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": word if i == 0 else " " + word},
+                    "finish_reason": None,
+                }],
+            }
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return fake
+
+
+def make_provider(name: str, **app_kwargs) -> llm_clients.Provider:
+    """Build a provider backed by an in-process fake server."""
+    transport = httpx.ASGITransport(app=create_app(**app_kwargs))
+    client = llm_clients.create_client(
+        api_key="test",
+        base_url="http://fake/v1",
+        http_client=llm_clients.create_http_client(transport=transport),
+    )
+    return llm_clients.Provider(name, client, "fake-model")
+
+
+app = create_app(delay=0.05)
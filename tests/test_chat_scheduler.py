@@ -0,0 +1,78 @@
+import asyncio
+import random
+
+import pytest
+
+from chat_scheduler import ChatScheduler
+
+
+@pytest.mark.asyncio
+async def test_thousands_of_chats_keep_order_and_run_in_parallel():
+    """Test updates of one chat run one at a time in order while chats overlap."""
+    chats, per_chat = 2000, 5
+    seen = {chat: [] for chat in range(chats)}
+    active = set()
+    overlaps = []
+    peak = 0
+
+    async def handler(item):
+        nonlocal peak
+        chat, seq = item
+        if chat in active:
+            overlaps.append(chat)
+        active.add(chat)
+        peak = max(peak, len(active))
+        await asyncio.sleep(random.random() * 0.002)
+        seen[chat].append(seq)
+        active.discard(chat)
+
+    scheduler = ChatScheduler(handler, concurrency=64, idle_timeout=0.05)
+    for seq in range(per_chat):
+        for chat in random.sample(range(chats), chats):
+            scheduler.submit(chat, (chat, seq))
+    assert await scheduler.drain(timeout=30)
+
+    assert not overlaps
+    assert all(sequence == list(range(per_chat)) for sequence in seen.values())
+    assert peak == 64
+    await scheduler.close()
+
+@pytest.mark.asyncio
+async def test_idle_lanes_are_evicted():
+    """Test a chat's lane is dropped after it stays idle, and recreated on demand."""
+    handled = []
+
+    async def handler(item):
+        handled.append(item)
+
+    scheduler = ChatScheduler(handler, concurrency=4, idle_timeout=0.01)
+    for chat in range(100):
+        scheduler.submit(chat, chat)
+    await scheduler.drain()
+    await asyncio.sleep(0.05)
+
+    assert scheduler.stats()["lanes"] == 0
+    assert scheduler.stats()["evicted"] == 100
+    scheduler.submit(1, "again")
+    await scheduler.drain()
+    assert handled[-1] == "again"
+    await scheduler.close()
+
+@pytest.mark.asyncio
+async def test_failing_item_does_not_block_its_chat():
+    """Test an exception is counted and later items of the chat still run."""
+    handled = []
+
+    async def handler(item):
+        if item == "boom":
+            raise RuntimeError(item)
+        handled.append(item)
+
+    scheduler = ChatScheduler(handler)
+    for item in ("first", "boom", "last"):
+        scheduler.submit("chat", item)
+    await scheduler.drain()
+
+    assert handled == ["first", "last"]
+    assert scheduler.stats()["errors"] == 1
+    await scheduler.close()
@@ -0,0 +1,93 @@
+import pytest
+
+import faq_cache
+from embeddings import HashingEmbedder
+from faq_cache import FAQCache, is_reusable
+
+FAQS = {
+    1: [
+        ("Какие у вас часы работы?", "Мы работаем ежедневно с 9:00 до 21:00."),
+        ("Сколько стоит абонемент в бассейн?", "Абонемент в бассейн стоит 25 000 тенге в месяц."),
+    ],
+    2: [],
+}
+
+
+class FakeDB:
+    def __init__(self):
+        self.loads = 0
+
+    async def run_db(self, func, company_id):
+        assert func is faq_cache.load_faqs
+        self.loads += 1
+        return FAQS[company_id]
+
+
+def make_cache(db, **kwargs):
+    return FAQCache(db.run_db, embedder=HashingEmbedder(), **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_rephrased_question_is_answered_from_the_faq():
+    """Test the question without its case and punctuation hits the FAQ and an unrelated message misses."""
+    cache = make_cache(FakeDB(), expected_latency=lambda: 2.0)
+
+    hit = await cache.lookup(1, 1, "какие у вас часы работы")
+    miss = await cache.lookup(1, 1, "Когда моя запись к массажисту?")
+
+    assert hit.source == "faq"
+    assert hit.answer.startswith("Мы работаем ежедневно")
+    assert miss is None
+    stats = cache.stats()["companies"][1]
+    assert stats["faq_hits"] == 1
+    assert stats["hit_rate"] == 0.5
+    assert 1.9 < stats["latency_saved"] <= 2.0
+
+@pytest.mark.asyncio
+async def test_validated_answers_are_reused_until_the_config_changes():
+    """Test a remembered LLM answer is served and dropped with a new config version."""
+    db = FakeDB()
+    cache = make_cache(db, reuse_validated=True)
+    await cache.remember(2, 1, "Есть ли у вас парковка?", "Да, бесплатная парковка у входа.")
+
+    hit = await cache.lookup(2, 1, "есть ли у вас парковка")
+    assert hit.source == "validated"
+    assert hit.answer == "Да, бесплатная парковка у входа."
+
+    assert await cache.lookup(2, 2, "есть ли у вас парковка") is None
+    assert db.loads == 2
+
+@pytest.mark.asyncio
+async def test_hashing_embedder_only_matches_the_same_words():
+    """Test questions differing in one word miss and LLM answers are not reused by default."""
+    cache = make_cache(FakeDB())
+    await cache.remember(2, 1, "Запишите меня на завтра в 10:00", "Записали вас на 10:00.")
+
+    assert await cache.lookup(1, 1, "Сколько стоит абонемент в спортзал?") is None
+    assert await cache.lookup(2, 1, "Запишите меня на завтра в 10:00") is None
+    assert cache.stats()["reuse_validated"] is False
+
+@pytest.mark.asyncio
+async def test_index_is_built_once_per_version():
+    """Test FAQs are loaded and embedded once, not per message."""
+    db = FakeDB()
+    cache = make_cache(db)
+    for _ in range(5):
+        await cache.lookup(1, 3, "Сколько стоит абонемент?")
+
+    assert db.loads == 1
+    cache.invalidate(1)
+    await cache.lookup(1, 3, "Сколько стоит абонемент?")
+    assert db.loads == 2
+
+def test_only_impersonal_first_answers_are_reusable():
+    """Test answers that depend on the conversation, the client's own details or name are not shared."""
+    class Client:
+        name = "Айгерим"
+        summary = ""
+
+    assert is_reusable("Когда вы открыты?", "Мы открыты с 9:00.", [], Client())
+    assert not is_reusable("Когда вы открыты?", "Айгерим, мы открыты с 9:00.", [], Client())
+    assert not is_reusable("Когда вы открыты?", "Мы открыты с 9:00.", [{"role": "user", "content": "Привет"}], Client())
+    assert not is_reusable("Запишите меня на завтра", "Записали вас на завтра.", [], Client())
+    assert not is_reusable("Есть окно в 18:00?", "Да, в 18:00 свободно.", [], Client())
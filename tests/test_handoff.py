@@ -0,0 +1,46 @@
+from handoff import HandoffMatch, HandoffMatcher, compile_matcher
+from profiles import CompanyProfile
+
+
+def test_reports_which_trigger_fired():
+    """Test company triggers and built-in phrases are found case-insensitively."""
+    matcher = HandoffMatcher(["оператор", "Жалоба"], word_boundaries=False)
+
+    assert matcher.match("Соединяю с ОПЕРАТОРОМ") == HandoffMatch("оператор", "trigger")
+    assert matcher.match("У вас ЖАЛОБА?") == HandoffMatch("Жалоба", "trigger")
+    assert matcher.match("Я не уверен, могу ли помочь") == HandoffMatch("не уверен", "uncertainty")
+    assert matcher.match("Всё хорошо, я могу помочь") is None
+    assert matcher.match("Извините") == HandoffMatch("извините", "fallback")
+    assert matcher.match("") is None
+
+
+def test_overlapping_phrases_match_the_longest():
+    """Test the combined regex reports a phrase that extends another as itself."""
+    triggers = ["не могу", "позвать менеджера"] + [f"код {i}" for i in range(50)]
+    matcher = HandoffMatcher(triggers, word_boundaries=False)
+    assert matcher.pattern is not None
+
+    assert matcher.match("Я не могу помочь с этим").trigger == "не могу помочь"
+    assert matcher.match("Я не могу сказать").trigger == "не могу"
+    assert matcher.match("Позвать менеджера?").trigger == "позвать менеджера"
+    assert matcher.match("Ваш КОД 42 принят").trigger == "код 42"
+
+
+def test_word_boundaries_skip_partial_words():
+    """Test whole-word matching ignores triggers inside longer words."""
+    substring = HandoffMatcher(["help"], word_boundaries=False)
+    words = HandoffMatcher(["help"], word_boundaries=True)
+
+    assert substring.match("That was helpful information") is not None
+    assert words.match("That was helpful information") is None
+    assert words.match("I need help, please") == HandoffMatch("help", "trigger")
+
+
+def test_profile_compiles_its_matcher_once():
+    """Test profiles with the same triggers share one cached matcher."""
+    first = CompanyProfile(company_id=1, config_version=1, name="A", handoff_triggers=("оператор",))
+    second = CompanyProfile(company_id=1, config_version=2, name="A", handoff_triggers=("оператор",))
+
+    assert first.handoff_matcher is second.handoff_matcher
+    assert first.handoff_matcher is compile_matcher(("оператор",))
+    assert first == CompanyProfile(company_id=1, config_version=1, name="A", handoff_triggers=("оператор",))
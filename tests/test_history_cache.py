@@ -0,0 +1,78 @@
+from history_cache import HistoryCache
+
+
+def turns(*texts):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": text} for i, text in enumerate(texts)]
+
+
+def test_miss_then_hits_after_load():
+    """Test a conversation is served from memory once it has been loaded."""
+    cache = HistoryCache(turns=4)
+
+    assert cache.get((1, 1), 4) is None
+    cache.load((1, 1), turns("a", "b"))
+
+    assert [m["content"] for m in cache.get((1, 1), 4)] == ["a", "b"]
+    assert [m["content"] for m in cache.get((1, 1), 1)] == ["b"]
+    assert cache.stats()["hit_ratio"] == round(2 / 3, 4)
+
+def test_append_keeps_only_the_last_turns():
+    """Test saved exchanges are appended and the oldest fall out of the ring."""
+    cache = HistoryCache(turns=4)
+    cache.load((1, 1), turns("a", "b", "c"))
+    cache.append((1, 1), turns("d", "e"))
+
+    assert [m["content"] for m in cache.get((1, 1), 4)] == ["b", "c", "d", "e"]
+    # Appending to a conversation that is not cached does not create a partial one
+    cache.append((1, 2), turns("x"))
+    assert cache.get((1, 2), 4) is None
+
+def test_longer_limit_than_the_ring_is_a_miss():
+    """Test a request for more messages than are kept goes to the database."""
+    cache = HistoryCache(turns=2)
+    cache.load((1, 1), turns("a", "b"))
+
+    assert cache.get((1, 1), 3) is None
+
+def test_evicts_least_recently_used_over_the_memory_ceiling():
+    """Test conversations are dropped oldest-used first once over max_bytes."""
+    one = HistoryCache(turns=10)
+    one.load("size", turns("x" * 1000))
+    size = one.bytes
+    cache = HistoryCache(turns=10, max_bytes=size * 2)
+
+    cache.load((1, 1), turns("x" * 1000))
+    cache.load((1, 2), turns("x" * 1000))
+    cache.get((1, 1), 10)
+    cache.load((1, 3), turns("x" * 1000))
+
+    assert cache.get((1, 2), 10) is None
+    assert cache.get((1, 1), 10) is not None
+    assert cache.bytes <= cache.max_bytes
+    assert cache.stats()["evictions"] == 1
+
+def test_bytes_follow_appends_and_invalidation():
+    """Test the memory estimate stays consistent as the ring overwrites and entries go."""
+    cache = HistoryCache(turns=2)
+    cache.load((1, 1), turns("a"))
+    for _ in range(5):
+        cache.append((1, 1), turns("b" * 100, "c" * 100))
+    reloaded = HistoryCache(turns=2)
+    reloaded.load((1, 1), turns("b" * 100, "c" * 100))
+
+    assert cache.bytes == reloaded.bytes
+    cache.invalidate((1, 1))
+    assert cache.bytes == 0
+
+def test_conversations_changed_elsewhere_are_reloaded():
+    """Test an entry cached at an older client version misses and is not appended to."""
+    cache = HistoryCache(turns=4)
+    cache.load((1, 1), turns("a", "b"), version=1)
+    cache.append((1, 1), turns("c", "d"), since=1, version=2)
+
+    assert [m["content"] for m in cache.get((1, 1), 4, version=2)] == ["a", "b", "c", "d"]
+    # Another process saved an exchange (version 3) before this one saved its own
+    assert cache.get((1, 1), 4, version=3) is None
+    cache.append((1, 1), turns("e"), since=3, version=4)
+    assert cache.get((1, 1), 4, version=4) is None
+    assert cache.stats()["conversations"] == 0
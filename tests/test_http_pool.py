@@ -0,0 +1,74 @@
+import asyncio
+
+import httpx
+import pytest
+
+from http_pool import Destination, HTTPPool
+
+NO_BACKOFF = Destination(backoff=0)
+
+
+@pytest.mark.asyncio
+async def test_hosts_get_their_own_clients_and_policies():
+    """Test each host has one pooled client configured from its destination."""
+    pool = HTTPPool({"api.telegram.org": Destination(timeout=3)},
+                    transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+    await pool.start()
+
+    await pool.get("https://api.telegram.org/bot1/getMe")
+    await pool.get("https://api.telegram.org/bot1/getMe")
+    await pool.get("https://example.com/")
+
+    assert set(pool.clients) == {"api.telegram.org", "example.com"}
+    assert pool.clients["api.telegram.org"].timeout.read == 3
+    assert pool.stats()["hosts"]["api.telegram.org"]["requests"] == 2
+    await pool.aclose()
+    assert pool.clients == {}
+
+
+@pytest.mark.asyncio
+async def test_retries_follow_the_destination_policy():
+    """Test 503 and failed connects are retried but a POST is not repeated after a read error."""
+    responses = iter([503, 200])
+    calls = []
+
+    def handler(request):
+        calls.append((request.url.host, request.method))
+        if request.url.host == "down.example":
+            raise httpx.ConnectError("connection refused", request=request)
+        if request.url.host == "slow.example":
+            raise httpx.ReadTimeout("timed out", request=request)
+        return httpx.Response(next(responses), headers={"Retry-After": "0"})
+
+    pool = HTTPPool(default=NO_BACKOFF, transport=httpx.MockTransport(handler))
+
+    assert (await pool.get("https://crm.example/users")).status_code == 200
+    with pytest.raises(httpx.ConnectError):
+        await pool.post("https://down.example/send")
+    with pytest.raises(httpx.ReadTimeout):
+        await pool.post("https://slow.example/send")
+
+    assert calls.count(("down.example", "POST")) == 3
+    assert calls.count(("slow.example", "POST")) == 1
+    hosts = pool.stats()["hosts"]
+    assert hosts["crm.example"]["retries"] == 1 and hosts["crm.example"]["failures"] == 1
+    assert hosts["down.example"]["failures"] == 3
+    await pool.aclose()
+
+
+@pytest.mark.asyncio
+async def test_saturation_counts_concurrent_requests():
+    """Test in-flight requests are measured against the host's connection limit."""
+    async def handler(request):
+        await asyncio.sleep(0.05)
+        return httpx.Response(200)
+
+    pool = HTTPPool(default=Destination(max_connections=10), transport=httpx.MockTransport(handler))
+
+    await asyncio.gather(*(pool.get("https://api.example/") for _ in range(5)))
+
+    stats = pool.stats()["hosts"]["api.example"]
+    assert stats["peak_in_flight"] == 5 and stats["peak_saturation"] == 0.5
+    assert stats["in_flight"] == 0 and stats["saturation"] == 0.0
+    assert stats["p50_ms"] >= 50
+    await pool.aclose()
@@ -0,0 +1,29 @@
+from language import CLIENT_LANGUAGE_KEY, detect, detect_for_client, detect_language
+
+
+def test_script_decides_english_and_kazakh_letters():
+    """Test Latin text is English and Kazakh-only letters mean Kazakh."""
+    assert detect("How much is the pool?") == ("en", True)
+    assert detect("Сәлеметсіз бе") == ("kz", True)
+    assert detect_language("Сiз кайда орналаскансыз") == "kz"
+    assert detect("123 !!!") == (None, False)
+
+
+def test_cyrillic_is_told_apart_by_trigrams():
+    """Test Kazakh typed without its letters is not mistaken for Russian."""
+    assert detect("Калай жазылуга болады") == ("kz", True)
+    assert detect("Кандай кызметтер бар") == ("kz", True)
+    assert detect("Где вы находитесь") == ("ru", True)
+    assert detect("Запишите меня на пятницу") == ("ru", True)
+
+
+def test_short_messages_use_the_remembered_language():
+    """Test a confident detection is remembered and short messages fall back to it."""
+    settings = {"preferred_language": "ru"}
+
+    assert detect_for_client("ок", settings, default="ru") == ("ru", False)
+    assert detect_for_client("Сабақты болдырмағым келеді", settings) == ("kz", True)
+    assert settings[CLIENT_LANGUAGE_KEY] == "kz"
+    assert detect_for_client("ок", settings) == ("kz", False)
+    assert detect_for_client("Бес минутқа кешігемін", settings) == ("kz", False)
+    assert detect_for_client("Thank you so much!", settings) == ("en", True)
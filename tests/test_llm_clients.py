@@ -0,0 +1,32 @@
+import asyncio
+import time
+
+import pytest
+
+import llm_clients
+from tests.fake_openai import make_provider
+
+
+@pytest.mark.asyncio
+async def test_complete_returns_reply():
+    """Test a completion is read from the provider."""
+    provider = make_provider("OpenAI", reply="Привет!")
+
+    reply = await llm_clients.complete(provider, [{"role": "user", "content": "Привет"}])
+
+    assert reply == "Привет!"
+    await llm_clients.close([provider])
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_overlap():
+    """Test many completions are in flight at once instead of serializing."""
+    provider = make_provider("OpenAI", delay=0.1)
+    messages = [{"role": "user", "content": "Привет"}]
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(llm_clients.complete(provider, messages) for _ in range(100)))
+    elapsed = time.perf_counter() - started
+
+    assert len(results) == 100
+    assert elapsed < 5  # 10 s if the calls were serialized
+    await llm_clients.close([provider])
@@ -0,0 +1,139 @@
+import pytest
+
+import llm_clients
+import llm_routing
+from tests.fake_openai import make_provider
+
+MESSAGES = [{"role": "user", "content": "Привет"}]
+
+
+def test_tracker_ranks_fastest_provider_first():
+    """Test routing weights follow the observed latencies."""
+    tracker = llm_routing.LatencyTracker()
+    for _ in range(10):
+        tracker.record("OpenAI", 2.0)
+        tracker.record("Nebius", 0.5)
+
+    weights = tracker.weights(["OpenAI", "Nebius"])
+
+    assert weights["Nebius"] > weights["OpenAI"]
+    assert abs(sum(weights.values()) - 1) < 1e-9
+    assert tracker.snapshot()["Nebius"]["histogram"]["0.5"] == 10
+
+def test_tracker_penalizes_errors():
+    """Test a failing provider loses weight even when it is fast."""
+    tracker = llm_routing.LatencyTracker()
+    for _ in range(10):
+        tracker.record("OpenAI", 0.5, ok=False)
+        tracker.record("Nebius", 1.0)
+
+    assert tracker.weights(["OpenAI", "Nebius"])["OpenAI"] == 0
+
+def test_hedge_delay_uses_p95():
+    """Test the hedge delay adapts to the provider p95 within bounds."""
+    tracker = llm_routing.LatencyTracker()
+    assert tracker.hedge_delay("OpenAI") == llm_routing.LLM_HEDGE_DEFAULT_DELAY
+
+    for i in range(100):
+        tracker.record("OpenAI", 1.0 + i / 100)
+
+    assert tracker.hedge_delay("OpenAI") == pytest.approx(1.95)
+
+def test_cancelled_calls_only_count_past_the_hedge_delay():
+    """Test a call beaten early stays out of the window and one cancelled past its hedge delay is kept."""
+    tracker = llm_routing.LatencyTracker()
+
+    tracker.record_cancelled("OpenAI", 0.1)
+    tracker.record_cancelled("OpenAI", llm_routing.LLM_HEDGE_DEFAULT_DELAY + 1)
+
+    assert list(tracker.stats["OpenAI"].latencies) == [llm_routing.LLM_HEDGE_DEFAULT_DELAY + 1]
+    assert tracker.stats["OpenAI"].cancelled == 2
+
+@pytest.mark.asyncio
+async def test_generate_routed_falls_back_to_next_provider():
+    """Test a failing provider falls through to the next one."""
+    providers = [make_provider("OpenAI", fail=True), make_provider("Nebius", reply="Ответ")]
+    tracker = llm_routing.LatencyTracker()
+
+    reply, service_used = await llm_routing.generate_routed(providers, MESSAGES, tracker)
+
+    assert (reply, service_used) == ("Ответ", "Nebius")
+    assert tracker.stats["OpenAI"].errors == 1
+    await llm_clients.close(providers)
+
+@pytest.mark.asyncio
+async def test_generate_routed_raises_when_all_providers_fail():
+    """Test an error is raised when no provider answers."""
+    providers = [make_provider("OpenAI", fail=True)]
+
+    with pytest.raises(RuntimeError):
+        await llm_routing.generate_routed(providers, MESSAGES, llm_routing.LatencyTracker())
+    await llm_clients.close(providers)
+
+@pytest.mark.asyncio
+async def test_generate_hedged_takes_backup_when_primary_is_slow(monkeypatch):
+    """Test the backup provider wins once the primary exceeds the hedge delay."""
+    monkeypatch.setattr(llm_routing, "LLM_HEDGE_DEFAULT_DELAY", 0.05)
+    providers = [make_provider("OpenAI", delay=2, reply="Медленно"), make_provider("Nebius", reply="Быстро")]
+    tracker = llm_routing.LatencyTracker()
+
+    reply, service_used = await llm_routing.generate_hedged(providers, MESSAGES, tracker)
+
+    assert (reply, service_used) == ("Быстро", "Nebius")
+    await llm_clients.close(providers)
+    assert tracker.stats["OpenAI"].cancelled == 1
+
+@pytest.mark.asyncio
+async def test_generate_hedged_uses_the_fallback_hedge_delay(monkeypatch):
+    """Test the provider started after a failure is hedged after its own delay, not the failed one's."""
+    monkeypatch.setattr(llm_clients, "LLM_MAX_RETRIES", 0)
+    monkeypatch.setattr(llm_routing, "LLM_HEDGE_DEFAULT_DELAY", 0.05)
+    providers = [make_provider("OpenAI", fail=True), make_provider("Nebius", delay=2, reply="Медленно"),
+                 make_provider("Groq", reply="Быстро")]
+    tracker = llm_routing.LatencyTracker()
+    for _ in range(llm_routing.LLM_HEDGE_MIN_SAMPLES):
+        tracker.record("OpenAI", 3.0)
+
+    reply, service_used = await llm_routing.generate_hedged(providers, MESSAGES, tracker)
+
+    assert (reply, service_used) == ("Быстро", "Groq")
+    await llm_clients.close(providers)
+
+@pytest.mark.asyncio
+async def test_generate_hedged_does_not_hedge_fast_primary(monkeypatch):
+    """Test no backup request is sent when the primary answers in time."""
+    monkeypatch.setattr(llm_routing, "LLM_HEDGE_DEFAULT_DELAY", 1)
+    providers = [make_provider("OpenAI", reply="Быстро"), make_provider("Nebius", reply="Запасной")]
+    tracker = llm_routing.LatencyTracker()
+
+    reply, service_used = await llm_routing.generate_hedged(providers, MESSAGES, tracker)
+
+    assert service_used == "OpenAI"
+    assert "Nebius" not in tracker.stats
+    await llm_clients.close(providers)
+
+@pytest.mark.asyncio
+async def test_reply_stream_yields_chunks():
+    """Test a streamed reply arrives in chunks and names the provider."""
+    providers = [make_provider("OpenAI", reply="Добрый день, чем помочь?")]
+    stream = llm_routing.ReplyStream(providers, MESSAGES, llm_routing.LatencyTracker())
+
+    chunks = [chunk async for chunk in stream]
+
+    assert len(chunks) > 1
+    assert "".join(chunks) == "Добрый день, чем помочь?"
+    assert stream.service_used == "OpenAI"
+    await llm_clients.close(providers)
+
+@pytest.mark.asyncio
+async def test_reply_stream_hedges_on_first_chunk(monkeypatch):
+    """Test a stream that shows no first chunk in time is beaten by the backup."""
+    monkeypatch.setattr(llm_routing, "LLM_HEDGE_DEFAULT_DELAY", 0.05)
+    providers = [make_provider("OpenAI", delay=2, reply="Медленно"), make_provider("Nebius", reply="Быстро")]
+    stream = llm_routing.ReplyStream(providers, MESSAGES, llm_routing.LatencyTracker(), hedge=True)
+
+    chunks = [chunk async for chunk in stream]
+
+    assert "".join(chunks) == "Быстро"
+    assert stream.service_used == "Nebius"
+    await llm_clients.close(providers)
@@ -157,3 +157,97 @@ def test_database_init(test_db):
     companies = test_db.query(Company).all()
     assert len(companies) > 0
     assert any(company.name == "Default Company" for company in companies)
+
+@pytest.mark.asyncio
+async def test_replies_use_the_company_bot_token(mocker):
+    """Test each tenant's update is answered through that tenant's own bot."""
+    import main
+    from profiles import CompanyProfile
+
+    companies = {
+        "111:first": mocker.Mock(pk=1, config_version=1, telegram_token="111:first"),
+        "222:second": mocker.Mock(pk=2, config_version=1, telegram_token="222:second"),
+    }
+    mocker.patch.object(main, "resolve_company", mocker.AsyncMock(side_effect=companies.get))
+    mocker.patch.object(main, "get_profile", mocker.AsyncMock(side_effect=lambda company: (
+        CompanyProfile.from_script_profile({"company_id": company.pk, "company": str(company.pk),
+                                            "messages": {"welcome": "Добро пожаловать!"}}))))
+    client = mocker.Mock(pk=1, settings={}, username=None)
+    mocker.patch.object(main.repository, "get_or_create_client", mocker.AsyncMock(return_value=client))
+    mocker.patch.object(main.repository, "save_client_settings", mocker.AsyncMock())
+    mocker.patch.object(main.repository, "save_exchange", mocker.AsyncMock(return_value=(mocker.Mock(), mocker.Mock())))
+    send_message = mocker.patch.object(main.telegram_api, "send_message", mocker.AsyncMock())
+
+    for token, chat_id in [("111:first", 10), ("222:second", 20)]:
+        update = {"update_id": chat_id, "message": {"chat": {"id": chat_id}, "from": {"id": chat_id}, "text": "/start"}}
+        assert (await main.handle_update(token, update))["status"] == "ok"
+
+    assert [(call.args[0], call.args[1]) for call in send_message.await_args_list] == [
+        ("111:first", 10), ("222:second", 20)]
+
+@pytest.mark.asyncio
+async def test_llm_failure_is_retried_until_the_last_attempt(mocker):
+    """Test a failed LLM call re-raises for the queue and only the last attempt sends the error message."""
+    import main
+    from profiles import CompanyProfile
+
+    company = mocker.Mock(pk=1, config_version=1, telegram_token="111:first")
+    mocker.patch.object(main, "resolve_company", mocker.AsyncMock(return_value=company))
+    mocker.patch.object(main, "get_profile", mocker.AsyncMock(return_value=CompanyProfile.from_script_profile(
+        {"company_id": 1, "company": "Бассейн", "messages": {"error": "Попробуйте позже."}})))
+    mocker.patch.object(main, "TELEGRAM_STREAMING", False)
+    mocker.patch.object(main.repository, "get_or_create_client",
+                        mocker.AsyncMock(return_value=mocker.Mock(pk=1, settings={}, username=None)))
+    mocker.patch.object(main.repository, "get_history", mocker.AsyncMock(return_value=[]))
+    mocker.patch.object(main.repository, "save_exchange", mocker.AsyncMock(return_value=(mocker.Mock(), mocker.Mock())))
+    mocker.patch.object(main.answer_cache, "lookup", mocker.AsyncMock(return_value=None))
+    mocker.patch.object(main.retriever, "retrieve", mocker.AsyncMock(return_value=[]))
+    mocker.patch.object(main, "generate_ai_response", mocker.AsyncMock(side_effect=RuntimeError("LLM down")))
+    send_message = mocker.patch.object(main.telegram_api, "send_message", mocker.AsyncMock())
+    update = {"update_id": 1, "message": {"chat": {"id": 10}, "from": {"id": 10}, "text": "Сколько стоит абонемент?"}}
+
+    with pytest.raises(RuntimeError):
+        await main.handle_update("111:first", update, last_attempt=False)
+    assert send_message.await_count == 0
+
+    assert (await main.handle_update("111:first", update, last_attempt=True))["status"] == "ok"
+    assert send_message.await_args.args[2].startswith("Попробуйте позже.")
+
+@pytest.mark.asyncio
+async def test_retried_update_is_not_answered_twice(mocker):
+    """Test the exchange is stored with its update_id and a retry that finds it sends nothing."""
+    import main
+    from profiles import CompanyProfile
+
+    company = mocker.Mock(pk=1, config_version=1, telegram_token="111:first")
+    mocker.patch.object(main, "resolve_company", mocker.AsyncMock(return_value=company))
+    mocker.patch.object(main, "get_profile", mocker.AsyncMock(return_value=CompanyProfile.from_script_profile(
+        {"company_id": 1, "company": "Бассейн", "messages": {"welcome": "Добро пожаловать!"}})))
+    client = mocker.Mock(pk=1, settings={}, username=None)
+    mocker.patch.object(main.repository, "get_or_create_client", mocker.AsyncMock(return_value=client))
+    save_exchange = mocker.patch.object(main.repository, "save_exchange",
+                                        mocker.AsyncMock(return_value=(mocker.Mock(), mocker.Mock())))
+    is_answered = mocker.patch.object(main.repository, "is_answered", mocker.AsyncMock(return_value=True))
+    send_message = mocker.patch.object(main.telegram_api, "send_message", mocker.AsyncMock())
+    update = {"update_id": 7, "message": {"chat": {"id": 10}, "from": {"id": 10}, "text": "/start"}}
+
+    assert (await main.handle_update("111:first", update))["status"] == "ok"
+    assert save_exchange.await_args.kwargs["update_id"] == 7
+    assert is_answered.await_count == 0
+
+    assert (await main.handle_update("111:first", update, retry=True))["status"] == "duplicate"
+    assert send_message.await_count == 1 and save_exchange.await_count == 1
+
+@pytest.mark.asyncio
+async def test_summaries_do_not_feed_the_live_latency_tracker(mocker):
+    """Test summary calls are timed on their own tracker, not the one routing live replies."""
+    import main
+
+    mocker.patch.object(main.llm_clients, "complete", mocker.AsyncMock(return_value="Клиент записан на пятницу."))
+    live_calls = {name: stats.calls for name, stats in main.llm_latency.stats.items()}
+
+    reply, _ = await main.summarizer.generate([{"role": "user", "content": "Привет"}])
+
+    assert reply == "Клиент записан на пятницу."
+    assert {name: stats.calls for name, stats in main.llm_latency.stats.items()} == live_calls
+    assert sum(stats.calls for stats in main.summary_latency.stats.values()) == 1
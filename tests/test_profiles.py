@@ -0,0 +1,99 @@
+import dataclasses
+import json
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+from profiles import (CompanyProfile, ProfileCache, ScheduleTable, WeeklySchedule, parse_hours,
+                      parse_list)
+
+POLICY_PATH = os.path.join(os.path.dirname(__file__), "test_policy.json")
+
+
+def load_policy():
+    with open(POLICY_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_profile_is_compiled_from_script_profile():
+    """Test lists, triggers and working hours are parsed once into the profile."""
+    profile = CompanyProfile.from_script_profile(load_policy())
+
+    assert profile.name == "FitClinic.kz"
+    assert "не знаю" in profile.handoff_triggers
+    assert isinstance(profile.allowed_topics, tuple)
+    assert profile.schedule[0] == (9 * 60, 21 * 60)
+    assert profile.schedule[6] == (10 * 60, 16 * 60)
+
+def test_profile_is_immutable():
+    """Test a cached profile cannot be changed by a request."""
+    profile = CompanyProfile.from_script_profile(load_policy())
+
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        profile.name = "Other"
+    assert not hasattr(profile, "__dict__")
+
+def test_parse_helpers():
+    """Test comma strings and lists normalize the same way and hours are validated."""
+    assert parse_list("цены, запись,") == ("цены", "запись")
+    assert parse_list(["цены", " запись "]) == ("цены", "запись")
+    assert parse_hours("") is None
+    assert parse_hours("22:00-06:00") == (22 * 60, 6 * 60)
+    with pytest.raises(ValueError):
+        parse_hours("9-21")
+
+def test_cache_invalidates_on_new_version():
+    """Test a saved company (higher config version) misses the cache."""
+    cache = ProfileCache()
+    cache.put(CompanyProfile.from_script_profile({"company_id": 1, "config_version": 3, "company": "A"}))
+
+    assert cache.get(1, 3).name == "A"
+    assert cache.get(1, 2).name == "A"
+    assert cache.get(1, 4) is None
+    assert cache.stats() == {"profiles": 1, "hits": 2, "misses": 1}
+
+def test_weekly_schedule_runs_overnight_hours_into_the_next_day():
+    """Test overnight hours spill into the next day, Sunday night into Monday, closing minute included."""
+    week = [None] * 7
+    week[0] = (9 * 60, 18 * 60)
+    week[4] = (22 * 60, 2 * 60)
+    week[6] = (20 * 60, 1 * 60)
+    schedule = WeeklySchedule.compile(tuple(week), "UTC")
+
+    # 2024-01-01 is a Monday
+    assert schedule.is_open(datetime(2024, 1, 1, 1, 0, tzinfo=timezone.utc))
+    assert not schedule.is_open(datetime(2024, 1, 1, 1, 1, tzinfo=timezone.utc))
+    assert schedule.is_open(datetime(2024, 1, 1, 9, 0, tzinfo=timezone.utc))
+    assert schedule.is_open(datetime(2024, 1, 1, 18, 0, tzinfo=timezone.utc))
+    assert not schedule.is_open(datetime(2024, 1, 1, 18, 1, tzinfo=timezone.utc))
+    assert schedule.is_open(datetime(2024, 1, 6, 2, 0, tzinfo=timezone.utc))
+    assert not schedule.is_open(datetime(2024, 1, 6, 2, 1, tzinfo=timezone.utc))
+    assert not schedule.is_open(datetime(2024, 1, 5, 21, 59, tzinfo=timezone.utc))
+    assert not WeeklySchedule.compile(((600, 600),) * 7, "UTC").starts
+    assert WeeklySchedule.compile(((0, 24 * 60),) + (None,) * 6, "UTC").ends == (24 * 60,)
+
+def test_profile_is_open_in_its_timezone():
+    """Test working hours are checked in the company's local time."""
+    profile = CompanyProfile.from_script_profile(
+        {"company_id": 1, "company": "A", "timezone": "Asia/Almaty", "working_hours": {"monday": "9:00-18:00"}})
+
+    # 05:00 UTC is 10:00 or 11:00 in Almaty depending on the tz database
+    assert profile.is_open(datetime(2024, 1, 1, 5, 0, tzinfo=timezone.utc))
+    assert not profile.is_open(datetime(2024, 1, 1, 14, 0, tzinfo=timezone.utc))
+    assert not profile.is_open(datetime(2024, 1, 2, 5, 0, tzinfo=timezone.utc))
+
+def test_schedule_table_matches_per_company_checks():
+    """Test the vectorized open check agrees with each profile across timezones."""
+    hours = {day: "9:00-18:00" for day in ("monday", "tuesday", "wednesday", "thursday", "friday")}
+    companies = [
+        CompanyProfile.from_script_profile(
+            {"company_id": i, "company": str(i), "timezone": tz, "working_hours": hours})
+        for i, tz in enumerate(["UTC", "Asia/Almaty", "America/New_York", "Europe/Moscow"], start=1)
+    ]
+    table = ScheduleTable.from_profiles(companies)
+
+    for hour in range(0, 24 * 7, 5):
+        now = datetime(2024, 1, 1, tzinfo=timezone.utc).replace(day=1 + hour // 24, hour=hour % 24)
+        assert table.open_companies(now) == [p.company_id for p in companies if p.is_open(now)]
+    assert table.open_companies(datetime(2024, 1, 1, 12, tzinfo=timezone.utc)) == [1, 2, 4]
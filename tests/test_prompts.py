@@ -0,0 +1,108 @@
+import dataclasses
+import json
+import os
+
+from profiles import CompanyProfile
+from prompts import PrefixCache, build_prompt
+
+POLICY_PATH = os.path.join(os.path.dirname(__file__), "test_policy.json")
+
+
+def load_profile(**changes):
+    with open(POLICY_PATH, encoding="utf-8") as f:
+        script_profile = json.load(f)
+    script_profile.update({"company_id": 1, "config_version": 1})
+    return dataclasses.replace(CompanyProfile.from_script_profile(script_profile), **changes)
+
+
+class FakeClient:
+    full_name = "Айгерим"
+    phone_number = "77010000000"
+
+
+def test_static_prefix_is_identical_across_requests():
+    """Test the first message does not depend on the user, history or message."""
+    profile = load_profile()
+    history = [{"role": "user", "content": "Здравствуйте"}, {"role": "assistant", "content": "Добрый день!"}]
+
+    first = build_prompt(profile, "Какие цены?")
+    second = build_prompt(profile, "Где вы находитесь?", history, user_data=FakeClient(), detected_language="ru")
+
+    assert first[0] == second[0]
+    assert "FitClinic.kz" in first[0]["content"]
+    assert "Где вы находитесь?" not in second[0]["content"]
+
+def test_history_is_sent_once_as_chat_messages():
+    """Test history and per-request context follow the prefix, the message comes last."""
+    history = [{"role": "user", "content": "Здравствуйте"}, {"role": "assistant", "content": "Добрый день!"}]
+
+    messages = build_prompt(load_profile(), "Какие цены?", history, user_data=FakeClient(), detected_language="kz")
+
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "system", "user"]
+    assert "Здравствуйте" not in messages[0]["content"]
+    assert "Айгерим" in messages[3]["content"]
+    assert "казахском" in messages[3]["content"]
+    assert messages[-1] == {"role": "user", "content": "Какие цены?"}
+
+def test_prefix_is_rerendered_on_new_version():
+    """Test the cached prefix follows the profile's config version."""
+    cache = PrefixCache()
+
+    first = cache.get(load_profile())
+    assert cache.get(load_profile()) is first
+    changed = cache.get(load_profile(name="FitClinic Almaty", config_version=2))
+
+    assert "FitClinic Almaty" in changed
+    assert cache.stats() == {"prefixes": 1, "hits": 1, "misses": 2}
+
+def test_history_is_trimmed_to_the_token_budget():
+    """Test the newest messages that fit the company budget are kept, using stored counts."""
+    history = [
+        {"role": "user", "content": "вставленный длинный текст", "tokens": 900},
+        {"role": "assistant", "content": "Ответ", "tokens": 50},
+        {"role": "user", "content": "Вопрос", "tokens": 30},
+        {"role": "assistant", "content": "Ответ", "tokens": 20},
+    ]
+    messages = build_prompt(load_profile(history_token_budget=500), "Какие цены?", history)
+
+    assert [m["content"] for m in messages[1:-1]] == ["Ответ", "Вопрос", "Ответ"]
+    prefix_tokens = build_prompt(load_profile(history_token_budget=0), "Какие цены?", history).tokens
+    assert messages.tokens == prefix_tokens + 100
+
+def test_prompt_reports_its_tokens():
+    """Test the prompt size covers the prefix, the context and the message."""
+    profile = load_profile()
+    bare = build_prompt(profile, "Цены")
+    longer = build_prompt(profile, "Какие цены на абонемент?", user_data=FakeClient(), detected_language="ru")
+
+    assert bare.tokens > 0
+    assert longer.tokens > bare.tokens
+    assert isinstance(longer, list)
+
+def test_summary_comes_before_the_history():
+    """Test the client's rolling summary is sent after the prefix and counted."""
+    class SummarizedClient(FakeClient):
+        summary = "Клиент записан на массаж в пятницу."
+        summary_token_count = 7
+
+    history = [{"role": "user", "content": "Здравствуйте", "tokens": 1}]
+    messages = build_prompt(load_profile(), "Когда моя запись?", history, user_data=SummarizedClient())
+    plain = build_prompt(load_profile(), "Когда моя запись?", history, user_data=FakeClient())
+
+    assert messages[1]["role"] == "system"
+    assert "массаж в пятницу" in messages[1]["content"]
+    assert messages[2]["content"] == "Здравствуйте"
+    assert messages.tokens == plain.tokens + 7
+
+def test_knowledge_comes_after_the_history():
+    """Test retrieved snippets are sent between the history and the current message."""
+    history = [{"role": "user", "content": "Здравствуйте", "tokens": 1}]
+    snippets = ["Вопрос: Сколько стоит бассейн?\nОтвет: 25 000 тенге в месяц."]
+    messages = build_prompt(load_profile(), "Цена бассейна?", history, knowledge=snippets)
+    plain = build_prompt(load_profile(), "Цена бассейна?", history)
+
+    assert messages[1]["content"] == "Здравствуйте"
+    assert messages[2]["role"] == "system"
+    assert snippets[0] in messages[2]["content"]
+    assert messages[-1]["content"] == "Цена бассейна?"
+    assert messages.tokens > plain.tokens
@@ -0,0 +1,65 @@
+from response_cache import ResponseCache, is_personal, normalize
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_normalize():
+    """Test case, punctuation, ё and spacing do not split the key."""
+    assert normalize("  Цена?! ") == "цена"
+    assert normalize("Ещё   вопрос") == normalize("еще вопрос")
+
+def test_personal_messages_bypass_the_cache():
+    """Test messages about the client themselves are never served or stored."""
+    cache = ResponseCache()
+    assert is_personal("Когда моя запись?")
+    assert is_personal("Мой номер 87011234567")
+    assert not is_personal("Какие цены?")
+
+    cache.put(1, 1, "Когда моя запись?", "ru", "Завтра в 10:00")
+    assert cache.get(1, 1, "Когда моя запись?", "ru") is None
+    assert cache.entries == {}
+    assert cache.stats()["bypassed"] == 1
+
+def test_hit_within_ttl_and_expiry():
+    """Test a reply is served for a repeated message until the TTL passes."""
+    clock = Clock()
+    cache = ResponseCache(ttl=60, clock=clock)
+    cache.put(1, 1, "цена?", "ru", "Абонемент стоит 25 000 тенге.")
+
+    assert cache.get(1, 1, "Цена", "ru") == "Абонемент стоит 25 000 тенге."
+    assert cache.get(1, 1, "Цена", "kz") is None
+    assert cache.get(2, 1, "Цена", "ru") is None
+    clock.now = 61
+    assert cache.get(1, 1, "Цена", "ru") is None
+    assert cache.stats()["expired"] == 1
+
+def test_new_config_version_drops_the_company():
+    """Test a profile, FAQ or policy change invalidates the company's replies."""
+    cache = ResponseCache()
+    cache.put(1, 1, "адрес", "ru", "пр. Абая 150")
+    cache.put(2, 1, "адрес", "ru", "ул. Сатпаева 1")
+
+    assert cache.get(1, 2, "адрес", "ru") is None
+    assert cache.get(2, 1, "адрес", "ru") == "ул. Сатпаева 1"
+    assert len(cache.entries) == 1
+    # A reply generated with the old configuration is not stored afterwards
+    cache.put(1, 1, "адрес", "ru", "пр. Абая 150")
+    assert len(cache.entries) == 1
+
+def test_lru_eviction_by_size():
+    """Test the least recently used reply goes first once the cache is full."""
+    cache = ResponseCache(size=2)
+    cache.put(1, 1, "привет", "ru", "Здравствуйте!")
+    cache.put(1, 1, "адрес", "ru", "пр. Абая 150")
+    cache.get(1, 1, "привет", "ru")
+    cache.put(1, 1, "цена", "ru", "25 000 тенге")
+
+    assert cache.get(1, 1, "адрес", "ru") is None
+    assert cache.get(1, 1, "привет", "ru") == "Здравствуйте!"
+    assert cache.stats()["evicted"] == 1
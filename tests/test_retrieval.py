@@ -0,0 +1,132 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import retrieval
+from retrieval import BM25Index, Retriever, faq_document, policy_document
+from vector_store import VectorStores
+
+POOL = faq_document(1, "Сколько стоит абонемент в бассейн?", "Абонемент в бассейн стоит 25 000 тенге в месяц.")
+HOURS = faq_document(2, "Какие у вас часы работы?", "Мы работаем ежедневно с 9:00 до 21:00.")
+REFUNDS = policy_document(3, "Возврат", "Деньги за неиспользованный абонемент возвращаются в течение 10 дней.")
+
+
+class FakeDB:
+    """Serves ``load_changes`` from a list of documents, like the real delta query."""
+
+    def __init__(self, documents):
+        self.documents = {document.key: document for document in documents}
+        self.changed = set(self.documents)
+        self.calls = []
+
+    async def run_db(self, func, company_id, since):
+        assert func is retrieval.load_changes
+        self.calls.append(since)
+        changed = [self.documents[key] for key in self.changed if key in self.documents]
+        self.changed = set()
+        return set(self.documents), changed, datetime(2024, 1, len(self.calls))
+
+
+def test_search_ranks_matching_documents_first():
+    """Test BM25 ranks the document sharing the rarer query terms first."""
+    index = BM25Index()
+    for document in (POOL, HOURS, REFUNDS):
+        index.add(document)
+
+    results = index.search("сколько стоит бассейн", 3)
+
+    assert [document.key for _, document in results] == [("faq", 1)]
+    assert index.search("часы работы")[0][1].key == ("faq", 2)
+    assert index.search("привет") == []
+
+
+def test_documents_are_replaced_and_removed_in_place():
+    """Test re-adding a key replaces its terms and removing it frees them."""
+    index = BM25Index()
+    index.add(POOL)
+    index.add(HOURS)
+    index.search("бассейн")
+
+    index.add(faq_document(1, "Есть ли сауна?", "Сауна работает до 22:00."))
+    assert index.search("бассейн") == []
+    assert index.search("сауна")[0][1].key == ("faq", 1)
+
+    index.remove(("faq", 1))
+    index.add(REFUNDS)
+    assert len(index) == 2
+    assert "сауна" not in index.postings
+    assert index.search("возврат денег")[0][1].key == ("policy", 3)
+
+
+@pytest.mark.asyncio
+async def test_retrieve_keeps_snippets_within_the_token_budget():
+    """Test snippets that would overflow the budget are skipped."""
+    db = FakeDB([POOL, HOURS, REFUNDS])
+    retriever = Retriever(db.run_db, top_k=3, token_budget=POOL.tokens)
+
+    snippets = await retriever.retrieve(1, 1, "абонемент в бассейн и возврат")
+
+    assert snippets == [POOL.snippet]
+    assert retriever.stats()["avg_snippets"] == 1
+
+
+@pytest.mark.asyncio
+async def test_newer_config_version_syncs_only_changed_rows():
+    """Test a version bump re-reads changed rows since the last sync and drops deleted ones."""
+    db = FakeDB([POOL, HOURS])
+    retriever = Retriever(db.run_db)
+    await retriever.retrieve(1, 1, "бассейн")
+    await retriever.retrieve(1, 1, "бассейн")
+    assert db.calls == [None]
+
+    del db.documents[("faq", 1)]
+    db.documents[REFUNDS.key] = REFUNDS
+    db.changed = {REFUNDS.key}
+    assert await retriever.retrieve(1, 2, "бассейн") == []
+    assert await retriever.retrieve(1, 2, "возврат") == [REFUNDS.snippet]
+    assert db.calls == [None, datetime(2024, 1, 1)]
+
+    retriever.apply(1, removed=REFUNDS.key)
+    assert await retriever.retrieve(1, 2, "возврат") == []
+    assert retriever.stats()["syncs"] == 2
+
+
+class TopicEmbedder:
+    """Semantic stand-in: one axis per topic, so words without shared letters can match."""
+
+    method = "topics"
+    semantic = True
+    dim = 3
+    TOPICS = {"бассе": 0, "плава": 0, "попла": 0, "часы": 1, "работ": 1, "возвр": 2, "верну": 2}
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in retrieval.terms(text):
+                for prefix, axis in self.TOPICS.items():
+                    if word.startswith(prefix):
+                        vectors[row, axis] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+
+@pytest.mark.asyncio
+async def test_dense_path_finds_rephrasings_without_shared_words(tmp_path, monkeypatch):
+    """Test a semantic embedder indexes rows on sync and adds matches BM25 cannot see."""
+    documents = [POOL, HOURS, REFUNDS]
+    monkeypatch.setattr(retrieval, "load_changes",
+                        lambda company_id, since: ({d.key for d in documents}, documents, datetime(2024, 1, 1)))
+
+    async def run_db(func, *args):
+        return func(*args)
+
+    bm25_only = Retriever(run_db)
+    retriever = Retriever(run_db, vectors=VectorStores(TopicEmbedder.dim, root=str(tmp_path)),
+                          embedder=TopicEmbedder())
+
+    assert await bm25_only.retrieve(1, 1, "Где можно поплавать?") == []
+    assert await retriever.retrieve(1, 1, "Где можно поплавать?") == [POOL.snippet]
+    assert (await retriever.retrieve(1, 1, "возврат абонемента"))[0] == REFUNDS.snippet
+    assert len(retriever.vectors.get(1)) == 3
+    assert retriever.stats()["dense"] is True
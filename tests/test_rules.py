@@ -0,0 +1,74 @@
+from datetime import datetime, timezone
+
+from profiles import CompanyProfile
+from rules import DEFAULT_REFUSALS, RuleStage, normalize
+
+ALWAYS_OPEN = {day: "00:00-24:00" for day in
+               ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")}
+# 2024-01-01 is a Monday
+MONDAY_NOON = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+MONDAY_NIGHT = datetime(2024, 1, 1, 23, tzinfo=timezone.utc)
+
+
+def make_profile(**overrides):
+    script_profile = {
+        "company_id": 1,
+        "company": "Бассейн",
+        "timezone": "UTC",
+        "working_hours": {"monday": "9:00-18:00"},
+        "messages": {"welcome": "Добро пожаловать!", "thanks": "Всегда рады помочь!",
+                     "off_hours": "Мы ответим утром."},
+        "restricted_topics": ["политика", "ставки на спорт"],
+    }
+    script_profile.update(overrides)
+    return CompanyProfile.from_script_profile(script_profile)
+
+
+def test_normalize_drops_punctuation_and_emoji():
+    """Test greetings and thanks are compared without case, punctuation or emoji."""
+    assert normalize("  Спасибо   большое!!! 🙏") == "спасибо большое"
+    assert normalize("«Сәлеметсіз бе?»") == "сәлеметсіз бе"
+
+
+def test_canned_replies_in_rule_order():
+    """Test /start, thanks, off hours, greetings and restricted topics skip the LLM."""
+    stage = RuleStage()
+    profile = make_profile()
+
+    assert stage.apply(profile, "/start", MONDAY_NIGHT).rule == "welcome"
+    assert stage.apply(profile, "/start@pool_bot", MONDAY_NOON).reply == "Добро пожаловать!"
+    assert stage.apply(profile, "Спасибо большое!", MONDAY_NIGHT).reply == "Всегда рады помочь!"
+    assert stage.apply(profile, "Сколько стоит абонемент?", MONDAY_NIGHT).reply == "Мы ответим утром."
+    assert stage.apply(profile, "Здравствуйте!", MONDAY_NOON).rule == "welcome"
+    assert stage.apply(profile, "Что думаете о политике?", MONDAY_NOON).reply == DEFAULT_REFUSALS["ru"]
+    assert stage.apply(profile, "Сколько стоит абонемент?", MONDAY_NOON) is None
+    assert stage.apply(profile, "Спасибо, а сколько стоит абонемент на месяц?", MONDAY_NOON) is None
+    assert stage.apply(profile, "", MONDAY_NIGHT) is None
+
+    stats = stage.stats()
+    assert stats["checked"] == 8
+    assert stats["llm_calls_avoided"] == 6
+    assert stats["served_welcome"] == 3 and stats["served_off_hours"] == 1 and stats["served_restricted"] == 1
+
+
+def test_rules_are_configurable_per_company():
+    """Test missing messages disable their rule and the company switch disables all."""
+    stage = RuleStage()
+    quiet = make_profile(messages={"off_topic": "Не по теме."}, working_hours=ALWAYS_OPEN)
+    disabled = make_profile(bot_settings={"canned_replies_enabled": False})
+
+    assert stage.apply(quiet, "/start", MONDAY_NIGHT) is None
+    assert stage.apply(quiet, "Спасибо", MONDAY_NIGHT) is None
+    assert stage.apply(quiet, "Вы принимаете ставками на спорте?", MONDAY_NIGHT).reply == "Не по теме."
+    assert stage.apply(disabled, "/start", MONDAY_NIGHT) is None
+    assert stage.stats()["checked"] == 3
+
+def test_unparsable_hours_do_not_close_the_company():
+    """Test a day with malformed hours falls through to the LLM instead of the off-hours reply."""
+    stage = RuleStage()
+    profile = make_profile(working_hours={"monday": "9-18", "tuesday": "9:00-18:00"})
+    tuesday_night = datetime(2024, 1, 2, 23, tzinfo=timezone.utc)
+
+    assert not profile.is_open(MONDAY_NIGHT)
+    assert stage.apply(profile, "Сколько стоит абонемент?", MONDAY_NIGHT) is None
+    assert stage.apply(profile, "Сколько стоит абонемент?", tuesday_night).rule == "off_hours"
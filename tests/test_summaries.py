@@ -0,0 +1,102 @@
+import pytest
+
+import summaries
+from summaries import Candidate, Summarizer
+
+
+class FakeStore:
+    """Stands in for the database functions run through ``run_db``."""
+
+    def __init__(self, candidates, turns=40):
+        self.candidates = candidates
+        self.turns = [(i, f"Сообщение {i}", bool(i % 2)) for i in range(1, turns + 1)]
+        self.saved = {}
+
+    async def run_db(self, func, *args, write=False):
+        if func is summaries.find_candidates:
+            return [c for c in self.candidates if c.client_id in args[0]]
+        if func is summaries.load_turns:
+            return self.turns[:args[1]]
+        if func is summaries.save_summary:
+            candidate, summary, tokens, last_id = args
+            self.saved[candidate.client_id] = (summary, last_id)
+            return True
+        raise AssertionError(func)
+
+
+def candidate(client_id, company_id=1, daily_tokens=10_000, unsummarized=50):
+    return Candidate(client_id, company_id, daily_tokens, "", None, unsummarized)
+
+
+async def generate(messages):
+    return "Клиент записан на массаж в пятницу.", "fake"
+
+
+@pytest.mark.asyncio
+async def test_folds_touched_clients_in_batches():
+    """Test old turns are folded into a summary and long backlogs stay queued."""
+    store = FakeStore([candidate(1, unsummarized=100), candidate(2)])
+    summarizer = Summarizer(store.run_db, generate, batch_messages=30)
+    summarizer.touch(1)
+
+    assert await summarizer.run_once() == 1
+    assert store.saved == {1: ("Клиент записан на массаж в пятницу.", 30)}
+    # 70 left after the batch, more than the raw history keeps
+    assert summarizer.touched == {1}
+    assert summarizer.stats()["messages_folded"] == 30
+
+@pytest.mark.asyncio
+async def test_backlog_is_folded_up_to_the_history_window():
+    """Test a client stays queued until every turn older than the raw history is in the summary."""
+    store = FakeStore([candidate(1, unsummarized=summaries.HISTORY_MESSAGES + 50)])
+    summarizer = Summarizer(store.run_db, generate, batch_messages=30)
+    summarizer.touch(1)
+
+    assert await summarizer.run_once() == 1
+    # 20 turns still sit between the new summary and the raw history
+    assert summarizer.touched == {1}
+
+@pytest.mark.asyncio
+async def test_skipped_while_the_llm_is_overloaded():
+    """Test no LLM call is made while live replies need the providers."""
+    store = FakeStore([candidate(1)])
+    calls = []
+
+    async def tracking_generate(messages):
+        calls.append(messages)
+        return await generate(messages)
+
+    summarizer = Summarizer(store.run_db, tracking_generate, overloaded=lambda: True)
+    summarizer.touch(1)
+
+    assert await summarizer.run_once() == 0
+    assert calls == []
+    # Kept for the next pass
+    assert summarizer.touched == {1}
+    assert summarizer.stats()["skipped_overloaded"] == 1
+
+@pytest.mark.asyncio
+async def test_company_budget_limits_summaries():
+    """Test a company stops being summarized once its daily tokens are spent."""
+    store = FakeStore([candidate(1, daily_tokens=50), candidate(2, daily_tokens=50)])
+    summarizer = Summarizer(store.run_db, generate)
+    summarizer.touch(1)
+    summarizer.touch(2)
+
+    assert await summarizer.run_once() == 1
+    assert summarizer.stats()["skipped_budget"] == 1
+
+def test_llm_busy_follows_backlog_and_latency():
+    """Test the overload check looks at queued updates and provider latency."""
+    from types import SimpleNamespace
+    from llm_routing import LatencyTracker
+
+    tracker = LatencyTracker()
+    idle = SimpleNamespace(pending=0, concurrency=16)
+    assert not summaries.llm_busy(idle, tracker)
+    assert summaries.llm_busy(SimpleNamespace(pending=16, concurrency=16), tracker)
+
+    tracker.record("OpenAI", 20.0)
+    assert summaries.llm_busy(idle, tracker, max_latency=8)
+    tracker.record("Nebius", 1.0)
+    assert not summaries.llm_busy(idle, tracker, max_latency=8)
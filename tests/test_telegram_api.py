@@ -0,0 +1,85 @@
+import json
+
+import httpx
+import pytest
+
+import http_pool
+import telegram_api
+
+
+@pytest.fixture
+def telegram_calls(monkeypatch):
+    """Record Bot API calls instead of sending them."""
+    calls = []
+
+    def handler(request):
+        method = request.url.path.rsplit("/", 1)[-1]
+        calls.append((method, json.loads(request.content)))
+        return httpx.Response(200, json={"ok": True, "result": {"message_id": 42}})
+
+    monkeypatch.setattr(http_pool, "pool", http_pool.HTTPPool(transport=httpx.MockTransport(handler)))
+    return calls
+
+def test_split_text_respects_limit():
+    """Test long replies are split into messages Telegram accepts."""
+    text = "\n".join(["строка" * 100] * 20)
+
+    parts = telegram_api.split_text(text)
+
+    assert all(len(part) <= telegram_api.TELEGRAM_MESSAGE_LIMIT for part in parts)
+    assert "".join(parts).replace("\n", "") == text.replace("\n", "")
+
+@pytest.mark.asyncio
+async def test_streaming_reply_sends_first_sentence_then_edits(telegram_calls):
+    """Test the first sentence is sent at once and the rest arrives as edits."""
+    reply = telegram_api.StreamingReply("token", 1, edit_interval=0)
+
+    await reply.feed("Здравствуйте")
+    assert telegram_calls == []
+    await reply.feed("! Чем")
+    await reply.feed(" могу помочь?")
+    await reply.finish("Здравствуйте! Чем могу помочь?\n\n[Использован: OpenAI]")
+
+    methods = [method for method, _ in telegram_calls]
+    assert methods[0] == "sendMessage"
+    assert set(methods[1:]) == {"editMessageText"}
+    assert telegram_calls[-1][1]["text"].endswith("[Использован: OpenAI]")
+    assert reply.time_to_first_text is not None
+
+@pytest.mark.asyncio
+async def test_streaming_reply_throttles_edits(telegram_calls):
+    """Test chunks arriving faster than the edit interval do not cause edits."""
+    reply = telegram_api.StreamingReply("token", 1, edit_interval=60)
+
+    await reply.feed("Первое предложение. ")
+    for word in ["много", "слов", "подряд"] * 10:
+        await reply.feed(word + " ")
+
+    assert [method for method, _ in telegram_calls] == ["sendMessage"]
+
+@pytest.mark.asyncio
+async def test_streaming_reply_without_chunks_sends_final_text(telegram_calls):
+    """Test an empty stream still delivers the final text once."""
+    reply = telegram_api.StreamingReply("token", 1)
+
+    await reply.finish("Ошибка")
+
+    assert telegram_calls == [("sendMessage", {"chat_id": 1, "text": "Ошибка"})]
+
+@pytest.mark.asyncio
+async def test_each_tenant_replies_through_its_own_bot(monkeypatch):
+    """Test messages of two companies go to the Bot API of each company's token."""
+    paths = []
+
+    def handler(request):
+        paths.append(request.url.path)
+        return httpx.Response(200, json={"ok": True, "result": {"message_id": 7}})
+
+    monkeypatch.setattr(http_pool, "pool", http_pool.HTTPPool(transport=httpx.MockTransport(handler)))
+
+    await telegram_api.send_message("111:first", 1, "Здравствуйте")
+    reply = telegram_api.StreamingReply("222:second", 2, edit_interval=0)
+    await reply.feed("Добрый день. ")
+    await reply.finish("Добрый день. Чем помочь?")
+
+    assert paths == ["/bot111:first/sendMessage", "/bot222:second/sendMessage", "/bot222:second/editMessageText"]
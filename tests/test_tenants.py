@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+import tenants
+from tenants import TenantTable
+
+
+def test_lookup_counts_hits_and_misses():
+    """Test known tokens resolve and unknown ones are answered from the table."""
+    table = TenantTable()
+    table.replace([(1, "FitClinic.kz", "token-1"), (2, "No bot", None)])
+
+    assert table.lookup("token-1").id == 1
+    assert table.lookup("unknown") is None
+    assert table.stats() == {"tenants": 1, "hits": 1, "misses": 1}
+
+def test_upsert_moves_company_to_new_token():
+    """Test changing a company's token drops the old one."""
+    table = TenantTable()
+    table.replace([(1, "FitClinic.kz", "old-token")])
+
+    table.upsert(1, "FitClinic.kz", "new-token")
+
+    assert table.lookup("old-token") is None
+    assert table.lookup("new-token").name == "FitClinic.kz"
+
+def test_remove_forgets_company():
+    """Test a deleted company no longer resolves."""
+    table = TenantTable()
+    table.replace([(1, "FitClinic.kz", "token-1")])
+
+    table.remove(1)
+
+    assert table.lookup("token-1") is None
+
+def test_record_stands_in_for_company_pk():
+    """Test records expose pk like a Company instance."""
+    table = TenantTable()
+    table.replace([(7, "FitClinic.kz", "token-7")])
+
+    assert table.lookup("token-7").pk == 7
+
+def test_record_carries_config_version():
+    """Test the config version read with the tenant is kept on the record."""
+    table = TenantTable()
+    table.replace([(7, "FitClinic.kz", "token-7", 3)])
+
+    assert table.lookup("token-7").config_version == 3
+    table.upsert(7, "FitClinic.kz", "token-7", 4)
+    assert table.lookup("token-7").config_version == 4
+
+@pytest.mark.asyncio
+async def test_changes_from_other_processes_reload_the_table():
+    """Test a config version bump made elsewhere is picked up at the next poll, unchanged polls reload nothing."""
+    table = TenantTable()
+    rows = [(7, "FitClinic.kz", "token-7", 3)]
+    fingerprints = iter([(1, 7, 3), (1, 7, 3), (1, 7, 4)])
+    calls = []
+
+    async def run_db(func):
+        calls.append(func)
+        if func is tenants.fetch_fingerprint:
+            fingerprint = next(fingerprints)
+            rows[0] = (7, "FitClinic.kz", "token-7", fingerprint[2])
+            return fingerprint
+        return list(rows)
+
+    task = asyncio.create_task(tenants.refresh_periodically(table, run_db, interval=60, poll_interval=0.01))
+    while len(calls) < 5:
+        await asyncio.sleep(0.005)
+    task.cancel()
+
+    assert calls[:5] == [tenants.fetch_fingerprint, tenants.fetch_rows, tenants.fetch_fingerprint,
+                     tenants.fetch_fingerprint, tenants.fetch_rows]
+    assert table.lookup("token-7").config_version == 4
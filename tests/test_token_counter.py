@@ -0,0 +1,42 @@
+from tokenizers import Tokenizer, models, pre_tokenizers
+
+from token_counter import TokenCounter, estimate, load_counter
+
+
+def word_tokenizer():
+    vocab = {"[UNK]": 0, "привет": 1, "мир": 2, "!": 3}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    return tokenizer
+
+
+def test_counts_with_a_tokenizer():
+    """Test counts come from the tokenizer, singly and in a batch."""
+    counter = TokenCounter(word_tokenizer())
+
+    assert counter.method == "tokenizer"
+    assert counter.count("привет мир!") == 3
+    assert counter.count_batch(["привет", "", "мир мир"]) == [1, 0, 2]
+
+def test_estimate_without_a_tokenizer():
+    """Test the fallback estimates tokens from word lengths per script."""
+    counter = TokenCounter()
+
+    assert counter.method == "estimate"
+    assert counter.count("How much is it?") == 5
+    assert counter.count("Сколько стоит прием?") == 5
+    assert counter.count("") == 0
+
+def test_estimate_counts_cyrillic_above_its_word_count():
+    """Test Russian and Kazakh are not under-counted as one token per word."""
+    # o200k_base gives 18 and 22 tokens for these
+    russian = "Подскажите, пожалуйста, есть ли у вас скидки для пенсионеров и студентов?"
+    kazakh = "Сәлеметсіз бе! Бассейнге айлық абонемент қанша тұрады?"
+
+    assert 14 <= estimate(russian) <= 23
+    assert 17 <= estimate(kazakh) <= 28
+    assert estimate("15000") == 3
+
+def test_missing_tokenizer_file_falls_back_to_the_estimate(tmp_path):
+    """Test a bad TOKENIZER_FILE does not stop the bot."""
+    assert load_counter(str(tmp_path / "missing.json")).method == "estimate"
@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import http_pool
+from translation import TranslationCache, Translator, google_translate, needs_translation
+
+ENGLISH = "Our pool is open every day from 7 am to 10 pm."
+
+
+def test_only_confident_english_replies_to_ru_and_kz_need_translation():
+    """Test the post-check skips replies already in the client's language."""
+    assert needs_translation(ENGLISH, "ru")
+    assert needs_translation(ENGLISH, "kz")
+    assert not needs_translation(ENGLISH, "en")
+    assert not needs_translation("Бассейн работает ежедневно с 7 до 22.", "ru")
+    assert not needs_translation("OK", "ru")
+
+
+@pytest.mark.asyncio
+async def test_repeated_replies_are_translated_once():
+    """Test a cached translation is served without calling the translator."""
+    calls = []
+
+    def translate(text, target):
+        calls.append(target)
+        return "Бассейн открыт ежедневно с 7 до 22."
+
+    translator = Translator(translate)
+    first = await translator.ensure_language(ENGLISH, "ru")
+    second = await translator.ensure_language(ENGLISH, "ru")
+    untouched = await translator.ensure_language("Добрый день!", "ru")
+
+    assert first == second == "Бассейн открыт ежедневно с 7 до 22."
+    assert untouched == "Добрый день!"
+    assert calls == ["ru"]
+    stats = translator.stats()
+    assert stats["translated"] == 2 and stats["cache_hits"] == 1 and stats["checked"] == 3
+    assert stats["needed_rate"] == round(2 / 3, 4)
+
+
+@pytest.mark.asyncio
+async def test_slow_translation_sends_the_original_and_fills_the_cache_later():
+    """Test a translation past the deadline is not waited for but still cached."""
+    def translate(text, target):
+        time.sleep(0.2)
+        return "Переведено"
+
+    translator = Translator(translate, deadline=0.01)
+    assert await translator.ensure_language(ENGLISH, "kz") == ENGLISH
+    assert translator.stats()["timeouts"] == 1
+
+    await asyncio.sleep(0.3)
+    assert await translator.ensure_language(ENGLISH, "kz") == "Переведено"
+    assert translator.cache.get(ENGLISH, "ru") is None
+
+
+@pytest.mark.asyncio
+async def test_failed_translation_sends_the_original():
+    """Test translator errors are counted and do not lose the reply."""
+    def translate(text, target):
+        raise ConnectionError("no route to host")
+
+    translator = Translator(translate)
+
+    assert await translator.ensure_language(ENGLISH, "ru") == ENGLISH
+    assert translator.stats()["errors"] == 1
+
+
+def test_cache_is_bounded():
+    """Test the least recently used translation is evicted first."""
+    cache = TranslationCache(size=2)
+    cache.put("a", "ru", "А")
+    cache.put("b", "ru", "Б")
+    cache.get("a", "ru")
+    cache.put("c", "ru", "В")
+
+    assert cache.get("b", "ru") is None
+    assert cache.get("a", "ru") == "А"
+    assert len(cache) == 2
+
+
+@pytest.mark.asyncio
+async def test_google_translate_goes_through_the_shared_pool(monkeypatch):
+    """Test the translation request and response format of the pooled translator."""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json=[[["Бассейн открыт. ", "The pool is open. ", None],
+                                          ["Ждём вас!", "We are waiting for you!", None]], None, "en"])
+
+    monkeypatch.setattr(http_pool, "pool", http_pool.HTTPPool(transport=httpx.MockTransport(handler)))
+    translator = Translator(google_translate)
+
+    assert await translator.ensure_language(ENGLISH, "kz") == "Бассейн открыт. Ждём вас!"
+    assert requests[0].url.params["tl"] == "kk"
+    assert b"q=Our+pool" in requests[0].content
+    assert http_pool.pool.stats()["hosts"]["translate.googleapis.com"]["requests"] == 1
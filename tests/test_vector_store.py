@@ -0,0 +1,139 @@
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+
+import retrieval
+import vector_store
+from embeddings import HashingEmbedder
+from retrieval import faq_document
+from vector_store import VectorStore, document_key, split_key
+
+
+def unit_rows(count, dim=32, seed=0):
+    rows = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def clustered_rows(count, dim=32, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = unit_rows(clusters, dim, seed)
+    rows = centers[rng.integers(clusters, size=count)] + rng.normal(scale=0.15, size=(count, dim))
+    return (rows / np.linalg.norm(rows, axis=1, keepdims=True)).astype(np.float32)
+
+
+def test_search_returns_nearest_keys_for_float_and_int8(tmp_path):
+    """Test both storage types find the stored vector closest to the query."""
+    vectors = unit_rows(100)
+    for quantize in (False, True):
+        store = VectorStore(str(tmp_path / str(quantize)), 32, quantize=quantize)
+        store.upsert(list(range(100)), vectors)
+
+        results = store.search(vectors[42], k=3)
+
+        assert results[0][0] == 42
+        assert abs(results[0][1] - 1.0) < 0.01
+        assert len(results) == 3
+
+
+def test_updates_and_deletes_are_seen_by_other_readers(tmp_path):
+    """Test appended segments supersede older rows in every store mapping the directory."""
+    vectors = unit_rows(3)
+    writer = VectorStore(str(tmp_path), 32)
+    reader = VectorStore(str(tmp_path), 32)
+    writer.upsert([1, 2], vectors[:2])
+    assert reader.search(vectors[1], k=1)[0][0] == 2
+
+    writer.upsert([2], vectors[2:])
+    writer.delete([1])
+
+    assert [key for key, _ in reader.search(vectors[2], k=5)] == [2]
+    assert len(reader) == 1
+    # Two of three stored rows were superseded, past VECTOR_STORE_MAX_DEAD
+    assert reader.stats()["segments"] == 1
+    assert reader.stats()["stored_rows"] == 1
+
+
+def test_compaction_builds_an_ivf_index_and_drops_old_segments(tmp_path):
+    """Test compacting many segments keeps only live rows, clustered for IVF search."""
+    vectors = clustered_rows(2000)
+    store = VectorStore(str(tmp_path), 32, ivf_min_rows=1000, nprobe=8, max_segments=4)
+    stale = VectorStore(str(tmp_path), 32)
+    for start in range(0, 2000, 500):
+        store.upsert(list(range(start, start + 500)), vectors[start:start + 500])
+    stale.refresh()
+    store.delete(list(range(100)))
+
+    assert store.stats()["segments"] == 1
+    assert store.stats()["ivf_lists"] > 1
+    assert len(store) == 1900
+    assert sorted(name for name in os.listdir(tmp_path) if name.startswith("seg-")) == ["seg-000006"]
+    hits = sum(store.search(vectors[i], k=1)[0][0] == i for i in range(100, 300))
+    assert hits >= 190
+    assert store.search(vectors[5], k=1)[0][0] != 5
+    # Still mapping the removed segments until it looks at the manifest again
+    assert stale.segments[0].vectors.shape == (500, 32)
+
+
+def test_index_company_embeds_changes_and_deletes_removed_rows(tmp_path, monkeypatch):
+    """Test a company sync embeds changed rows and drops vectors of deleted ones."""
+    rows = {
+        ("faq", 1): faq_document(1, "Сколько стоит бассейн?", "25 000 тенге."),
+        ("faq", 2): faq_document(2, "Какие часы работы?", "С 9 до 21."),
+    }
+    calls = []
+
+    def load_changes(company_id, since):
+        calls.append(since)
+        return set(rows), list(rows.values()), datetime(2024, 1, len(calls))
+
+    monkeypatch.setattr(retrieval, "load_changes", load_changes)
+    embedder = HashingEmbedder(dim=64)
+    store = VectorStore(str(tmp_path), 64)
+
+    assert vector_store.index_company(store, embedder, 1) == 2
+    del rows[("faq", 1)]
+    vector_store.index_company(store, embedder, 1)
+
+    assert calls == [None, datetime(2024, 1, 1)]
+    assert [split_key(int(key)) for key in store.live_keys()] == [("faq", 2)]
+    query = embedder.embed(["часы работы"])[0]
+    assert store.search(query, k=1)[0][0] == document_key("faq", 2)
+
+
+def test_concurrent_index_company_runs_one_sync_at_a_time(tmp_path, monkeypatch):
+    """Test a second sync waits for the first and starts from its synced_at, never an older one."""
+    rows = {("faq", 1): faq_document(1, "Сколько стоит бассейн?", "25 000 тенге.")}
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def load_changes(company_id, since):
+        calls.append(since)
+        if len(calls) == 1:
+            started.set()
+            release.wait(5)
+            return set(rows), list(rows.values()), datetime(2024, 1, 2)
+        # This process's clock is behind the first one's
+        return set(rows), [], datetime(2024, 1, 1)
+
+    monkeypatch.setattr(retrieval, "load_changes", load_changes)
+    embedder = HashingEmbedder(dim=64)
+    first = threading.Thread(target=vector_store.index_company,
+                             args=(VectorStore(str(tmp_path), 64), embedder, 1))
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=vector_store.index_company,
+                              args=(VectorStore(str(tmp_path), 64), embedder, 1))
+    second.start()
+    second.join(0.2)
+    assert len(calls) == 1
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    assert calls == [None, datetime(2024, 1, 2)]
+    store = VectorStore(str(tmp_path), 64)
+    store.refresh()
+    assert store.meta["synced_at"] == datetime(2024, 1, 2).isoformat()
+    assert len(store) == 1
@@ -0,0 +1,236 @@
+import asyncio
+import time
+
+import pytest
+
+import work_queue
+from work_queue import QueueWorkers, WorkQueue
+
+
+def make_update(update_id, text="Привет"):
+    return {"update_id": update_id, "message": {"chat": {"id": 1}, "text": text}}
+
+
+@pytest.mark.asyncio
+async def test_duplicate_delivery_is_queued_once(tmp_path):
+    """Test a redelivered update (same update_id) does not create a second entry."""
+    queue = WorkQueue(str(tmp_path / "queue.sqlite3"))
+    await queue.open()
+
+    assert await queue.enqueue("token", make_update(1)) is not None
+    assert await queue.enqueue("token", make_update(1)) is None
+    assert await queue.enqueue("other-token", make_update(1)) is not None
+
+    stats = await queue.stats()
+    assert stats["depth"] == 2
+    assert stats["duplicates"] == 1
+    assert queue.duplicates_by_token == {"token": 1}
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_redelivery_after_processing_and_restart_is_dropped(tmp_path):
+    """Test an update handled before a restart is not handled again when Telegram resends it."""
+    path = str(tmp_path / "queue.sqlite3")
+    queue = WorkQueue(path)
+    await queue.open()
+    await queue.enqueue("token", make_update(1))
+    update = await queue.claim()
+    await queue.ack(update.id)
+    await queue.close()
+
+    restarted = WorkQueue(path)
+    await restarted.open()
+
+    assert await restarted.enqueue("token", make_update(1)) is None
+    assert await restarted.claim() is None
+    await restarted.close()
+
+@pytest.mark.asyncio
+async def test_seen_updates_expire_after_window(tmp_path, monkeypatch):
+    """Test the dedup set only keeps updates seen within the window."""
+    monkeypatch.setattr(work_queue, "DEDUP_PRUNE_INTERVAL", 0)
+    queue = WorkQueue(str(tmp_path / "queue.sqlite3"), dedup_window=0.0)
+    await queue.open()
+    await queue.enqueue("token", make_update(1))
+    await queue.ack((await queue.claim()).id)
+    await queue.enqueue("token", make_update(2))  # prunes update 1
+
+    assert await queue.enqueue("token", make_update(1)) is not None
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_restart_keeps_unfinished_updates(tmp_path):
+    """Test updates queued or in progress when the process stops are processed after a restart."""
+    path = str(tmp_path / "queue.sqlite3")
+    # The lease of the update it was processing runs out right away
+    queue = WorkQueue(path, lease=0)
+    await queue.open()
+    for update_id in (1, 2, 3):
+        await queue.enqueue("token", make_update(update_id))
+    done = await queue.claim()
+    await queue.ack(done.id)
+    await queue.claim()  # in progress when the process "crashes"
+    await queue.close()
+
+    restarted = WorkQueue(path)
+    assert await restarted.open() == 1
+    remaining = [await restarted.claim(), await restarted.claim(), await restarted.claim()]
+
+    assert [u.payload["update_id"] for u in remaining if u] == [2, 3]
+    await restarted.close()
+
+@pytest.mark.asyncio
+async def test_processes_sharing_a_queue_keep_their_leased_updates(tmp_path):
+    """Test a second process opening the queue leaves live leases alone and takes over expired ones."""
+    path = str(tmp_path / "queue.sqlite3")
+    first = WorkQueue(path)
+    await first.open()
+    await first.enqueue("token", make_update(1))
+    in_progress = await first.claim()
+
+    second = WorkQueue(path, lease=0)
+    assert await second.open() == 0
+    assert await second.claim() is None
+
+    other_chat = make_update(2)
+    other_chat["message"]["chat"]["id"] = 2
+    await second.enqueue("token", other_chat)
+    await second.claim()  # second "crashes" holding update 2
+    assert await first.requeue_expired() == 1
+    assert (await first.claim()).payload["update_id"] == 2
+    assert (await first.stats())["processing"] == 2
+    await first.ack(in_progress.id)
+    await first.close()
+    await second.close()
+
+@pytest.mark.asyncio
+async def test_chat_held_by_another_process_waits(tmp_path):
+    """Test a process does not take a chat's next update while another process holds an earlier one."""
+    path = str(tmp_path / "queue.sqlite3")
+    first, second = WorkQueue(path), WorkQueue(path)
+    await first.open()
+    await second.open()
+    for update_id, chat in ((1, 1), (2, 1), (3, 2)):
+        update = make_update(update_id)
+        update["message"]["chat"]["id"] = chat
+        await first.enqueue("token", update)
+
+    assert [u.payload["update_id"] for u in await first.claim_many(1)] == [1]
+    assert [u.payload["update_id"] for u in await second.claim_many(10)] == [3]
+    # The holder of update 1 queues the chat's next one behind it
+    assert [u.payload["update_id"] for u in await first.claim_many(10)] == [2]
+    await first.close()
+    await second.close()
+
+@pytest.mark.asyncio
+async def test_stopped_workers_put_back_unfinished_updates(tmp_path):
+    """Test updates cancelled at shutdown are pending again, not left leased."""
+    queue = WorkQueue(str(tmp_path / "queue.sqlite3"))
+    await queue.open()
+
+    async def handler(update):
+        await asyncio.sleep(10)
+
+    workers = QueueWorkers(queue, handler, poll_interval=0.05)
+    workers.start()
+    await queue.enqueue("token", make_update(1))
+    for _ in range(100):
+        if (await queue.stats())["processing"]:
+            break
+        await asyncio.sleep(0.01)
+    await workers.stop(timeout=0.05)
+
+    stats = await queue.stats()
+    assert stats["pending"] == 1 and stats["processing"] == 0
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_workers_process_and_retry(tmp_path):
+    """Test workers drain the queue, retry failures and park updates that keep failing."""
+    queue = WorkQueue(str(tmp_path / "queue.sqlite3"), retry_delay=0)
+    await queue.open()
+    handled = []
+
+    async def handler(update):
+        if update.payload["message"]["text"] == "boom":
+            raise RuntimeError("boom")
+        handled.append(update.payload["update_id"])
+
+    workers = QueueWorkers(queue, handler, concurrency=4, poll_interval=0.05)
+    workers.start()
+    for update_id in range(20):
+        await queue.enqueue("token", make_update(update_id))
+    await queue.enqueue("token", make_update(99, text="boom"))
+    for _ in range(100):
+        stats = await queue.stats()
+        if stats["depth"] == 0:
+            break
+        await asyncio.sleep(0.02)
+    await workers.stop()
+
+    assert sorted(handled) == list(range(20))
+    assert stats["dead"] == 1
+    assert stats["failed"] == 3
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_failed_update_is_retried_later_before_the_chat_moves_on(tmp_path):
+    """Test a failed update waits for its backoff and the chat's later updates wait for it."""
+    queue = WorkQueue(str(tmp_path / "queue.sqlite3"), retry_delay=0.2)
+    await queue.open()
+    failed_at = []
+    handled = []
+
+    async def handler(update):
+        text = update.payload["message"]["text"]
+        if text == "A" and not failed_at:
+            failed_at.append(time.monotonic())
+            raise RuntimeError("LLM down")
+        handled.append((text, time.monotonic()))
+
+    for update_id, text in enumerate("ABC", start=1):
+        await queue.enqueue("token", make_update(update_id, text))
+    workers = QueueWorkers(queue, handler, poll_interval=0.05)
+    workers.start()
+    for _ in range(100):
+        if (await queue.stats())["depth"] == 0:
+            break
+        await asyncio.sleep(0.02)
+    await workers.stop()
+
+    assert [text for text, _ in handled] == ["A", "B", "C"]
+    assert handled[0][1] - failed_at[0] >= 0.2
+    assert queue.failed == 1 and (await queue.stats())["dead"] == 0
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_workers_keep_chat_order(tmp_path):
+    """Test quick messages from one chat are processed one after another, in order."""
+    queue = WorkQueue(str(tmp_path / "queue.sqlite3"))
+    await queue.open()
+    handled = {1: [], 2: []}
+    active = set()
+
+    async def handler(update):
+        chat = update.payload["message"]["chat"]["id"]
+        assert chat not in active
+        active.add(chat)
+        await asyncio.sleep(0.005)
+        handled[chat].append(update.payload["update_id"])
+        active.discard(chat)
+
+    for update_id in range(20):
+        update = make_update(update_id)
+        update["message"]["chat"]["id"] = 1 + update_id % 2
+        await queue.enqueue("token", update)
+    workers = QueueWorkers(queue, handler, concurrency=8, poll_interval=0.05)
+    workers.start()
+    for _ in range(100):
+        if (await queue.stats())["depth"] == 0:
+            break
+        await asyncio.sleep(0.02)
+    await workers.stop()
+
+    assert handled == {1: list(range(0, 20, 2)), 2: list(range(1, 20, 2))}
+    assert queue.failed == 0
+    await queue.close()
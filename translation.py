@@ -0,0 +1,175 @@
+"""Fallback translation of replies the model wrote in the wrong language.
+
+The prompt pins the reply language (see ``prompts``), so this path should
+be rare: ``needs_translation`` is a local check with ``language.detect``
+and costs microseconds. Only a reply that confidently came back in English
+for a Russian or Kazakh message is translated.
+
+Translations are kept in a bounded LRU cache keyed by a hash of the text,
+so a repeated reply is translated once. The translation itself has a
+deadline of TRANSLATION_DEADLINE seconds; past it the original reply is
+sent, and the translation, when it arrives, still fills the cache for the
+next time.
+
+``google_translate`` calls Google's translate endpoint (the one
+googletrans scraped) through the shared ``http_pool``, so translations
+reuse keep-alive connections; blocking translators run on a thread.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import http_pool
+from language import detect
+
+logger = logging.getLogger("uvicorn")
+
+TRANSLATION_DEADLINE = float(os.getenv("TRANSLATION_DEADLINE", "1.5"))
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "2000"))
+TRANSLATE_URL = os.getenv("TRANSLATE_URL", "https://translate.googleapis.com/translate_a/single")
+# A late translation still fills the cache, so this can exceed the deadline
+TRANSLATE_TIMEOUT = float(os.getenv("TRANSLATE_TIMEOUT", "5"))
+
+http_pool.pool.configure(urlsplit(TRANSLATE_URL).hostname, http_pool.Destination(
+    timeout=TRANSLATE_TIMEOUT,
+    retries=1,
+    # Translating is idempotent, a POST can be repeated
+    retry_methods=http_pool.IDEMPOTENT_METHODS | {"POST"},
+))
+
+# Message language -> translation target code
+TARGETS = {"ru": "ru", "kz": "kk"}
+
+
+def needs_translation(reply: str, message_language: Optional[str]) -> bool:
+    """Whether ``reply`` is confidently English while the client wrote in ru or kz."""
+    if message_language not in TARGETS or not reply:
+        return False
+    detection = detect(reply)
+    return detection.confident and detection.language == "en"
+
+
+async def google_translate(text: str, target: str) -> str:
+    """Translate ``text`` to ``target`` with Google's public translate endpoint."""
+    response = await http_pool.pool.post(
+        TRANSLATE_URL,
+        params={"client": "gtx", "sl": "auto", "tl": target, "dt": "t"},
+        data={"q": text},
+    )
+    response.raise_for_status()
+    # [[["translated sentence", "source sentence", ...], ...], ...]
+    return "".join(sentence[0] for sentence in response.json()[0] if sentence[0])
+
+
+class TranslationCache:
+    """Translations by (target, hash of the source text), least recently used out first."""
+
+    def __init__(self, size: int = TRANSLATION_CACHE_SIZE):
+        self.size = size
+        self.entries: "OrderedDict[Tuple[str, bytes], str]" = OrderedDict()
+
+    @staticmethod
+    def key(text: str, target: str) -> Tuple[str, bytes]:
+        return target, hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+    def get(self, text: str, target: str) -> Optional[str]:
+        key = self.key(text, target)
+        translated = self.entries.get(key)
+        if translated is not None:
+            self.entries.move_to_end(key)
+        return translated
+
+    def put(self, text: str, target: str, translated: str) -> None:
+        key = self.key(text, target)
+        self.entries[key] = translated
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class Translator:
+    """Translates wrong-language replies from the cache or within a deadline.
+
+    Args:
+        translate: ``translate(text, target) -> str``, a coroutine function or
+            a blocking one (run on a thread)
+        deadline: Seconds to wait for a translation before sending the original
+    """
+
+    def __init__(self, translate: Callable[[str, str], Union[str, Awaitable[str]]] = google_translate,
+                 deadline: float = TRANSLATION_DEADLINE, cache: Optional[TranslationCache] = None):
+        self.translate = translate
+        self.deadline = deadline
+        self.cache = cache if cache is not None else TranslationCache()
+        self.checked = 0
+        self.needed = 0
+        self.cache_hits = 0
+        self.timeouts = 0
+        self.errors = 0
+        # Time replies spent on the translation path, cache hits included
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def _fill_cache(self, text: str, target: str, task: "asyncio.Future") -> None:
+        if not task.cancelled() and task.exception() is None:
+            self.cache.put(text, target, task.result())
+
+    async def ensure_language(self, reply: str, message_language: Optional[str]) -> str:
+        """Return ``reply``, translated when it is not in the client's language."""
+        self.checked += 1
+        if not needs_translation(reply, message_language):
+            return reply
+        self.needed += 1
+        started = time.perf_counter()
+        target = TARGETS[message_language]
+        try:
+            translated = self.cache.get(reply, target)
+            if translated is not None:
+                self.cache_hits += 1
+                return translated
+            if asyncio.iscoroutinefunction(self.translate):
+                task = asyncio.ensure_future(self.translate(reply, target))
+            else:
+                task = asyncio.ensure_future(asyncio.to_thread(self.translate, reply, target))
+            done, _ = await asyncio.wait({task}, timeout=self.deadline)
+            if not done:
+                self.timeouts += 1
+                task.add_done_callback(lambda finished: self._fill_cache(reply, target, finished))
+                logger.warning(f"Translation to {target} missed its {self.deadline}s deadline, sending the original")
+                return reply
+            try:
+                translated = task.result()
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Translation to {target} failed: {e}")
+                return reply
+            self.cache.put(reply, target, translated)
+            return translated
+        finally:
+            elapsed = time.perf_counter() - started
+            self.seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "checked": self.checked,
+            "translated": self.needed,
+            # Share of checked replies that needed translating
+            "needed_rate": round(self.needed / self.checked, 4) if self.checked else 0.0,
+            "cache_hits": self.cache_hits,
+            "cache_entries": len(self.cache),
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "avg_latency_ms": round(self.seconds / self.needed * 1000, 1) if self.needed else 0.0,
+            "max_latency_ms": round(self.max_seconds * 1000, 1),
+            # Translation time spread over every checked reply
+            "latency_per_reply_ms": round(self.seconds / self.checked * 1000, 2) if self.checked else 0.0,
+        }
@@ -0,0 +1,455 @@
+"""Memory-mapped vector store of company knowledge for dense retrieval.
+
+Each company has a directory of immutable segments plus ``manifest.json``
+listing the live ones in order. A segment holds the rows it added
+(``keys.npy``, ``vectors.npy``, and ``scales.npy`` when int8-quantized)
+and the keys it deleted (``deleted.npy``). The newest occurrence of a key
+wins, so updates and deletes only ever append a segment. Segments are
+opened with ``np.load(mmap_mode="r")``: every uvicorn worker maps the same
+files and shares their pages through the OS page cache instead of holding
+its own copy.
+
+Writers take an exclusive ``flock`` on the directory, write the segment
+and then replace the manifest atomically; readers notice the new manifest
+by its mtime on the next search. Once there are more than
+VECTOR_STORE_MAX_SEGMENTS segments, or more than VECTOR_STORE_MAX_DEAD of
+the rows are superseded, the live rows are compacted into one segment.
+Compacted segments with at least VECTOR_STORE_IVF_MIN_ROWS rows get an
+IVF index: rows are clustered with spherical k-means and stored grouped by
+cluster, so a search scans only the VECTOR_STORE_NPROBE clusters whose
+centroids are closest to the query. Smaller segments are scanned in full.
+
+Vectors are expected L2-normalized (see ``embeddings``), scores are
+cosine similarities.
+"""
+import fcntl
+import json
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("uvicorn")
+
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", "vector_store")
+VECTOR_STORE_QUANTIZE = os.getenv("VECTOR_STORE_QUANTIZE", "false").lower() in ("1", "true", "yes")
+VECTOR_STORE_NPROBE = int(os.getenv("VECTOR_STORE_NPROBE", "64"))
+VECTOR_STORE_IVF_MIN_ROWS = int(os.getenv("VECTOR_STORE_IVF_MIN_ROWS", "50000"))
+VECTOR_STORE_MAX_SEGMENTS = int(os.getenv("VECTOR_STORE_MAX_SEGMENTS", "8"))
+VECTOR_STORE_MAX_DEAD = float(os.getenv("VECTOR_STORE_MAX_DEAD", "0.3"))
+
+# Rows scored per matrix product, bounds the temporary arrays of full scans
+SCAN_ROWS = 65536
+# int8 rows are widened to float32 this many at a time, small enough to stay in cache
+QUANTIZED_BLOCK_ROWS = 1024
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+
+# Knowledge rows are keyed by one int64: kind in the high bits, row id below
+KINDS = {"faq": 1, "policy": 2, "chunk": 3}
+_KIND_NAMES = {code: kind for kind, code in KINDS.items()}
+_KIND_SHIFT = 48
+
+
+def document_key(kind: str, pk: int) -> int:
+    return KINDS[kind] << _KIND_SHIFT | pk
+
+
+def split_key(key: int) -> Tuple[str, int]:
+    return _KIND_NAMES[key >> _KIND_SHIFT], key & ((1 << _KIND_SHIFT) - 1)
+
+
+def quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization, returns (int8 rows, float32 scales)."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    rows = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return rows, scales.astype(np.float32)
+
+
+def train_centroids(vectors: np.ndarray, lists: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a sample of ``vectors`` (cosine assignment, normalized means)."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), lists * KMEANS_SAMPLE_PER_LIST)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(sample_size, lists, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assigned = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assigned, sample)
+        norms = np.linalg.norm(sums, axis=1)
+        # Empty clusters keep their previous centroid
+        filled = norms > 0
+        centroids[filled] = sums[filled] / norms[filled, None]
+    return centroids
+
+
+class _Segment:
+    """One immutable segment directory, memory-mapped."""
+
+    def __init__(self, path: str):
+        self.name = os.path.basename(path)
+        self.keys = np.load(os.path.join(path, "keys.npy"), mmap_mode="r")
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.deleted = np.load(os.path.join(path, "deleted.npy"))
+        self.scales = self._optional(path, "scales.npy")
+        self.centroids = self._optional(path, "centroids.npy")
+        # Row range of cluster i is offsets[i]:offsets[i + 1]
+        self.offsets = self._optional(path, "offsets.npy")
+        # Rows not superseded by a later segment, set by the store
+        self.live = np.ones(len(self.keys), dtype=bool)
+
+    @staticmethod
+    def _optional(path: str, filename: str) -> Optional[np.ndarray]:
+        filename = os.path.join(path, filename)
+        return np.load(filename, mmap_mode="r") if os.path.exists(filename) else None
+
+    def _score(self, start: int, stop: int, query: np.ndarray) -> np.ndarray:
+        if self.scales is None:
+            return self.vectors[start:stop] @ query
+        scores = np.empty(stop - start, dtype=np.float32)
+        for block in range(start, stop, QUANTIZED_BLOCK_ROWS):
+            end = min(block + QUANTIZED_BLOCK_ROWS, stop)
+            scores[block - start:end - start] = self.vectors[block:end].astype(np.float32) @ query
+        return scores * self.scales[start:stop]
+
+    def ranges(self, query: np.ndarray, nprobe: int) -> Iterable[Tuple[int, int]]:
+        if self.centroids is None:
+            return ((start, min(start + SCAN_ROWS, len(self.keys))) for start in range(0, len(self.keys), SCAN_ROWS))
+        nprobe = min(nprobe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return ((int(self.offsets[i]), int(self.offsets[i + 1])) for i in np.sort(lists))
+
+    def search(self, query: np.ndarray, k: int, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Best ``k`` live rows as (row numbers, scores), unordered."""
+        rows, scores = [], []
+        for start, stop in self.ranges(query, nprobe):
+            if start == stop:
+                continue
+            block_scores = self._score(start, stop, query)
+            block_scores[~self.live[start:stop]] = -np.inf
+            if len(block_scores) > k:
+                top = np.argpartition(-block_scores, k - 1)[:k]
+            else:
+                top = np.arange(len(block_scores))
+            rows.append(top + start)
+            scores.append(block_scores[top])
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return np.concatenate(rows), np.concatenate(scores)
+
+
+class VectorStore:
+    """Append-only, memory-mapped vectors of one company.
+
+    Args:
+        path: Directory of the store, created on first write
+        dim: Vector dimension
+        quantize: Store new segments as int8 with a float32 scale per row
+        nprobe: IVF clusters scanned per search
+        ivf_min_rows: Compactions producing at least this many rows build an IVF index
+    """
+
+    def __init__(self, path: str, dim: int, quantize: bool = VECTOR_STORE_QUANTIZE,
+                 nprobe: int = VECTOR_STORE_NPROBE, ivf_min_rows: int = VECTOR_STORE_IVF_MIN_ROWS,
+                 max_segments: int = VECTOR_STORE_MAX_SEGMENTS, max_dead: float = VECTOR_STORE_MAX_DEAD):
+        self.path = path
+        self.dim = dim
+        self.quantize = quantize
+        self.nprobe = nprobe
+        self.ivf_min_rows = ivf_min_rows
+        self.max_segments = max_segments
+        self.max_dead = max_dead
+        self.segments: List[_Segment] = []
+        # Caller data stored with the manifest (e.g. the last sync time)
+        self.meta: Dict[str, object] = {}
+        self.live_rows = 0
+        self._manifest_mtime = None
+        # Manifest of the write lock while this store holds it
+        self._held: Optional[dict] = None
+        self.searches = 0
+        self.compactions = 0
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.path, "manifest.json")
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self._manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"segments": [], "next": 1, "meta": {}}
+
+    def _write_manifest(self, manifest: dict) -> None:
+        temporary = self._manifest_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self._manifest_path)
+
+    def refresh(self) -> None:
+        """Map the segments of the current manifest if it changed since the last look."""
+        try:
+            stat = os.stat(self._manifest_path)
+            # The manifest is replaced, never rewritten in place: a new inode is a new version
+            mtime = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._manifest_mtime:
+            return
+        manifest = self._read_manifest()
+        try:
+            known = {segment.name: segment for segment in self.segments}
+            segments = [known.get(name) or _Segment(os.path.join(self.path, name)) for name in manifest["segments"]]
+        except FileNotFoundError:
+            # A compaction removed segments after we read the manifest, read it again
+            self._manifest_mtime = None
+            return self.refresh()
+        self._mark_live(segments)
+        self.segments = segments
+        self.meta = manifest.get("meta", {})
+        self._manifest_mtime = mtime
+
+    def _mark_live(self, segments: List[_Segment]) -> None:
+        # Keys in write order (each segment's deletions, then its rows); the last occurrence wins
+        events = []
+        for segment in segments:
+            events.append(segment.deleted)
+            events.append(segment.keys)
+        if not events:
+            self.live_rows = 0
+            return
+        keys = np.concatenate(events)
+        _, reversed_first = np.unique(keys[::-1], return_index=True)
+        latest = np.zeros(len(keys), dtype=bool)
+        latest[len(keys) - 1 - reversed_first] = True
+        position = 0
+        self.live_rows = 0
+        for segment in segments:
+            position += len(segment.deleted)
+            segment.live = latest[position:position + len(segment.keys)]
+            position += len(segment.keys)
+            self.live_rows += int(segment.live.sum())
+
+    def __len__(self) -> int:
+        self.refresh()
+        return self.live_rows
+
+    @contextmanager
+    def _locked(self):
+        # Reentrant: writes inside ``writing()`` share its lock and manifest
+        if self._held is not None:
+            yield self._held
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._held = self._read_manifest()
+                yield self._held
+            finally:
+                self._held = None
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @contextmanager
+    def writing(self):
+        """Hold the write lock across several reads and writes.
+
+        The store is refreshed once the lock is taken, so reads inside see
+        every earlier writer, and upserts, deletes and meta updates inside
+        land before any other writer can look.
+        """
+        with self._locked():
+            self._manifest_mtime = None
+            self.refresh()
+            yield self
+
+    def _write_segment(self, manifest: dict, keys: np.ndarray, vectors: np.ndarray, deleted: Sequence[int],
+                       order: Optional[np.ndarray] = None, centroids: Optional[np.ndarray] = None,
+                       offsets: Optional[np.ndarray] = None) -> str:
+        """Write a segment directory, rows taken in ``order`` when given; returns its name."""
+        name = f"seg-{manifest['next']:06d}"
+        manifest["next"] += 1
+        path = os.path.join(self.path, name)
+        temporary = path + ".tmp"
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+        keys = np.asarray(keys, dtype=np.int64)
+        np.save(os.path.join(temporary, "keys.npy"), keys if order is None else keys[order])
+        np.save(os.path.join(temporary, "deleted.npy"), np.asarray(deleted, dtype=np.int64))
+        # Streamed in blocks so compacting a large store needs no second full copy
+        rows = np.lib.format.open_memmap(os.path.join(temporary, "vectors.npy"), mode="w+",
+                                         dtype=np.int8 if self.quantize else np.float32, shape=(len(keys), self.dim))
+        scales = np.empty(len(keys), dtype=np.float32)
+        for start in range(0, len(keys), SCAN_ROWS):
+            stop = min(start + SCAN_ROWS, len(keys))
+            block = np.asarray(vectors[start:stop] if order is None else vectors[order[start:stop]], dtype=np.float32)
+            if self.quantize:
+                rows[start:stop], scales[start:stop] = quantize(block)
+            else:
+                rows[start:stop] = block
+        rows.flush()
+        del rows
+        if self.quantize:
+            np.save(os.path.join(temporary, "scales.npy"), scales)
+        if centroids is not None:
+            np.save(os.path.join(temporary, "centroids.npy"), centroids)
+            np.save(os.path.join(temporary, "offsets.npy"), offsets)
+        os.rename(temporary, path)
+        return name
+
+    def _append(self, keys: Sequence[int], vectors: np.ndarray, deleted: Sequence[int],
+                meta: Optional[dict]) -> None:
+        with self._locked() as manifest:
+            name = self._write_segment(manifest, keys, vectors, deleted)
+            manifest["segments"].append(name)
+            if meta:
+                manifest["meta"] = {**manifest.get("meta", {}), **meta}
+            self._write_manifest(manifest)
+        self.refresh()
+        total = sum(len(segment.keys) for segment in self.segments)
+        if len(self.segments) > self.max_segments or (total and 1 - self.live_rows / total > self.max_dead):
+            self.compact()
+
+    def update_meta(self, meta: dict) -> None:
+        with self._locked() as manifest:
+            manifest["meta"] = {**manifest.get("meta", {}), **meta}
+            self._write_manifest(manifest)
+        self.refresh()
+
+    def upsert(self, keys: Sequence[int], vectors: np.ndarray, meta: Optional[dict] = None) -> None:
+        """Add or replace the vectors of ``keys``."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(keys), self.dim)
+        self._append(keys, vectors, [], meta)
+
+    def delete(self, keys: Sequence[int], meta: Optional[dict] = None) -> None:
+        self._append([], np.empty((0, self.dim), dtype=np.float32), keys, meta)
+
+    def compact(self) -> None:
+        """Rewrite the live rows as one segment, clustered for IVF when large enough."""
+        with self._locked() as manifest:
+            self._manifest_mtime = None
+            self.refresh()
+            old = [segment.name for segment in self.segments]
+            keys = self.live_keys()
+            vectors = np.empty((len(keys), self.dim), dtype=np.float32)
+            row = 0
+            for segment in self.segments:
+                for start in range(0, len(segment.keys), SCAN_ROWS):
+                    stop = min(start + SCAN_ROWS, len(segment.keys))
+                    live = segment.live[start:stop]
+                    block = np.asarray(segment.vectors[start:stop][live], dtype=np.float32)
+                    if segment.scales is not None:
+                        block *= segment.scales[start:stop][live, None]
+                    vectors[row:row + len(block)] = block
+                    row += len(block)
+            order = centroids = offsets = None
+            if len(keys) >= self.ivf_min_rows:
+                centroids = train_centroids(vectors, max(1, int(np.sqrt(len(keys)))))
+                assigned = np.concatenate([np.argmax(vectors[start:start + SCAN_ROWS] @ centroids.T, axis=1)
+                                           for start in range(0, len(keys), SCAN_ROWS)])
+                order = np.argsort(assigned, kind="stable")
+                offsets = np.searchsorted(assigned[order], np.arange(len(centroids) + 1)).astype(np.int64)
+            name = self._write_segment(manifest, keys, vectors, [], order, centroids, offsets)
+            manifest["segments"] = [name]
+            self._write_manifest(manifest)
+            # Workers still mapping the old files keep reading them until they refresh
+            for segment in old:
+                shutil.rmtree(os.path.join(self.path, segment), ignore_errors=True)
+        self.compactions += 1
+        logger.info(f"Compacted {len(old)} segments of {self.path} into {len(keys)} rows"
+                    f"{f' in {len(centroids)} lists' if centroids is not None else ''}")
+        self.refresh()
+
+    def search(self, query: np.ndarray, k: int = 5) -> List[Tuple[int, float]]:
+        """Keys of the ``k`` nearest live vectors with their cosine similarity, best first."""
+        self.refresh()
+        self.searches += 1
+        query = np.asarray(query, dtype=np.float32)
+        found_keys, found_scores = [], []
+        for segment in self.segments:
+            rows, scores = segment.search(query, k, self.nprobe)
+            found_keys.append(segment.keys[rows])
+            found_scores.append(scores)
+        if not found_keys:
+            return []
+        keys, scores = np.concatenate(found_keys), np.concatenate(found_scores)
+        top = np.argsort(-scores)[:k]
+        return [(int(keys[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def live_keys(self) -> np.ndarray:
+        self.refresh()
+        if not self.segments:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([segment.keys[segment.live] for segment in self.segments])
+
+    def stats(self) -> Dict[str, object]:
+        self.refresh()
+        return {
+            "rows": self.live_rows,
+            "segments": len(self.segments),
+            "stored_rows": sum(len(segment.keys) for segment in self.segments),
+            "ivf_lists": sum(len(s.centroids) for s in self.segments if s.centroids is not None),
+            "quantized": self.quantize,
+            "searches": self.searches,
+            "compactions": self.compactions,
+        }
+
+
+class VectorStores:
+    """Stores by company id under one root directory, opened on first use.
+
+    ``dim`` must be the dimension of the embedder filling the stores.
+    """
+
+    def __init__(self, dim: int, root: str = VECTOR_STORE_DIR, **options):
+        self.root = root
+        self.dim = dim
+        self.options = options
+        self.stores: Dict[int, VectorStore] = {}
+
+    def get(self, company_id: int) -> VectorStore:
+        store = self.stores.get(company_id)
+        if store is None:
+            store = self.stores[company_id] = VectorStore(
+                os.path.join(self.root, str(company_id)), self.dim, **self.options)
+        return store
+
+    def stats(self) -> Dict[int, Dict[str, object]]:
+        return {company_id: store.stats() for company_id, store in self.stores.items()}
+
+
+def index_company(store: VectorStore, embedder, company_id: int) -> int:
+    """Bring a company's store up to date with its FAQ and Policy rows.
+
+    Embeds rows changed since the last sync (kept in the store's meta) and
+    deletes the vectors of rows that are gone. The whole sync holds the
+    store's write lock, so concurrent syncs of the company (other workers,
+    a management task) run one after another. Blocking, run it on the
+    database pool or from a management task. Returns the rows embedded.
+    """
+    from datetime import datetime
+    from retrieval import load_changes
+
+    with store.writing():
+        synced_at = store.meta.get("synced_at")
+        since = datetime.fromisoformat(synced_at) if synced_at else None
+        keys, documents, now = load_changes(company_id, since)
+        current = np.array([document_key(kind, pk) for kind, pk in keys], dtype=np.int64)
+        gone = np.setdiff1d(store.live_keys(), current)
+        # Never move synced_at backwards, e.g. when this host's clock is behind the last syncer's
+        meta = {"synced_at": (now if since is None else max(now, since)).isoformat()}
+        if len(gone):
+            store.delete(gone, meta=None if documents else meta)
+        if documents:
+            vectors = embedder.embed([document.snippet for document in documents])
+            store.upsert([document_key(*document.key) for document in documents], vectors, meta=meta)
+        elif not len(gone):
+            store.update_meta(meta)
+    logger.info(f"Vector store of company {company_id}: {len(documents)} embedded, {len(gone)} deleted")
+    return len(documents)
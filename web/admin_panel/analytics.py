@@ -0,0 +1,393 @@
+"""Incremental daily analytics for the bot.
+
+``Analytics.update_daily_analytics`` recomputes a company's day from all of
+today's messages, which gets slower with every message. The accumulator
+instead counts each persisted message (and each new client) in memory per
+company/day and adds these deltas to the ``Analytics`` row with one UPDATE
+(``F()`` expressions) per changed row every ``ANALYTICS_FLUSH_INTERVAL``
+seconds, then starts again from zero. Several bot processes can flush into
+the same rows without overwriting each other's counts.
+
+The process that creates a company's row for the day seeds it from the
+database with a few aggregate queries; rows counted by that seed are
+remembered by id, so they are not added again. Active users and the
+average response time are not additive across processes, so the flush
+recomputes them from today's messages inside the same UPDATE. Deltas not
+yet flushed when a process dies are lost; ``rollup_daily_analytics``
+recomputes whole date ranges for backfills and reconciliation (see the
+``rollup_analytics`` management command).
+"""
+import asyncio
+import logging
+import os
+import threading
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.db.models import (Avg, Case, Count, DurationField, F, FloatField, Max, Min, OuterRef, Q,
+                              Subquery, Sum, Value, When)
+from django.db.models.functions import Cast, Coalesce, Greatest, Least, TruncDate
+from django.utils import timezone
+
+from users.models import Client
+from .models import Analytics, Message
+
+logger = logging.getLogger("uvicorn")
+
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "30"))
+
+
+class DailyStats:
+    """Changes to one company's day since the last flush."""
+
+    __slots__ = (
+        "new_users", "user_messages", "bot_messages", "response_min", "response_max",
+        "message_watermark", "client_watermark", "dirty",
+    )
+
+    def __init__(self, message_watermark: int = 0, client_watermark: int = 0):
+        self.new_users = 0
+        self.user_messages = 0
+        self.bot_messages = 0
+        self.response_min: Optional[timedelta] = None
+        self.response_max: Optional[timedelta] = None
+        # Highest ids already included by the seed of the row
+        self.message_watermark = message_watermark
+        self.client_watermark = client_watermark
+        self.dirty = False
+
+    def add_message(self, message: Message) -> None:
+        if message.pk <= self.message_watermark:
+            return
+        if message.is_bot_response:
+            self.bot_messages += 1
+        else:
+            self.user_messages += 1
+        if message.response_time is not None:
+            self._add_response_time(message.response_time)
+        self.dirty = True
+
+    def add_client(self, client: Client) -> None:
+        if client.pk <= self.client_watermark:
+            return
+        self.new_users += 1
+        self.dirty = True
+
+    def _add_response_time(self, response_time: timedelta) -> None:
+        if self.response_min is None or response_time < self.response_min:
+            self.response_min = response_time
+        if self.response_max is None or response_time > self.response_max:
+            self.response_max = response_time
+
+    def take(self) -> "DailyStats":
+        """The pending deltas; this object starts again from zero."""
+        taken = DailyStats()
+        for field in ("new_users", "user_messages", "bot_messages", "response_min", "response_max"):
+            setattr(taken, field, getattr(self, field))
+        self.__init__(self.message_watermark, self.client_watermark)
+        return taken
+
+    def merge(self, other: "DailyStats") -> None:
+        """Add back deltas whose flush failed."""
+        self.new_users += other.new_users
+        self.user_messages += other.user_messages
+        self.bot_messages += other.bot_messages
+        for response_time in (other.response_min, other.response_max):
+            if response_time is not None:
+                self._add_response_time(response_time)
+        self.dirty = True
+
+    def updates(self) -> Dict[str, object]:
+        """UPDATE expressions adding these deltas to the Analytics row.
+
+        Derived fields follow update_daily_analytics; the rates use the
+        updated counters (SET expressions read the old values).
+        """
+        messages = self.user_messages + self.bot_messages
+        total_users = F("total_users") + self.new_users
+        user_messages = F("user_messages") + self.user_messages
+        today = (
+            Message.objects.filter(company_id=OuterRef("company_id"), timestamp__date=OuterRef("date"))
+            .order_by().values("company_id")
+        )
+        updates = {
+            "total_users": total_users,
+            "new_users": F("new_users") + self.new_users,
+            "active_users": Coalesce(Subquery(today.annotate(n=Count("user_id", distinct=True)).values("n")), 0),
+            "total_messages": F("total_messages") + messages,
+            "bot_messages": F("bot_messages") + self.bot_messages,
+            "user_messages": user_messages,
+            "average_response_time": Subquery(today.annotate(average=Avg("response_time")).values("average"),
+                                              output_field=DurationField()),
+            "engagement_rate": Case(
+                When(total_users__gt=-self.new_users,
+                     then=Cast(F("total_messages") + messages, FloatField()) / total_users),
+                default=F("engagement_rate"),
+            ),
+            "response_rate": Case(
+                When(~Q(total_users__gt=-self.new_users), then=F("response_rate")),
+                When(user_messages__gt=-self.user_messages,
+                     then=Cast(F("bot_messages") + self.bot_messages, FloatField()) / user_messages),
+                default=Value(0.0),
+            ),
+        }
+        if self.response_max is not None:
+            longest = Value(self.response_max, output_field=DurationField())
+            updates["max_response_time"] = Greatest(Coalesce("max_response_time", longest), longest)
+        if self.response_min is not None:
+            shortest = Value(self.response_min, output_field=DurationField())
+            updates["min_response_time"] = Least(Coalesce("min_response_time", shortest), shortest)
+        return updates
+
+
+def load_baseline(company_id: int, day: date) -> DailyStats:
+    """Start counting a company's ``day``, seeding its row from the database if it is new."""
+    row, created = Analytics.objects.get_or_create(company_id=company_id, date=day)
+    if not created:
+        # Another process (or an earlier run) counts everything up to now
+        return DailyStats()
+
+    clients = Client.objects.filter(company_id=company_id).aggregate(
+        total=Count("id"),
+        new=Count("id", filter=Q(created_at__gte=_day_start(day - timedelta(days=1)))),
+        last=Max("id"),
+    )
+    messages = Message.objects.filter(company_id=company_id, timestamp__date=day)
+    totals = messages.aggregate(
+        bot=Count("id", filter=Q(is_bot_response=True)),
+        user=Count("id", filter=Q(is_bot_response=False)),
+        response_average=Avg("response_time"),
+        response_min=Min("response_time"),
+        response_max=Max("response_time"),
+        last=Max("id"),
+    )
+    seed = {
+        "total_users": clients["total"],
+        "active_users": messages.order_by().values("user_id").distinct().count(),
+        "new_users": clients["new"],
+        "total_messages": totals["bot"] + totals["user"],
+        "bot_messages": totals["bot"],
+        "user_messages": totals["user"],
+        "average_response_time": totals["response_average"],
+        "max_response_time": totals["response_max"],
+        "min_response_time": totals["response_min"],
+    }
+    if seed["total_users"] > 0:
+        seed["engagement_rate"] = seed["total_messages"] / seed["total_users"]
+        seed["response_rate"] = totals["bot"] / totals["user"] if totals["user"] > 0 else 0
+    Analytics.objects.filter(pk=row.pk).update(**seed)
+    return DailyStats(message_watermark=totals["last"] or 0, client_watermark=clients["last"] or 0)
+
+
+class AnalyticsAccumulator:
+    """Per-company/day deltas shared by the database threads."""
+
+    def __init__(self):
+        self.days: Dict[Tuple[int, date], DailyStats] = {}
+        self._lock = threading.Lock()
+        self.baselines = 0
+        self.flushes = 0
+        self.rows_written = 0
+
+    def _stats(self, company_id: int) -> DailyStats:
+        key = (company_id, timezone.localdate())
+        stats = self.days.get(key)
+        if stats is None:
+            stats = self.days[key] = load_baseline(*key)
+            self.baselines += 1
+        return stats
+
+    def record_messages(self, company_id: int, messages: Iterable[Message]) -> None:
+        """Count persisted messages (blocking on the first call of the day)."""
+        with self._lock:
+            stats = self._stats(company_id)
+            for message in messages:
+                stats.add_message(message)
+
+    def record_new_client(self, company_id: int, client: Client) -> None:
+        """Count a newly created client."""
+        with self._lock:
+            self._stats(company_id).add_client(client)
+
+    def flush(self) -> int:
+        """Add pending deltas to their Analytics rows. Returns the number of rows."""
+        with self._lock:
+            dirty = []
+            for key, stats in self.days.items():
+                if stats.dirty:
+                    dirty.append((key, stats.take()))
+            # Earlier days get no more messages once their last deltas are taken
+            today = timezone.localdate()
+            for key in [key for key in self.days if key[1] < today]:
+                del self.days[key]
+
+        written = 0
+        for (company_id, day), deltas in dirty:
+            try:
+                written += Analytics.objects.filter(company_id=company_id, date=day).update(**deltas.updates())
+            except Exception as e:
+                logger.error(f"Error flushing analytics for company {company_id} on {day}: {e}")
+                with self._lock:
+                    self.days.setdefault((company_id, day), DailyStats()).merge(deltas)
+        self.flushes += 1
+        self.rows_written += written
+        return written
+
+accumulator = AnalyticsAccumulator()
+
+
+async def flush_periodically(run_db, interval: float = ANALYTICS_FLUSH_INTERVAL,
+                             analytics: AnalyticsAccumulator = accumulator) -> None:
+    """Flush ``analytics`` every ``interval`` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_db(analytics.flush, write=True)
+        except Exception as e:
+            logger.error(f"Error flushing analytics: {e}")
+
+
+ROLLUP_FIELDS = [
+    "total_users", "active_users", "new_users",
+    "total_messages", "bot_messages", "user_messages",
+    "average_response_time", "max_response_time", "min_response_time",
+    "engagement_rate", "response_rate",
+]
+
+
+def _day_start(day: date) -> datetime:
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+class _UserCounts:
+    """Clients per company as of any day, from per-day creation counts."""
+
+    def __init__(self, before: int, created: List[Tuple[date, int]]):
+        self.before = before
+        self.days = [day for day, _ in created]
+        self.cumulative = list(accumulate(count for _, count in created))
+        self.by_day = dict(created)
+
+    def total(self, day: date) -> int:
+        index = bisect_right(self.days, day)
+        return self.before + (self.cumulative[index - 1] if index else 0)
+
+    def new(self, day: date) -> int:
+        # Same window as update_daily_analytics: since yesterday's midnight
+        return self.by_day.get(day - timedelta(days=1), 0) + self.by_day.get(day, 0)
+
+
+def _user_counts(start: date, end: date, company_ids: Optional[Sequence[int]]) -> Dict[int, _UserCounts]:
+    clients = Client.objects.order_by()
+    if company_ids:
+        clients = clients.filter(company_id__in=company_ids)
+    before = dict(
+        clients.filter(created_at__lt=_day_start(start))
+        .values("company_id").annotate(n=Count("id")).values_list("company_id", "n")
+    )
+    created = defaultdict(list)
+    # Starts a day early so new_users of the first day sees yesterday's clients
+    rows = (
+        clients.filter(created_at__gte=_day_start(start - timedelta(days=1)),
+                       created_at__lt=_day_start(end + timedelta(days=1)))
+        .annotate(day=TruncDate("created_at"))
+        .values("company_id", "day").annotate(n=Count("id"))
+        .values_list("company_id", "day", "n")
+        .order_by("company_id", "day")
+    )
+    for company_id, day, count in rows:
+        created[company_id].append((day, count))
+    # Clients counted in ``before`` and created the day before ``start`` are in both
+    counts = {}
+    for company_id in set(before) | set(created):
+        days = created.get(company_id, [])
+        early = sum(count for day, count in days if day < start)
+        counts[company_id] = _UserCounts(before.get(company_id, 0) - early, days)
+    return counts
+
+
+def rollup_daily_analytics(start: date, end: date, company_ids: Optional[Sequence[int]] = None,
+                           chunk_days: int = 31, batch_size: int = 1000) -> int:
+    """Recompute Analytics rows for every company/day with messages in [start, end].
+
+    Messages are aggregated in SQL grouped by company and day, ``chunk_days``
+    at a time, and the rows are written with bulk upserts, so the number of
+    queries depends on the range and row count, not on the message count.
+    Results match ``update_daily_analytics`` run at the end of each day.
+
+    Returns:
+        int: Number of Analytics rows written
+    """
+    users = _user_counts(start, end, company_ids)
+    messages = Message.objects.order_by()
+    if company_ids:
+        messages = messages.filter(company_id__in=company_ids)
+
+    written = 0
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(end, chunk_start + timedelta(days=chunk_days - 1))
+        rows = (
+            messages.filter(timestamp__gte=_day_start(chunk_start),
+                            timestamp__lt=_day_start(chunk_end + timedelta(days=1)))
+            .annotate(day=TruncDate("timestamp"))
+            .values("company_id", "day")
+            .annotate(
+                total=Count("id"),
+                bot=Count("id", filter=Q(is_bot_response=True)),
+                active=Count("user_id", distinct=True),
+                response_count=Count("response_time"),
+                response_total=Sum("response_time"),
+                response_min=Min("response_time"),
+                response_max=Max("response_time"),
+            )
+            .iterator(chunk_size=batch_size)
+        )
+        batch = []
+        for row in rows:
+            batch.append(_analytics_row(row, users.get(row["company_id"])))
+            if len(batch) >= batch_size:
+                written += _upsert(batch)
+                batch = []
+        if batch:
+            written += _upsert(batch)
+        chunk_start = chunk_end + timedelta(days=1)
+    return written
+
+
+def _analytics_row(row, users: Optional[_UserCounts]) -> Analytics:
+    day = row["day"]
+    total_users = users.total(day) if users else 0
+    bot_messages = row["bot"]
+    user_messages = row["total"] - bot_messages
+    analytics = Analytics(
+        company_id=row["company_id"],
+        date=day,
+        total_users=total_users,
+        active_users=row["active"],
+        new_users=users.new(day) if users else 0,
+        total_messages=row["total"],
+        bot_messages=bot_messages,
+        user_messages=user_messages,
+        # Sum / count rather than SQL AVG, to round exactly like update_daily_analytics
+        average_response_time=row["response_total"] / row["response_count"] if row["response_count"] else None,
+        max_response_time=row["response_max"],
+        min_response_time=row["response_min"],
+    )
+    if total_users > 0:
+        analytics.engagement_rate = row["total"] / total_users
+        analytics.response_rate = bot_messages / user_messages if user_messages > 0 else 0
+    return analytics
+
+
+def _upsert(rows: List[Analytics]) -> int:
+    Analytics.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=["company", "date"],
+        update_fields=ROLLUP_FIELDS,
+    )
+    return len(rows)
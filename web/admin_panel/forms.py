@@ -60,9 +60,13 @@ class CompanyForm(forms.ModelForm):
             'max_retries',
             'enable_analytics',
             'collect_feedback',
+            'canned_replies_enabled',
             'available_languages',
+            'history_token_budget',
+            'summary_daily_tokens',
             'allowed_topics',
             'restricted_topics',
+            'handoff_trigger',
             'admin_id',
             'notifications_enabled',
             'notification_hours',
@@ -128,32 +132,9 @@ class CompanyForm(forms.ModelForm):
         return phone
 
     def save(self, commit=True):
-        # Save the company first
-        company = super().save(commit=False)
-        
-        # Create policy JSON
-        policy = {
-            'company_info': {
-                'name': self.cleaned_data['company_name'],
-
-            },
-            'messages': {
-                'welcome': self.cleaned_data['welcome_message'],
-            },
-            'support': {
-                'email': self.cleaned_data['support_email'],
-                'phone': self.cleaned_data['support_phone'],
-            },
-            'data_retention_days': self.cleaned_data['data_retention_days']
-        }
-        
-        # Update company fields
-        company.policy = policy
-        company.name = self.cleaned_data['company_name']
-        
-        if commit:
-            company.save()
-        return company
+        # Company.save() bumps config_version, which invalidates the bot's
+        # cached profile for this company
+        return super().save(commit=commit)
 
 
         # Make email required
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_panel', '0003_message_token_count'),
+        ('users', '0007_company_canned_replies_enabled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='update_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['company', 'update_id'], name='admin_panel_company_59861f_idx'),
+        ),
+    ]
@@ -2,7 +2,20 @@ from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.db.models import Manager
 
-class FAQ(models.Model):
+class CompanyConfigMixin:
+    """Bumps the owning company's config version whenever a row is saved or
+    deleted, the webhook's caches of bot answers depend on it."""
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._meta.get_field('company').related_model.bump_config_version(self.company_id)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self._meta.get_field('company').related_model.bump_config_version(self.company_id)
+        return result
+
+class FAQ(CompanyConfigMixin, models.Model):
     """Frequently Asked Questions for a company."""
     company = models.ForeignKey('users.Company', on_delete=models.CASCADE, related_name='faqs')
     category = models.CharField(max_length=50, choices=[
@@ -27,7 +40,7 @@ class FAQ(models.Model):
     def __str__(self):
         return f"{self.company.name}: {self.category} - {self.question[:50]}..."
 
-class Policy(models.Model):
+class Policy(CompanyConfigMixin, models.Model):
     """Company policies that can be customized."""
     company = models.ForeignKey('users.Company', on_delete=models.CASCADE, related_name='policies')
     category = models.CharField(max_length=50, choices=[
@@ -62,33 +75,55 @@ class Message(models.Model):
     user = models.ForeignKey('users.Client', on_delete=models.CASCADE, related_name='messages')
     response_time = models.DurationField(null=True, blank=True)
     is_bot_response = models.BooleanField(default=False)
+    # Tokens in ``content``, counted once when the message is stored so
+    # prompt history can be budgeted without re-tokenizing
+    token_count = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # Telegram update the exchange answered, so a retried update is not
+    # answered and stored twice
+    update_id = models.BigIntegerField(null=True, blank=True, editable=False)
     
     class Meta:
         app_label = 'admin_panel'
         ordering = ['-timestamp']
+        indexes = [models.Index(fields=['company', 'update_id'])]
 
     def __str__(self):
         return f"Message from {self.user.username} at {self.timestamp}"
 
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        # Conversations cached by any webhook process are reloaded
+        self._meta.get_field('user').related_model.touch(self.user_id)
+        return result
+
     def calculate_response_time(self, previous_message):
         """Calculate response time based on the previous message."""
-        if previous_message and previous_message.user != self.user:
+        # Both sides of a conversation share ``user``, the sender is told
+        # apart by ``is_bot_response``
+        if previous_message and previous_message.is_bot_response != self.is_bot_response:
             self.response_time = self.timestamp - previous_message.timestamp
-            self.save()
+            self.save(update_fields=['response_time'])
 
     @classmethod
-    def create_with_response_time(cls, content, company, user, is_bot_response=False):
-        """Create a new message and calculate response time."""
+    def create_with_response_time(cls, content, company, user, is_bot_response=False, token_count=None,
+                                  update_id=None):
+        """Create a new message and calculate response time.
+        
+        ``company`` may be a Company or any object with its ``pk`` (such as
+        a routing table record), so callers don't need to load the row.
+        """
         previous_message = cls.objects.filter(
-            company=company,
+            company_id=company.pk,
             user=user
         ).order_by('-timestamp').first()
         
         message = cls.objects.create(
             content=content,
-            company=company,
+            company_id=company.pk,
             user=user,
-            is_bot_response=is_bot_response
+            is_bot_response=is_bot_response,
+            token_count=token_count,
+            update_id=update_id
         )
         
         message.calculate_response_time(previous_message)
@@ -128,33 +163,35 @@ class Analytics(models.Model):
 
     @classmethod
     def update_daily_analytics(cls, company):
-        """Update analytics for today."""
-        from datetime import datetime, timedelta
-        today = datetime.now().date()
+        """Update analytics for today (``company`` as in create_with_response_time)."""
+        from datetime import timedelta
+        from django.utils import timezone
+        from users.models import Client
+        today = timezone.localdate()
         yesterday = today - timedelta(days=1)
         
         # Get or create today's analytics
         analytics, created = cls.objects.get_or_create(
-            company=company,
+            company_id=company.pk,
             date=today
         )
         
         # Calculate metrics
-        analytics.total_users = Client.objects.filter(company=company).count()
+        analytics.total_users = Client.objects.filter(company_id=company.pk).count()
         analytics.active_users = Client.objects.filter(
-            company=company,
+            company_id=company.pk,
             messages__timestamp__gte=today
         ).distinct().count()
         
         # Calculate new users
         analytics.new_users = Client.objects.filter(
-            company=company,
-            date_joined__gte=yesterday
+            company_id=company.pk,
+            created_at__gte=yesterday
         ).count()
         
         # Calculate message metrics
         messages = Message.objects.filter(
-            company=company,
+            company_id=company.pk,
             timestamp__date=today
         )
         
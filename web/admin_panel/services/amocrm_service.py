@@ -1,6 +1,6 @@
-import requests
 from django.conf import settings
 from ..models import Integration
+from . import http
 from users.models import Client
 
 class AmoCRMService:
@@ -22,7 +22,7 @@ class AmoCRMService:
             'Authorization': f'Bearer {self.access_token}',
             'Content-Type': 'application/json'
         }
-        response = requests.request(method, url, headers=headers, json=data)
+        response = http.pool.request(method, url, destination=http.AMOCRM, headers=headers, json=data)
         response.raise_for_status()
         return response.json()
     
@@ -1,6 +1,6 @@
-import requests
 from django.conf import settings
 from ..models import Integration
+from . import http
 from users.models import Client
 
 class BitrixService:
@@ -17,7 +17,7 @@ class BitrixService:
     
     def _make_request(self, method, params=None):
         url = f"{self.base_url}/{method}"
-        response = requests.get(url, params=params or {})
+        response = http.pool.request('GET', url, destination=http.BITRIX, params=params or {})
         response.raise_for_status()
         return response.json()
     
@@ -0,0 +1,136 @@
+"""Pooled HTTP client for the CRM integrations.
+
+The admin panel runs in its own (synchronous) process, so it cannot share
+the bot's async ``http_pool``; it gets the same scheme in blocking form:
+one keep-alive ``httpx.Client`` per host (thread safe, shared by all
+requests of the process), a timeout and retry policy per service, and
+latency and in-flight counters per host (``stats``).
+
+Failed connects and 429/503 responses are retried with an exponential
+backoff; read errors only for GET requests.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+LATENCY_SAMPLES = 1000
+RETRY_STATUSES = frozenset({429, 503})
+
+
+@dataclass(frozen=True)
+class Destination:
+    timeout: float = 15.0
+    connect_timeout: float = 5.0
+    retries: int = 2
+    backoff: float = 0.5
+    max_connections: int = 20
+
+
+# CRM APIs are slow on large accounts; Bitrix24 webhooks are rate limited to 2 requests a second
+AMOCRM = Destination(timeout=20.0)
+BITRIX = Destination(timeout=20.0, backoff=1.0, max_connections=5)
+
+
+class HostStats:
+    def __init__(self, max_connections):
+        self.max_connections = max_connections
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def snapshot(self):
+        latencies = sorted(self.latencies)
+        p50 = latencies[len(latencies) // 2] if latencies else 0.0
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'retries': self.retries,
+            'p50_ms': round(p50 * 1000, 1),
+            'max_ms': round(latencies[-1] * 1000, 1) if latencies else 0.0,
+            'in_flight': self.in_flight,
+            'peak_saturation': round(self.peak_in_flight / self.max_connections, 3),
+        }
+
+
+class HTTPPool:
+    """Blocking HTTP clients by host, shared by the threads of the process."""
+
+    def __init__(self, transport=None):
+        self.transport = transport
+        self.clients = {}
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def _client(self, host, destination):
+        with self.lock:
+            client = self.clients.get(host)
+            if client is None:
+                client = self.clients[host] = httpx.Client(
+                    limits=httpx.Limits(max_connections=destination.max_connections),
+                    timeout=httpx.Timeout(destination.timeout, connect=destination.connect_timeout),
+                    transport=self.transport,
+                )
+                self.hosts[host] = HostStats(destination.max_connections)
+            return client, self.hosts[host]
+
+    def request(self, method, url, destination=Destination(), **kwargs):
+        """Send a request through the host's pool and return the response."""
+        host = httpx.URL(url).host
+        client, stats = self._client(host, destination)
+        attempt = 0
+        while True:
+            with self.lock:
+                stats.requests += 1
+                stats.in_flight += 1
+                stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+            started = time.perf_counter()
+            response = error = None
+            try:
+                response = client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                error = e
+            finally:
+                with self.lock:
+                    stats.in_flight -= 1
+                    stats.latencies.append(time.perf_counter() - started)
+                    stats.failures += response is None or response.status_code >= 500
+            if error is not None:
+                retryable = isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)) or method.upper() == 'GET'
+            else:
+                retryable = response.status_code in RETRY_STATUSES
+            if not retryable or attempt >= destination.retries:
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                response.close()
+            attempt += 1
+            with self.lock:
+                stats.retries += 1
+            logger.warning(f'{method} {host} failed, retry {attempt} of {destination.retries}')
+            time.sleep(destination.backoff * 2 ** (attempt - 1))
+
+    def stats(self):
+        with self.lock:
+            return {host: stats.snapshot() for host, stats in self.hosts.items()}
+
+    def close(self):
+        with self.lock:
+            clients, self.clients = self.clients, {}
+        for client in clients.values():
+            client.close()
+
+
+# Shared by the integration services of this process, closed when it exits
+pool = HTTPPool()
+atexit.register(pool.close)
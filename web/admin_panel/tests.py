@@ -1,3 +1,231 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+import httpx
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from users.models import Company, Client
+from .analytics import AnalyticsAccumulator, rollup_daily_analytics
+from .models import FAQ, Analytics, Message, Policy
+from .services import http
+
+ANALYTICS_FIELDS = [
+    'total_users', 'active_users', 'new_users',
+    'total_messages', 'bot_messages', 'user_messages',
+    'average_response_time', 'max_response_time', 'min_response_time',
+    'engagement_rate', 'response_rate',
+]
+
+
+class AnalyticsAccumulatorTest(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Test Company")
+        self.other_company = Company.objects.create(name="Other Company")
+
+    def new_client(self, accumulator, company, telegram_id):
+        client = Client.objects.create(company=company, name=f"Client {telegram_id}", telegram_id=telegram_id)
+        accumulator.record_new_client(company.pk, client)
+        return client
+
+    def exchange(self, accumulator, company, client, text="Привет"):
+        messages = [
+            Message.create_with_response_time(content=text, company=company, user=client),
+            Message.create_with_response_time(content="Ответ", company=company, user=client, is_bot_response=True),
+        ]
+        accumulator.record_messages(company.pk, messages)
+
+    def flushed_and_recomputed(self, company):
+        row = Analytics.objects.get(company=company)
+        flushed = {field: getattr(row, field) for field in ANALYTICS_FIELDS}
+        recomputed = Analytics.update_daily_analytics(company)
+        return flushed, {field: getattr(recomputed, field) for field in ANALYTICS_FIELDS}
+
+    def test_flushed_counters_match_full_recompute(self):
+        """Test the incremental daily numbers equal update_daily_analytics"""
+        accumulator = AnalyticsAccumulator()
+        # Traffic from before the process started is picked up by the baseline
+        existing = Client.objects.create(company=self.company, name="Existing", telegram_id=1)
+        Message.create_with_response_time(content="Старое", company=self.company, user=existing)
+
+        clients = [existing] + [self.new_client(accumulator, self.company, i) for i in range(2, 6)]
+        for i in range(20):
+            self.exchange(accumulator, self.company, clients[i % 3], text=f"Вопрос {i}")
+        other = self.new_client(accumulator, self.other_company, 100)
+        self.exchange(accumulator, self.other_company, other)
+
+        self.assertEqual(accumulator.flush(), 2)
+        flushed, recomputed = self.flushed_and_recomputed(self.company)
+        self.assertEqual(flushed, recomputed)
+        self.assertEqual(flushed['active_users'], 3)
+        self.assertEqual(flushed['user_messages'], 21)
+        self.assertIsNotNone(flushed['average_response_time'])
+        flushed, recomputed = self.flushed_and_recomputed(self.other_company)
+        self.assertEqual(flushed, recomputed)
+
+    def test_restart_continues_without_double_counting(self):
+        """Test a new accumulator adds to the flushed row"""
+        client = self.new_client(AnalyticsAccumulator(), self.company, 1)
+        first = AnalyticsAccumulator()
+        self.exchange(first, self.company, client)
+        first.flush()
+
+        restarted = AnalyticsAccumulator()
+        self.exchange(restarted, self.company, client)
+        self.exchange(restarted, self.company, self.new_client(restarted, self.company, 2))
+        restarted.flush()
+
+        flushed, recomputed = self.flushed_and_recomputed(self.company)
+        self.assertEqual(flushed, recomputed)
+        self.assertEqual(flushed['total_messages'], 6)
+
+    def test_processes_flushing_the_same_day_add_up(self):
+        """Test flushes from two processes add their counts instead of overwriting each other"""
+        client = self.new_client(AnalyticsAccumulator(), self.company, 1)
+        first, second = AnalyticsAccumulator(), AnalyticsAccumulator()
+        self.exchange(first, self.company, client)
+        self.exchange(second, self.company, client)
+        self.exchange(second, self.company, self.new_client(second, self.company, 2))
+
+        first.flush()
+        second.flush()
+        first.flush()
+
+        flushed, recomputed = self.flushed_and_recomputed(self.company)
+        self.assertEqual(flushed, recomputed)
+        self.assertEqual(flushed['total_messages'], 6)
+        self.assertEqual(flushed['total_users'], 2)
+
+    def test_zero_response_time_is_counted(self):
+        """Test an instant reply counts as the shortest response time instead of being skipped"""
+        accumulator = AnalyticsAccumulator()
+        client = self.new_client(accumulator, self.company, 1)
+        self.exchange(accumulator, self.company, client)
+        message = Message.create_with_response_time(content="Ответ", company=self.company, user=client,
+                                                    is_bot_response=True)
+        message.response_time = timedelta(0)
+        accumulator.record_messages(self.company.pk, [message])
+        accumulator.flush()
+
+        self.assertEqual(Analytics.objects.get(company=self.company).min_response_time, timedelta(0))
+
+    def test_flush_writes_each_row_with_one_update(self):
+        """Test a flush costs one query per changed row and none when nothing changed"""
+        accumulator = AnalyticsAccumulator()
+        client = self.new_client(accumulator, self.company, 1)
+        for _ in range(10):
+            self.exchange(accumulator, self.company, client)
+
+        with self.assertNumQueries(1):
+            accumulator.flush()
+        with self.assertNumQueries(0):
+            accumulator.flush()
+
+
+class AnalyticsRollupTest(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.companies = [Company.objects.create(name=f"Company {i}") for i in range(3)]
+        for company in self.companies:
+            for i in range(3):
+                client = Client.objects.create(company=company, name=f"Client {i}", telegram_id=i)
+                for _ in range(i + 1):
+                    Message.create_with_response_time(content="Вопрос", company=company, user=client)
+                    Message.create_with_response_time(content="Ответ", company=company, user=client,
+                                                      is_bot_response=True)
+
+    def test_rollup_matches_update_daily_analytics(self):
+        """Test the grouped aggregates give the same rows as the per-company recompute"""
+        self.assertEqual(rollup_daily_analytics(self.today, self.today), 3)
+        for company in self.companies:
+            row = Analytics.objects.get(company=company, date=self.today)
+            rolled_up = {field: getattr(row, field) for field in ANALYTICS_FIELDS}
+            recomputed = Analytics.update_daily_analytics(company)
+            self.assertEqual(rolled_up, {field: getattr(recomputed, field) for field in ANALYTICS_FIELDS})
+
+    def test_rollup_backfills_past_days_in_bounded_queries(self):
+        """Test earlier days are rebuilt and the query count does not grow with companies"""
+        last_week = self.today - timedelta(days=7)
+        moved = Message.objects.filter(company=self.companies[0]).order_by('id')[:4]
+        Message.objects.filter(id__in=list(moved.values_list('id', flat=True))).update(
+            timestamp=timezone.now() - timedelta(days=7)
+        )
+        Client.objects.filter(company=self.companies[0]).update(created_at=timezone.now() - timedelta(days=8))
+
+        # 2 user-count queries, 1 aggregate per chunk, 1 upsert per batch
+        with self.assertNumQueries(4):
+            written = rollup_daily_analytics(last_week, self.today, chunk_days=31)
+
+        self.assertEqual(written, 4)
+        backfilled = Analytics.objects.get(company=self.companies[0], date=last_week)
+        self.assertEqual(backfilled.total_messages, 4)
+        self.assertEqual(backfilled.total_users, 3)
+        self.assertEqual(backfilled.new_users, 3)
+
+    def test_command_reports_rows(self):
+        """Test the management command runs the rollup for the given range"""
+        out = StringIO()
+        call_command('rollup_analytics', '--start', self.today.isoformat(), '--end', self.today.isoformat(), stdout=out)
+        self.assertRegex(out.getvalue(), r'Wrote 3 analytics rows .* with [1-9]\d* queries')
+
+
+class CompanyConfigVersionTest(TestCase):
+    def test_faq_and_policy_changes_bump_company_config_version(self):
+        """Test cached bot answers see FAQ and policy edits through the company's config version"""
+        company = Company.objects.create(name="Test Company")
+        version = Company._base_manager.get(pk=company.pk).config_version
+
+        faq = FAQ.objects.create(company=company, question="Часы работы?", answer="С 9 до 21")
+        faq.answer = "С 10 до 22"
+        faq.save()
+        faq.delete()
+        Policy.objects.create(company=company, category='refund', title="Возврат", content="В течение 14 дней")
+
+        self.assertEqual(Company._base_manager.get(pk=company.pk).config_version, version + 4)
+
+
+class ClientHistoryVersionTest(TestCase):
+    def test_deleting_a_message_moves_the_client_version(self):
+        """Test webhook processes see deleted messages through the client's updated_at"""
+        company = Company.objects.create(name="Test Company")
+        client = Client.objects.create(company=company, name="Айгерим")
+        message = Message.create_with_response_time("Привет", company, client)
+        before = Client.objects.get(pk=client.pk).updated_at
+
+        message.delete()
+
+        self.assertGreater(Client.objects.get(pk=client.pk).updated_at, before)
+
+
+class IntegrationHTTPPoolTest(SimpleTestCase):
+    def pool(self, handler):
+        pool = http.HTTPPool(transport=httpx.MockTransport(handler))
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_unavailable_service_is_retried_on_the_same_client(self):
+        """Test a 503 is retried and requests to a host share one pooled client"""
+        statuses = iter([503, 200, 200])
+        pool = self.pool(lambda request: httpx.Response(next(statuses), json={'result': []}))
+        destination = http.Destination(backoff=0)
+
+        self.assertEqual(pool.request('GET', 'https://crm.example/user.get', destination=destination).status_code, 200)
+        pool.request('GET', 'https://crm.example/crm.lead.list', destination=destination)
+
+        self.assertEqual(len(pool.clients), 1)
+        stats = pool.stats()['crm.example']
+        self.assertEqual((stats['requests'], stats['retries'], stats['failures'], stats['in_flight']), (3, 1, 1, 0))
+
+    def test_post_is_not_repeated_after_a_read_timeout(self):
+        """Test a request that may have reached the CRM is not sent twice"""
+        calls = []
+
+        def handler(request):
+            calls.append(request.method)
+            raise httpx.ReadTimeout('timed out', request=request)
+
+        pool = self.pool(handler)
+        with self.assertRaises(httpx.ReadTimeout):
+            pool.request('POST', 'https://crm.example/api/v4/leads', destination=http.Destination(backoff=0))
+        self.assertEqual(calls, ['POST'])
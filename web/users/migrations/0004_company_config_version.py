@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_client_telegram_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='config_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='handoff_trigger',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_company_config_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='history_token_budget',
+            field=models.PositiveIntegerField(default=1500),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_company_history_token_budget'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='summary',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='summary_message_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='summary_token_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='summary_daily_tokens',
+            field=models.PositiveIntegerField(default=20000),
+        ),
+    ]
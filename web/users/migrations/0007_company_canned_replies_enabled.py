@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_conversation_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='canned_replies_enabled',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils.translation import gettext_lazy as _
@@ -94,6 +95,29 @@ class CompanyManager(models.Manager):
         # Regular users can't see any companies
         return super().get_queryset().none()
 
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+
+def parse_time(value):
+    """Minutes since midnight of "HH:MM", 24:00 allowed (same rules as the bot's profiles.parse_hours)."""
+    hours, minutes = value.strip().split(':')
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or (hours == 24 and minutes):
+        raise ValueError(value)
+    return hours * 60 + minutes
+
+
+def validate_hours(value):
+    """Check a "HH:MM-HH:MM" working hours range; empty means closed."""
+    if not value or not value.strip():
+        return
+    try:
+        start, end = (parse_time(part) for part in value.strip().split('-'))
+    except ValueError:
+        raise ValidationError(_('Use the HH:MM-HH:MM format, e.g. 9:00-18:00 or 22:00-06:00.'))
+    if start == end:
+        raise ValidationError(_('Opening and closing time must differ; leave empty for a day off.'))
+
 class Company(models.Model):
     objects = CompanyManager()
     name = models.CharField(max_length=255, unique=True)
@@ -103,6 +127,9 @@ class Company(models.Model):
     email = models.EmailField(blank=True, null=True)
     website = models.URLField(blank=True, null=True)
     
+    # Telegram
+    telegram_token = models.CharField(max_length=100, unique=True, blank=True, null=True)
+    
     # Bot Configuration
     language = models.CharField(max_length=2, choices=[
         ('ru', 'Russian'),
@@ -140,11 +167,18 @@ class Company(models.Model):
     max_retries = models.PositiveIntegerField(default=3)
     enable_analytics = models.BooleanField(default=True)
     collect_feedback = models.BooleanField(default=True)
+    # Welcome, thanks and off-hours messages and topic refusals are sent without the LLM
+    canned_replies_enabled = models.BooleanField(default=True)
     available_languages = models.JSONField(default=list)
+    # Conversation history sent to the LLM with each message, in tokens
+    history_token_budget = models.PositiveIntegerField(default=1500)
+    # LLM tokens a day spent on summarizing old conversation turns, 0 disables
+    summary_daily_tokens = models.PositiveIntegerField(default=20000)
     
     # Topics
     allowed_topics = models.JSONField(default=list)
     restricted_topics = models.JSONField(default=list)
+    handoff_trigger = models.JSONField(default=list, blank=True)
     
     # Admin Settings
     admin_id = models.CharField(max_length=50, blank=True, null=True)
@@ -153,6 +187,9 @@ class Company(models.Model):
     email_notifications = models.BooleanField(default=True)
     admin_email = models.EmailField(blank=True, null=True)
     
+    # Bumped on every save so the bot recompiles its cached profile
+    config_version = models.PositiveIntegerField(default=0, editable=False)
+    
     class Meta:
         verbose_name = _('company')
         verbose_name_plural = _('companies')
@@ -160,11 +197,45 @@ class Company(models.Model):
     def __str__(self):
         return self.name
 
+    def clean(self):
+        # Malformed hours would make the bot treat the day as closed, reject
+        # them in every form built on the model
+        errors = {}
+        for day in WEEKDAYS:
+            field_name = f'{day}_hours'
+            try:
+                validate_hours(getattr(self, field_name))
+            except ValidationError as e:
+                errors[field_name] = e
+        if errors:
+            raise ValidationError(errors)
+
+    def save(self, *args, **kwargs):
+        self.config_version = (self.config_version or 0) + 1
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'config_version'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def bump_config_version(cls, company_id):
+        """Mark the bot configuration as changed without saving the company
+        (e.g. when its FAQs change), so caches built from it are refreshed."""
+        cls._base_manager.filter(pk=company_id).update(config_version=models.F('config_version') + 1)
+
 class Client(models.Model):
     company = models.ForeignKey('Company', on_delete=models.CASCADE, related_name='clients')
     name = models.CharField(max_length=255)
-    email = models.EmailField()
+    email = models.EmailField(blank=True, null=True)
     phone = models.CharField(max_length=20, blank=True, null=True)
+    telegram_id = models.BigIntegerField(blank=True, null=True, db_index=True)
+    username = models.CharField(max_length=255, blank=True, null=True)
+    settings = models.JSONField(default=dict, blank=True)
+    # Rolling summary of the conversation up to and including message
+    # ``summary_message_id``, maintained by the webhook's summarizer
+    summary = models.TextField(blank=True, default='', editable=False)
+    summary_message_id = models.BigIntegerField(null=True, blank=True, editable=False)
+    summary_token_count = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -175,3 +246,11 @@ class Client(models.Model):
 
     def __str__(self):
         return f"{self.name} ({self.email})"
+
+    @classmethod
+    def touch(cls, client_id):
+        """Mark the client's conversation as changed by moving ``updated_at``,
+        which the webhook's history cache compares. Returns the new value."""
+        now = timezone.now()
+        cls._base_manager.filter(pk=client_id).update(updated_at=now)
+        return now
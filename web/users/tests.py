@@ -6,7 +6,8 @@ from django.contrib.messages import get_messages
 
 from django.contrib.auth import get_user_model
 from users.models import Company
-from users.forms import UserCreationForm, UserUpdateForm
+from django.forms.models import model_to_dict
+from users.forms import CompanyForm, UserCreationForm, UserUpdateForm
 
 User = get_user_model()
 
@@ -228,3 +229,29 @@ class UserViewTest(TestCase):
         # The user should be created but not as a superuser
         user = User.objects.get(email='newadmin@company.com')
         self.assertFalse(user.is_superuser)
+
+class CompanyFormHoursTest(TestCase):
+    def setUp(self):
+        self.company = Company.objects.create(name="Hours Company")
+
+    def form(self, **changes):
+        data = model_to_dict(self.company, exclude=CompanyForm.Meta.exclude)
+        data.update(available_languages='["ru"]', allowed_topics='["услуги"]',
+                    restricted_topics='["политика"]', notification_hours='[9, 21]')
+        data.update(changes)
+        return CompanyForm(data=data, instance=self.company)
+
+    def test_valid_hours_are_accepted(self):
+        """Test regular, overnight and round-the-clock hours pass"""
+        form = self.form(monday_hours='9:00-18:00', friday_hours='22:00-06:00', saturday_hours='00:00-24:00')
+        self.assertTrue(form.is_valid(), form.errors)
+
+    def test_malformed_hours_are_rejected_at_save(self):
+        """Test bad ranges are reported on their own fields instead of at message time"""
+        form = self.form(monday_hours='9-18', tuesday_hours='25:00-26:00',
+                         wednesday_hours='10:00-10:00', thursday_hours='9:00-18:00-20:00')
+        self.assertFalse(form.is_valid())
+        self.assertEqual(
+            {field for field in form.errors if field.endswith('_hours')},
+            {'monday_hours', 'tuesday_hours', 'wednesday_hours', 'thursday_hours'},
+        )
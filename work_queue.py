@@ -0,0 +1,447 @@
+"""Durable local queue for incoming Telegram updates.
+
+The webhook only validates an update, stores it here and answers Telegram
+right away; ``QueueWorkers`` process the stored updates in the background,
+one at a time per chat and in parallel across chats.
+An update is only claimed while no earlier update of its chat is pending
+or held by another process, so a chat stays in order even when several
+processes share the queue. The queue is a SQLite file, so updates accepted before a crash or restart
+are still there afterwards:
+
+- an update is deleted only after its handler finished; a failed one is
+  retried after WORK_QUEUE_RETRY_DELAY, doubling per attempt, and the
+  chat's later updates wait for it until it succeeds or is parked as dead,
+- a claimed update is leased to the queue that claimed it for
+  WORK_QUEUE_LEASE_SECONDS, renewed while its workers run; updates whose
+  lease ran out because their process died are put back (or parked as dead
+  if they already used up their attempts, e.g. because they crash the
+  process), so several processes can share one queue file,
+- every (token, update_id) accepted is remembered for
+  WORK_QUEUE_DEDUP_WINDOW seconds, so Telegram redeliveries of an update
+  that is queued or already handled are dropped before any work is done.
+
+Delivery is at least once: a handler can run again for an update it had
+already answered when the process stopped before the ack. The bot stores
+each exchange with its update_id right after sending the reply and drops
+a retried update whose exchange exists, so only a crash between the
+Telegram send and that save sends a reply twice.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, NamedTuple, Optional
+
+from chat_scheduler import ChatScheduler
+
+logger = logging.getLogger("uvicorn")
+
+WORK_QUEUE_PATH = os.getenv("WORK_QUEUE_PATH", "work_queue.sqlite3")
+WORK_QUEUE_WORKERS = int(os.getenv("WORK_QUEUE_WORKERS", "16"))
+# Claimed updates held in memory by the scheduler at most
+WORK_QUEUE_PREFETCH = int(os.getenv("WORK_QUEUE_PREFETCH", "64"))
+WORK_QUEUE_MAX_ATTEMPTS = int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", "3"))
+WORK_QUEUE_POLL_INTERVAL = float(os.getenv("WORK_QUEUE_POLL_INTERVAL", "1.0"))
+WORK_QUEUE_SHUTDOWN_TIMEOUT = float(os.getenv("WORK_QUEUE_SHUTDOWN_TIMEOUT", "10"))
+# Delay before the first retry of a failed update, doubled for every further attempt
+WORK_QUEUE_RETRY_DELAY = float(os.getenv("WORK_QUEUE_RETRY_DELAY", "5"))
+WORK_QUEUE_RETRY_MAX_DELAY = float(os.getenv("WORK_QUEUE_RETRY_MAX_DELAY", "300"))
+# A claimed update is put back this long after its process stopped renewing the lease
+WORK_QUEUE_LEASE_SECONDS = float(os.getenv("WORK_QUEUE_LEASE_SECONDS", "30"))
+# Telegram stops redelivering an update after 24 hours
+WORK_QUEUE_DEDUP_WINDOW = float(os.getenv("WORK_QUEUE_DEDUP_WINDOW", str(24 * 3600)))
+DEDUP_PRUNE_INTERVAL = 60
+
+PENDING, PROCESSING, DEAD = "pending", "processing", "dead"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS updates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    company_token TEXT NOT NULL,
+    update_id INTEGER,
+    -- Bot token and chat id, NULL for updates not tied to a chat
+    chat TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    -- A failed update is not retried before this time
+    not_before REAL NOT NULL DEFAULT 0,
+    enqueued_at REAL NOT NULL,
+    claimed_at REAL,
+    owner TEXT,
+    lease_until REAL,
+    last_error TEXT,
+    UNIQUE (company_token, update_id)
+);
+CREATE INDEX IF NOT EXISTS updates_status_id ON updates (status, id);
+CREATE INDEX IF NOT EXISTS updates_chat_id ON updates (chat, id);
+CREATE TABLE IF NOT EXISTS seen_updates (
+    company_token TEXT NOT NULL,
+    update_id INTEGER NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (company_token, update_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS seen_updates_seen_at ON seen_updates (seen_at);
+"""
+
+
+class QueuedUpdate(NamedTuple):
+    id: int
+    company_token: str
+    payload: Dict[str, Any]
+    attempts: int
+    enqueued_at: float
+
+
+class WorkQueue:
+    """SQLite-backed FIFO of raw updates.
+
+    All SQLite calls run on one dedicated thread so the event loop never
+    waits on disk I/O. Each instance claims updates under its own ``owner``
+    id, so processes sharing the file only take over each other's updates
+    once their lease has expired.
+    """
+
+    def __init__(self, path: str = WORK_QUEUE_PATH, dedup_window: float = WORK_QUEUE_DEDUP_WINDOW,
+                 lease: float = WORK_QUEUE_LEASE_SECONDS, retry_delay: float = WORK_QUEUE_RETRY_DELAY,
+                 max_retry_delay: float = WORK_QUEUE_RETRY_MAX_DELAY):
+        self.path = path
+        self.dedup_window = dedup_window
+        self.lease = lease
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._pruned_at = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="work-queue")
+        self._conn: Optional[sqlite3.Connection] = None
+        # Set whenever something was enqueued, so idle workers wake up
+        self.available = asyncio.Event()
+        self.enqueued = 0
+        self.duplicates = 0
+        # Redeliveries dropped, by bot token
+        self.duplicates_by_token: Counter = Counter()
+        self.processed = 0
+        self.failed = 0
+
+    async def _run(self, func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _open(self) -> None:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        # WAL keeps committed updates across a process crash without a full
+        # fsync per commit; set WORK_QUEUE_SYNCHRONOUS=FULL to survive power loss too
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={os.getenv('WORK_QUEUE_SYNCHRONOUS', 'NORMAL')}")
+        conn.executescript(SCHEMA)
+        self._conn = conn
+
+    async def open(self) -> int:
+        """Open the queue file and put back updates whose process stopped without finishing them.
+
+        Returns:
+            int: Number of updates that were requeued
+        """
+        await self._run(self._open)
+        requeued = await self.requeue_expired()
+        self.available.set()
+        return requeued
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    def _requeue_expired(self, max_attempts: int) -> int:
+        expired = "status = ? AND (lease_until IS NULL OR lease_until < ?)"
+        now = time.time()
+        self._conn.execute(
+            "UPDATE updates SET status = ?, claimed_at = NULL, owner = NULL, lease_until = NULL, "
+            f"last_error = 'interrupted' WHERE {expired} AND attempts >= ?", (DEAD, PROCESSING, now, max_attempts)
+        )
+        cursor = self._conn.execute(
+            f"UPDATE updates SET status = ?, claimed_at = NULL, owner = NULL, lease_until = NULL WHERE {expired}",
+            (PENDING, PROCESSING, now),
+        )
+        return cursor.rowcount
+
+    async def requeue_expired(self, max_attempts: int = WORK_QUEUE_MAX_ATTEMPTS) -> int:
+        """Put back in-progress updates whose lease expired (their process died).
+
+        Returns:
+            int: Number of updates that were requeued
+        """
+        requeued = await self._run(self._requeue_expired, max_attempts)
+        if requeued:
+            logger.warning(f"Requeued {requeued} updates left in progress by a stopped process")
+            self.available.set()
+        return requeued
+
+    def _renew(self) -> int:
+        return self._conn.execute(
+            "UPDATE updates SET lease_until = ? WHERE status = ? AND owner = ?",
+            (time.time() + self.lease, PROCESSING, self.owner),
+        ).rowcount
+
+    async def renew(self) -> int:
+        """Extend the lease of every update this queue is processing."""
+        return await self._run(self._renew)
+
+    def _release(self) -> int:
+        return self._conn.execute(
+            "UPDATE updates SET status = ?, claimed_at = NULL, owner = NULL, lease_until = NULL "
+            "WHERE status = ? AND owner = ?", (PENDING, PROCESSING, self.owner),
+        ).rowcount
+
+    async def release(self) -> int:
+        """Put back the updates this queue claimed but did not finish (on shutdown)."""
+        return await self._run(self._release)
+
+    def _put_back(self, ids: List[int]) -> int:
+        return self._conn.executemany(
+            "UPDATE updates SET status = ?, claimed_at = NULL, owner = NULL, lease_until = NULL, "
+            "attempts = attempts - 1 WHERE id = ? AND status = ? AND owner = ?",
+            [(PENDING, queue_id, PROCESSING, self.owner) for queue_id in ids],
+        ).rowcount
+
+    async def put_back(self, updates: List[QueuedUpdate]) -> int:
+        """Return claimed updates that were never started, without counting an attempt."""
+        return await self._run(self._put_back, [update.id for update in updates])
+
+    def _enqueue(self, company_token: str, payload: Dict[str, Any]) -> Optional[int]:
+        now = time.time()
+        update_id = payload.get("update_id")
+        # Marking the update as seen and queueing it commit together, so a
+        # crash cannot leave an update marked seen but never queued
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            if update_id is not None:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO seen_updates (company_token, update_id, seen_at) VALUES (?, ?, ?)",
+                    (company_token, update_id, now),
+                )
+                if not cursor.rowcount:
+                    self._conn.execute("COMMIT")
+                    return None
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO updates (company_token, update_id, chat, payload, enqueued_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (company_token, update_id, _chat(company_token, payload),
+                 json.dumps(payload, ensure_ascii=False), now),
+            )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        if now - self._pruned_at >= DEDUP_PRUNE_INTERVAL:
+            self._prune_seen(now)
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def _prune_seen(self, now: float) -> None:
+        self._conn.execute("DELETE FROM seen_updates WHERE seen_at < ?", (now - self.dedup_window,))
+        self._pruned_at = now
+
+    async def enqueue(self, company_token: str, payload: Dict[str, Any]) -> Optional[int]:
+        """Persist an update.
+
+        Returns:
+            Its queue id, or None if the update was already seen (a redelivery)
+        """
+        queue_id = await self._run(self._enqueue, company_token, payload)
+        if queue_id is None:
+            self.duplicates += 1
+            self.duplicates_by_token[company_token] += 1
+        else:
+            self.enqueued += 1
+            self.available.set()
+        return queue_id
+
+    def _claim(self, limit: int) -> List[QueuedUpdate]:
+        now = time.time()
+        # A chat's next update waits while an earlier one is pending or held by
+        # another process; ones this queue holds are ordered by its scheduler
+        rows = self._conn.execute(
+            "UPDATE updates SET status = ?, claimed_at = ?, owner = ?, lease_until = ?, attempts = attempts + 1 "
+            "WHERE id IN (SELECT id FROM updates AS u WHERE status = ? AND not_before <= ? "
+            "AND (chat IS NULL OR NOT EXISTS ("
+            "SELECT 1 FROM updates AS e WHERE e.chat = u.chat AND e.id < u.id AND e.status != ? "
+            "AND NOT (e.status = ? AND e.owner = ?))) ORDER BY id LIMIT ?) "
+            "RETURNING id, company_token, payload, attempts, enqueued_at",
+            (PROCESSING, now, self.owner, now + self.lease, PENDING, now, DEAD, PROCESSING, self.owner, limit),
+        ).fetchall()
+        # RETURNING does not guarantee an order
+        rows.sort()
+        return [QueuedUpdate(row[0], row[1], json.loads(row[2]), row[3], row[4]) for row in rows]
+
+    async def claim_many(self, limit: int) -> List[QueuedUpdate]:
+        """Take up to ``limit`` of the oldest claimable pending updates, oldest first.
+
+        Of a chat whose earlier updates are still pending only the first is
+        taken; the next one follows on a later claim once this queue holds it.
+        """
+        return await self._run(self._claim, limit)
+
+    async def claim(self) -> Optional[QueuedUpdate]:
+        """Take the oldest pending update, or None when the queue is empty."""
+        updates = await self.claim_many(1)
+        return updates[0] if updates else None
+
+    def _ack(self, queue_id: int) -> None:
+        self._conn.execute("DELETE FROM updates WHERE id = ?", (queue_id,))
+
+    async def ack(self, queue_id: int) -> None:
+        """Remove a processed update."""
+        await self._run(self._ack, queue_id)
+        self.processed += 1
+
+    def _fail(self, update: QueuedUpdate, error: str, max_attempts: int) -> str:
+        status = DEAD if update.attempts >= max_attempts else PENDING
+        delay = min(self.retry_delay * 2 ** (update.attempts - 1), self.max_retry_delay)
+        self._conn.execute(
+            "UPDATE updates SET status = ?, claimed_at = NULL, owner = NULL, lease_until = NULL, "
+            "not_before = ?, last_error = ? WHERE id = ?", (status, time.time() + delay, error, update.id),
+        )
+        return status
+
+    async def fail(self, update: QueuedUpdate, error: str, max_attempts: int = WORK_QUEUE_MAX_ATTEMPTS) -> str:
+        """Return a failed update to the queue for a delayed retry, or park it as dead after ``max_attempts``.
+
+        Until the retry the chat's later updates are not claimed.
+        """
+        self.failed += 1
+        return await self._run(self._fail, update, error, max_attempts)
+
+    def _stats(self) -> Dict[str, Any]:
+        counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM updates GROUP BY status").fetchall())
+        oldest = self._conn.execute(
+            "SELECT MIN(enqueued_at) FROM updates WHERE status != ?", (DEAD,)
+        ).fetchone()[0]
+        return {
+            "depth": counts.get(PENDING, 0) + counts.get(PROCESSING, 0),
+            "pending": counts.get(PENDING, 0),
+            "processing": counts.get(PROCESSING, 0),
+            "dead": counts.get(DEAD, 0),
+            "oldest_age_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+        }
+
+    async def stats(self) -> Dict[str, Any]:
+        """Queue depth and age of the oldest unfinished update, plus counters."""
+        stats = await self._run(self._stats)
+        stats.update({
+            "enqueued": self.enqueued,
+            "duplicates": self.duplicates,
+            "processed": self.processed,
+            "failed": self.failed,
+        })
+        return stats
+
+
+def _chat_id(payload: Dict[str, Any]) -> Optional[int]:
+    for field in ("message", "edited_message"):
+        if field in payload:
+            return payload[field]["chat"]["id"]
+    message = (payload.get("callback_query") or {}).get("message")
+    return message["chat"]["id"] if message else None
+
+
+def _chat(company_token: str, payload: Dict[str, Any]) -> Optional[str]:
+    chat_id = _chat_id(payload)
+    return None if chat_id is None else f"{company_token}:{chat_id}"
+
+
+def chat_key(update: QueuedUpdate) -> Hashable:
+    """Scheduling key of an update: its bot and chat, so a chat is handled in order."""
+    chat_id = _chat_id(update.payload)
+    if chat_id is None:
+        # Not tied to a chat, nothing to keep in order with
+        return update.company_token, None, update.id
+    return update.company_token, chat_id
+
+
+class QueueWorkers:
+    """Processes queued updates with ``handler``, in order per chat.
+
+    One dispatcher claims updates oldest first and hands them to a
+    ``ChatScheduler`` keyed by ``key`` (bot and chat by default), so two
+    quick messages from one chat never race while different chats run in
+    parallel, up to ``concurrency`` at a time.
+    """
+
+    def __init__(self, queue: WorkQueue, handler: Callable[[QueuedUpdate], Awaitable[Any]],
+                 concurrency: int = WORK_QUEUE_WORKERS, poll_interval: float = WORK_QUEUE_POLL_INTERVAL,
+                 prefetch: int = WORK_QUEUE_PREFETCH, key: Callable[[QueuedUpdate], Hashable] = chat_key):
+        self.queue = queue
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self.prefetch = max(prefetch, concurrency)
+        self.key = key
+        self.scheduler = ChatScheduler(self._process, concurrency=concurrency)
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def start(self) -> None:
+        self._stopping = False
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self, timeout: float = WORK_QUEUE_SHUTDOWN_TIMEOUT) -> None:
+        """Let claimed updates finish for up to ``timeout`` seconds, then cancel.
+
+        Cancelled updates are put back in the queue for the next run (or
+        another process sharing it).
+        """
+        self._stopping = True
+        self.queue.available.set()
+        if self._dispatcher is not None:
+            await self._dispatcher
+            self._dispatcher = None
+        if not await self.scheduler.drain(timeout):
+            logger.warning(f"Cancelling {self.scheduler.pending} queued updates still in progress")
+        await self.scheduler.close()
+        if released := await self.queue.release():
+            logger.warning(f"Put back {released} unfinished updates")
+
+    def stats(self) -> Dict[str, int]:
+        return self.scheduler.stats()
+
+    async def _dispatch(self) -> None:
+        # Leases are renewed well before they run out, expired ones of other processes taken over
+        maintain_every = self.queue.lease / 3
+        maintained_at = time.monotonic()
+        while not self._stopping:
+            if time.monotonic() - maintained_at >= maintain_every:
+                maintained_at = time.monotonic()
+                await self.queue.renew()
+                await self.queue.requeue_expired()
+            free = self.prefetch - self.scheduler.pending
+            if free <= 0:
+                await self.scheduler.wait_for_progress(self.poll_interval)
+                continue
+            # Clear before claiming so an enqueue right after an empty claim still wakes us
+            self.queue.available.clear()
+            updates = await self.queue.claim_many(free)
+            if not updates:
+                try:
+                    await asyncio.wait_for(self.queue.available.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            for update in updates:
+                self.scheduler.submit(self.key(update), update)
+
+    async def _process(self, update: QueuedUpdate) -> None:
+        try:
+            await self.handler(update)
+        except Exception as e:
+            status = await self.queue.fail(update, repr(e))
+            logger.error(f"Error processing queued update {update.id} (attempt {update.attempts}, now {status}): {e}")
+            # The chat's later updates, already claimed, wait for the retry
+            if status == PENDING and (waiting := self.scheduler.take_waiting(self.key(update))):
+                await self.queue.put_back(waiting)
+        else:
+            await self.queue.ack(update.id)